@@ -1,7 +1,39 @@
+import io
+import os
+import sys
+import json
+import pickle
+import queue
+import math
+import mmap
 import time
+import heapq
+import asyncio
+import bisect
+import multiprocessing
+import gc
+import argparse
 import random
+import selectors
+import socket
+import struct
+import zlib
+import functools
+import itertools
+import cProfile
+import pstats
+import tracemalloc
+from array import array
+from collections import OrderedDict, deque
 from datetime import datetime
-from typing import Dict, List, Optional
+from enum import IntEnum
+from typing import (Any, Awaitable, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional,
+                    Sequence, Tuple)
+
+try:
+    import resource  # Unix only; used for max-RSS in benchmark reports
+except ImportError:
+    resource = None
 
 # ========== ANSI COLOR CODES ==========
 class Colors:
@@ -15,79 +47,1453 @@ class Colors:
     UNDERLINE = '\033[4m'
     END = '\033[0m'
 
+# ========== SIMULATION CLOCK & EVENT ENGINE ==========
+class SimClock:
+    """Simulated network clock, optionally paced against real time"""
+    def __init__(self, realtime: bool = False, start: Optional[float] = None):
+        self.realtime = realtime  # True = interactive mode (real sleeps)
+        self._now = time.time() if start is None else start
+
+    def now(self) -> float:
+        """Current simulated time in seconds since the epoch"""
+        return self._now
+
+    def sleep(self, seconds: float):
+        """Advance simulated time; only blocks for real in interactive mode"""
+        if seconds <= 0:
+            return
+        if self.realtime:
+            time.sleep(seconds)
+        self._now += seconds
+
+    def advance_to(self, when: float):
+        """Jump forward to an absolute simulated time (never backwards)"""
+        self.sleep(when - self._now)
+
+    def sync(self, when: float):
+        """Move forward without pacing, for engines that keep their own time"""
+        if when > self._now:
+            self._now = when
+
+class EventScheduler:
+    """Discrete-event engine: a priority queue of timestamped callbacks"""
+    def __init__(self, clock: SimClock):
+        self.clock = clock
+        self._queue: List[tuple] = []
+        self._sequence = itertools.count()  # FIFO tie-break for equal times
+        self.events_processed = 0
+
+    def schedule(self, delay: float, callback: Callable, *args):
+        """Run callback(*args) after `delay` simulated seconds"""
+        self.schedule_at(self.clock.now() + delay, callback, *args)
+
+    def schedule_at(self, when: float, callback: Callable, *args):
+        """Run callback(*args) at an absolute simulated time"""
+        heapq.heappush(self._queue, (when, next(self._sequence), callback, args))
+
+    def run(self, until: Optional[float] = None) -> int:
+        """Process events in time order; returns number of events handled"""
+        processed = 0
+        queue = self._queue
+        while queue:
+            if until is not None and queue[0][0] > until:
+                break
+            when, _, callback, args = heapq.heappop(queue)
+            # Handlers may advance the clock themselves (busy pipeline), in
+            # which case later events start late - that is queueing delay.
+            self.clock.advance_to(when)
+            callback(*args)
+            processed += 1
+        if until is not None:
+            self.clock.advance_to(until)
+        self.events_processed += processed
+        return processed
+
+class _ClockSelector(selectors.DefaultSelector):
+    """Selector for SimEventLoop: a timeout advances the clock, never blocks"""
+    def __init__(self, clock: SimClock):
+        super().__init__()
+        self.clock = clock
+
+    def select(self, timeout: Optional[float] = None):
+        if timeout is None or timeout <= 0:
+            return super().select(timeout)
+        events = super().select(0)
+        if not events:
+            self.clock.sleep(timeout)  # Paced only if the clock is realtime
+        return events
+
+class SimEventLoop(asyncio.SelectorEventLoop):
+    """asyncio event loop whose time is a SimClock
+    
+    loop.time() is the clock's time. Whenever every task is waiting, the
+    loop jumps the clock to the next timer instead of blocking, so
+    asyncio.sleep(seconds) takes modeled seconds, requests overlap, and
+    host CPU time never shows up as modeled latency.
+    """
+    def __init__(self, clock: SimClock):
+        super().__init__(_ClockSelector(clock))
+        self.clock = clock
+        self._clock_resolution = 1e-6  # Epoch-sized float times are coarser than monotonic
+
+    def time(self) -> float:
+        return self.clock.now()
+
+def run_simulated(main: Awaitable, clock: SimClock) -> Any:
+    """asyncio.run() for the simulator: run `main` on a new SimEventLoop over `clock`"""
+    loop = SimEventLoop(clock)
+    try:
+        return loop.run_until_complete(main)
+    finally:
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # itertools.count is not picklable on every Python; keep its position
+        state = self.__dict__.copy()
+        state["_sequence"] = next(self._sequence)
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]):
+        self.__dict__.update(state)
+        self._sequence = itertools.count(state["_sequence"])
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+# ========== EVENT OUTPUT LAYER ==========
+class Level(IntEnum):
+    """Event severities (same values as the logging module)"""
+    DEBUG = 10
+    INFO = 20
+    WARNING = 30
+    ERROR = 40
+
+_SILENT = 1 << 30  # Threshold for a bus with no sinks: every emit() returns at once
+
+class Event(NamedTuple):
+    """One structured event; `fields` are rendered only by sinks that want them"""
+    timestamp: float
+    level: int
+    name: str              # Dotted kind, e.g. "dns.resolved"
+    fields: Dict[str, Any]
+
+# Console rendering, keyed by event name. Formatted lazily with str.format, with
+# `c` bound to Colors (or to blanks when color is off). Events without a
+# template are structured-only and never reach the terminal.
+CONSOLE_TEMPLATES: Dict[str, str] = {
+    "router.server_added": "{c.CYAN}[{router}] Added {server} ({ip}) to routing table{c.END}",
+    "router.servers_added": "{c.CYAN}[{router}] Added {count} servers to routing table{c.END}",
+    "router.pool_added": ("{c.CYAN}[{router}] Added pool {pool} ({ip}, {members} servers, "
+                          "{balancer}) to routing table{c.END}"),
+    "route.start": ("\n{c.YELLOW}══════════════════════════════════════════════════════════{c.END}\n"
+                    "{c.BLUE}[{router}] Processing request for: {destination}{c.END}"),
+    "dns.resolving": "{c.CYAN}[DNS] Resolving '{domain}'...{c.END}",
+    "dns.nxdomain": "{c.RED}[DNS] NXDOMAIN: '{domain}' not found{c.END}",
+    "dns.cache_hit": "{c.YELLOW}[DNS] Cache hit for '{domain}'{c.END}",
+    "dns.resolved": "{c.GREEN}[DNS] Resolved '{domain}' → {ip}{c.END}",
+    "packet.created": "{packet}",
+    "firewall.inspecting": "{c.YELLOW}[FIREWALL] Inspecting packet...{c.END}",
+    "routing.lookup": "{c.CYAN}[ROUTING] Checking routing table for {ip}...{c.END}",
+    "server.processing": "{c.GREEN}[SERVER] {server} processing request...{c.END}",
+    "cache.hit": "{c.GREEN}[CACHE] Served from edge cache (saved {saved_ms:.2f}ms){c.END}",
+    "pool.member_down": ("{c.RED}[POOL] {pool}: health check failed, {server} out of rotation "
+                         "({healthy}/{members} healthy){c.END}"),
+    "pool.member_up": ("{c.GREEN}[POOL] {pool}: {server} passed health checks, back in rotation "
+                       "({healthy}/{members} healthy){c.END}"),
+    "route.complete": ("{c.YELLOW}[STATS] Latency: {latency_ms:.2f}ms | "
+                       "Packets routed: {routed}{c.END}"),
+}
+
+class _NoColors:
+    """Stand-in for Colors with every code blank"""
+    def __getattr__(self, name: str) -> str:
+        return ""
+
+class EventSink:
+    """Destination for events; `level` filters what it receives"""
+    level = Level.DEBUG
+
+    def handle(self, event: Event):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+class NullEventSink(EventSink):
+    """Discards everything (an empty EventBus is cheaper still)"""
+    level = _SILENT
+
+    def handle(self, event: Event):
+        pass
+
+class ConsoleEventSink(EventSink):
+    """The classic colored terminal output"""
+    def __init__(self, level: int = Level.INFO, color: bool = True, stream=None,
+                 templates: Optional[Dict[str, str]] = None):
+        self.level = level
+        self.colors = Colors if color else _NoColors()
+        self.stream = stream  # None = sys.stdout at write time (so redirection works)
+        self.templates = CONSOLE_TEMPLATES if templates is None else templates
+
+    def handle(self, event: Event):
+        template = self.templates.get(event.name)
+        if template is not None and event.level >= self.level:
+            print(template.format(c=self.colors, **event.fields), file=self.stream)
+
+class JSONLinesEventSink(EventSink):
+    """Buffered JSON-lines writer: events are serialized and written in batches"""
+    def __init__(self, path: str, level: int = Level.DEBUG, flush_every: int = 1000):
+        self.path = path
+        self.level = level
+        self.flush_every = flush_every
+        self._pending: List[Event] = []
+
+    def handle(self, event: Event):
+        if event.level >= self.level:
+            self._pending.append(event)
+            if len(self._pending) >= self.flush_every:
+                self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        lines = []
+        for event in self._pending:
+            record = {"ts": event.timestamp, "level": Level(event.level).name, "event": event.name}
+            record.update(event.fields)
+            lines.append(json.dumps(record, default=self._encode, ensure_ascii=False))
+        self._pending.clear()
+        with open(self.path, "a", encoding="utf-8") as handle:
+            handle.write("\n".join(lines) + "\n")
+
+    @staticmethod
+    def _encode(value: Any) -> Any:
+        to_dict = getattr(value, "to_dict", None)
+        return to_dict() if to_dict is not None else str(value)
+
+class EventBus:
+    """Routes events from components to sinks
+    
+    emit() compares the level against the lowest sink level before doing
+    anything else, so with no sinks (quiet mode) or only high-level sinks a
+    disabled event costs one call and one comparison; no strings are
+    formatted until a sink actually renders the event.
+    """
+    def __init__(self, *sinks: EventSink, clock: Optional[SimClock] = None):
+        self.clock = clock
+        self.sinks: List[EventSink] = []
+        self._threshold = _SILENT
+        for sink in sinks:
+            self.add_sink(sink)
+
+    def add_sink(self, sink: EventSink) -> EventSink:
+        self.sinks.append(sink)
+        self._threshold = min(s.level for s in self.sinks)
+        return sink
+
+    def remove_sink(self, sink: EventSink):
+        self.sinks.remove(sink)
+        self._threshold = min((s.level for s in self.sinks), default=_SILENT)
+
+    def enabled(self, level: int) -> bool:
+        """True if some sink wants events at `level` (guard for costly fields)"""
+        return level >= self._threshold
+
+    def emit(self, level: int, name: str, **fields):
+        if level < self._threshold:
+            return
+        event = Event(self.clock.now() if self.clock else time.time(), level, name, fields)
+        for sink in self.sinks:
+            sink.handle(event)
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.flush()
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+# ========== IP ADDRESSING & PREFIX TRIE ==========
+ALLOW = "allow"
+DENY = "deny"
+
+_unpack_ipv4 = struct.Struct("!I").unpack
+
+def parse_ipv4(ip: str) -> Optional[int]:
+    """Convert strict dotted-quad IPv4 to a 32-bit integer (None if malformed)"""
+    try:
+        return _unpack_ipv4(socket.inet_pton(socket.AF_INET, ip))[0]
+    except OSError:
+        return None
+
+# Cached variant for the packet path, where the same addresses repeat
+ip_to_int = functools.lru_cache(maxsize=65536)(parse_ipv4)
+
+def int_to_ip(value: int) -> str:
+    """Convert a 32-bit integer back to dotted-quad notation"""
+    return socket.inet_ntoa(value.to_bytes(4, "big"))
+
+def parse_cidr(cidr: str) -> Tuple[int, int]:
+    """Parse 'a.b.c.d/len' (or a bare address) into (network, prefix length)"""
+    address, _, length = cidr.strip().partition("/")
+    network = parse_ipv4(address)
+    prefix_len = int(length) if length else 32
+    if network is None or not 0 <= prefix_len <= 32:
+        raise ValueError(f"Invalid CIDR block: {cidr!r}")
+    mask = (0xFFFFFFFF << (32 - prefix_len)) & 0xFFFFFFFF
+    return network & mask, prefix_len
+
+class PrefixTrie:
+    """Binary radix trie of IPv4 prefixes with longest-prefix-match lookup
+    
+    Child links live in flat integer arrays (node 0 is the root, 0 means
+    "no child"), so hundreds of thousands of prefixes stay compact and every
+    lookup walks at most 32 nodes regardless of table size.
+    """
+    def __init__(self):
+        self._zero = array("i", [0])
+        self._one = array("i", [0])
+        self._values: List[Any] = [None]
+        self._size = 0
+
+    def insert(self, cidr: str, value: Any):
+        """Add or replace the value stored for a CIDR block"""
+        network, prefix_len = parse_cidr(cidr)
+        node = self._walk(network, prefix_len, create=True)
+        if self._values[node] is None:
+            self._size += 1
+        self._values[node] = value
+
+    def remove(self, cidr: str) -> bool:
+        """Remove a CIDR block; returns False if it was not present"""
+        network, prefix_len = parse_cidr(cidr)
+        node = self._walk(network, prefix_len, create=False)
+        if node < 0 or self._values[node] is None:
+            return False
+        self._values[node] = None
+        self._size -= 1
+        return True
+
+    def get(self, cidr: str) -> Any:
+        """Exact-match lookup of a CIDR block"""
+        network, prefix_len = parse_cidr(cidr)
+        node = self._walk(network, prefix_len, create=False)
+        return None if node < 0 else self._values[node]
+
+    def lookup(self, ip: int) -> Any:
+        """Longest-prefix match for an integer address (None if unmatched)"""
+        zero, one, values = self._zero, self._one, self._values
+        node = 0
+        best = values[0]
+        for shift in range(31, -1, -1):
+            node = one[node] if (ip >> shift) & 1 else zero[node]
+            if not node:
+                break
+            if values[node] is not None:
+                best = values[node]
+        return best
+
+    def items(self):
+        """Yield (cidr, value) for every stored prefix"""
+        stack = [(0, 0, 0)]  # (node, network bits, depth)
+        while stack:
+            node, bits, depth = stack.pop()
+            if self._values[node] is not None:
+                network = bits << (32 - depth) if depth else 0
+                yield f"{int_to_ip(network)}/{depth}", self._values[node]
+            if self._one[node]:
+                stack.append((self._one[node], (bits << 1) | 1, depth + 1))
+            if self._zero[node]:
+                stack.append((self._zero[node], bits << 1, depth + 1))
+
+    def _walk(self, network: int, prefix_len: int, create: bool) -> int:
+        zero, one = self._zero, self._one
+        node = 0
+        for depth in range(prefix_len):
+            links = one if (network >> (31 - depth)) & 1 else zero
+            child = links[node]
+            if not child:
+                if not create:
+                    return -1
+                child = len(zero)
+                zero.append(0)
+                one.append(0)
+                self._values.append(None)
+                links[node] = child
+            node = child
+        return node
+
+    def __len__(self) -> int:
+        return self._size
+
+# Source networks that medium/high security servers refuse
+RESTRICTED_NETWORKS = PrefixTrie()
+RESTRICTED_NETWORKS.insert("192.168.2.0/24", DENY)
+
+# ========== PACKET HISTORY (RING BUFFER) ==========
+class Protocol(IntEnum):
+    """Compact protocol codes used in columnar storage"""
+    HTTP = 0
+    HTTPS = 1
+    FTP = 2
+    SMTP = 3
+    DNS = 4
+    OTHER = 255
+
+PROTOCOL_CODES: Dict[str, int] = {p.name: int(p) for p in Protocol}
+PROTOCOL_NAMES: Dict[int, str] = {int(p): p.name for p in Protocol}
+_OTHER_PROTOCOL = int(Protocol.OTHER)  # Plain int: enum attribute access is slow
+
+def protocol_code(name: str) -> int:
+    """Map a protocol name to its small integer code
+    
+    A name outside Protocol gets the next free code on first use, so logs
+    and traces keep the original name ("ICMP", not "OTHER"). OTHER is only
+    used once all the one-byte codes are taken.
+    """
+    code = PROTOCOL_CODES.get(name)
+    if code is None:
+        code = len(PROTOCOL_CODES) - 1  # Codes 0..n-1 in use, plus OTHER
+        if code >= _OTHER_PROTOCOL:
+            return _OTHER_PROTOCOL
+        PROTOCOL_CODES[name] = code
+        PROTOCOL_NAMES[code] = name
+    return code
+
+def register_protocols(names: Dict[int, str]):
+    """Adopt protocol codes assigned by another process (traces, snapshots)"""
+    for code, name in names.items():
+        if code not in PROTOCOL_NAMES and name not in PROTOCOL_CODES:
+            PROTOCOL_CODES[name] = code
+            PROTOCOL_NAMES[code] = name
+
+class PacketRecord(NamedTuple):
+    """One materialized row of a PacketLog"""
+    timestamp: float
+    source_ip: str
+    destination_ip: str
+    protocol: str
+    status: int
+
+class PacketLog:
+    """Fixed-capacity ring buffer of packet records stored as columns
+    
+    Addresses, protocol codes, timestamps and status codes live in typed
+    arrays allocated once up front, so memory stays flat no matter how long
+    the simulation runs; the oldest records are overwritten first. Records
+    are expected in non-decreasing timestamp order (the simulation clock
+    never goes backwards), which lets window queries binary search.
+    """
+    def __init__(self, capacity: int = 65536):
+        if capacity <= 0:
+            raise ValueError("PacketLog capacity must be positive")
+        self.capacity = capacity
+        self.sources = array("I", bytes(4 * capacity))
+        self.destinations = array("I", bytes(4 * capacity))
+        self.protocols = array("B", bytes(capacity))
+        self.timestamps = array("d", bytes(8 * capacity))
+        self.statuses = array("h", bytes(2 * capacity))
+        self._start = 0        # Physical index of the oldest record
+        self._count = 0
+        self.total_appended = 0
+
+    def append(self, source: int, destination: int, protocol: int,
+               timestamp: float, status: int = 0):
+        """Store one record, overwriting the oldest when full"""
+        capacity = self.capacity
+        if self._count < capacity:
+            slot = (self._start + self._count) % capacity
+            self._count += 1
+        else:
+            slot = self._start
+            self._start = (slot + 1) % capacity
+        self.sources[slot] = source
+        self.destinations[slot] = destination
+        self.protocols[slot] = protocol
+        self.timestamps[slot] = timestamp
+        self.statuses[slot] = status
+        self.total_appended += 1
+
+    def extend(self, sources: "array[int]", destinations: "array[int]",
+               protocols: "array[int]", timestamps: "array[float]",
+               statuses: "array[int]"):
+        """Store whole columns of records at once with slice copies
+        
+        Columns must be arrays of the log's own typecodes ("I", "I", "B",
+        "d", "h"); when they hold more than `capacity` records only the
+        newest are kept, exactly as with repeated append().
+        """
+        capacity = self.capacity
+        total = len(sources)
+        first = max(0, total - capacity)
+        count = total - first
+        slot = (self._start + self._count) % capacity  # Where the next record goes
+        overwritten = max(0, self._count + count - capacity)
+        self._start = (self._start + overwritten) % capacity
+        self._count = min(capacity, self._count + count)
+        self.total_appended += total
+        head = min(count, capacity - slot)  # Records that fit before wrapping
+        for column, values in ((self.sources, sources), (self.destinations, destinations),
+                               (self.protocols, protocols), (self.timestamps, timestamps),
+                               (self.statuses, statuses)):
+            column[slot:slot + head] = values[first:first + head]
+            column[:count - head] = values[first + head:total]
+
+    def record(self, packet: "Packet", timestamp: float, status: int = 0):
+        """Store a Packet's addresses and protocol (malformed addresses as 0)"""
+        source, destination = packet.source, packet.destination
+        self.append(source if type(source) is int else 0,
+                    destination if type(destination) is int else 0,
+                    packet.protocol_code, timestamp, status)
+
+    def trim_before(self, timestamp: float) -> int:
+        """Drop records older than timestamp (time-based retention)"""
+        dropped = self._lower_bound(timestamp)
+        self._start = (self._start + dropped) % self.capacity
+        self._count -= dropped
+        return dropped
+
+    def count_in_window(self, start: float, end: Optional[float] = None,
+                        source: Optional[int] = None) -> int:
+        """Count records with start <= timestamp < end, optionally for one source"""
+        first = self._lower_bound(start)
+        last = self._count if end is None else self._lower_bound(end)
+        if source is None:
+            return max(0, last - first)
+        sources, capacity, offset = self.sources, self.capacity, self._start
+        return sum(1 for i in range(first, last) if sources[(offset + i) % capacity] == source)
+
+    def last_n_for_source(self, source: int, n: int) -> List[PacketRecord]:
+        """Most recent n records from source, newest first"""
+        found = []
+        sources, capacity, offset = self.sources, self.capacity, self._start
+        for i in range(self._count - 1, -1, -1):
+            if len(found) >= n:
+                break
+            slot = (offset + i) % capacity
+            if sources[slot] == source:
+                found.append(self._materialize(slot))
+        return found
+
+    def records(self):
+        """Yield every retained record, oldest first"""
+        for i in range(self._count):
+            yield self._materialize((self._start + i) % self.capacity)
+
+    def clear(self):
+        self._start = 0
+        self._count = 0
+
+    def _materialize(self, slot: int) -> PacketRecord:
+        code = self.protocols[slot]
+        protocol = PROTOCOL_NAMES.get(code, str(code))
+        return PacketRecord(self.timestamps[slot], int_to_ip(self.sources[slot]),
+                            int_to_ip(self.destinations[slot]), protocol, self.statuses[slot])
+
+    def _lower_bound(self, timestamp: float) -> int:
+        """Logical index of the first record with timestamp >= given time"""
+        timestamps, capacity, offset = self.timestamps, self.capacity, self._start
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if timestamps[(offset + middle) % capacity] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def __len__(self) -> int:
+        return self._count
+
+# ========== PACKET TRACES (CAPTURE & REPLAY) ==========
+class TraceRecord(NamedTuple):
+    """One materialized trace entry (for inspection; replay does not build these)"""
+    timestamp: float
+    source_ip: str
+    destination: str           # As requested: domain name or IP literal
+    ip_address: Optional[str]  # After DNS; None if resolution failed
+    protocol: str
+    status: int
+    reason: str
+
+class TraceFormat:
+    """Binary trace layout
+    
+    A 32-byte header, then fixed-width 26-byte little-endian records, then a
+    JSON footer holding the string tables. Records reference requested
+    destinations and outcome reasons by index, so the per-packet part stays
+    fixed-width and can be memory-mapped and sliced without parsing.
+    
+        header: magic, version, record size, reserved, record count, footer offset
+        record: timestamp (f64), source (u32), resolved destination (u32),
+                destination name index (u32), status (i16), reason index (u16),
+                protocol code (u8), pad
+    """
+    MAGIC = b"PGTRACE\x01"
+    VERSION = 1
+    HEADER = struct.Struct("<8sHHIQQ")
+    RECORD = struct.Struct("<dIIIhHBx")
+
+class TraceWriter:
+    """Streams request outcomes to a binary trace file
+    
+    Records are buffered and written in blocks; the string tables and the
+    final record count are written by close(), so always close the writer
+    (it is a context manager).
+    """
+    def __init__(self, path: str, flush_every: int = 4096):
+        self.path = path
+        self.flush_every = flush_every
+        self.names: Dict[str, int] = {}
+        self.reasons: Dict[str, int] = {}
+        self.count = 0
+        self._pending: List[bytes] = []
+        self._pack = TraceFormat.RECORD.pack
+        self._file = open(path, "wb")
+        self._file.write(TraceFormat.HEADER.pack(TraceFormat.MAGIC, TraceFormat.VERSION,
+                                                 TraceFormat.RECORD.size, 0, 0, 0))
+
+    def write(self, timestamp: float, source: int, ip_address: Optional[str], destination: str,
+              protocol: int, status: int, reason: str):
+        """Append one request outcome"""
+        name = self.names.get(destination)
+        if name is None:
+            name = self.names[destination] = len(self.names)
+        code = self.reasons.get(reason)
+        if code is None:
+            code = self.reasons[reason] = len(self.reasons)
+        resolved = ip_to_int(ip_address) if ip_address else 0
+        self._pending.append(self._pack(timestamp, source, resolved or 0, name, status, code, protocol))
+        self.count += 1
+        if len(self._pending) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            self._file.write(b"".join(self._pending))
+            self._pending.clear()
+
+    def close(self):
+        """Write the string tables and finalize the header"""
+        if self._file.closed:
+            return
+        self.flush()
+        footer_offset = self._file.tell()
+        self._file.write(json.dumps({"names": list(self.names),
+                                     "reasons": list(self.reasons),
+                                     "protocols": PROTOCOL_NAMES}).encode("utf-8"))
+        self._file.seek(0)
+        self._file.write(TraceFormat.HEADER.pack(TraceFormat.MAGIC, TraceFormat.VERSION,
+                                                 TraceFormat.RECORD.size, 0, self.count,
+                                                 footer_offset))
+        self._file.close()
+
+    def __enter__(self) -> "TraceWriter":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+class TraceReader:
+    """Memory-mapped view of a trace file
+    
+    requests() streams (destination, protocol, source) tuples chunk by chunk
+    from the mapping, reusing the string-table objects, so a multi-gigabyte
+    trace replays in constant memory.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        header = self._file.read(TraceFormat.HEADER.size)
+        if len(header) < TraceFormat.HEADER.size:
+            raise ValueError(f"{path}: not a trace file (too short)")
+        magic, version, record_size, _, count, footer_offset = TraceFormat.HEADER.unpack(header)
+        if magic != TraceFormat.MAGIC or version != TraceFormat.VERSION:
+            raise ValueError(f"{path}: not a version {TraceFormat.VERSION} trace file")
+        if record_size != TraceFormat.RECORD.size:
+            raise ValueError(f"{path}: unexpected record size {record_size}")
+        if not footer_offset:
+            raise ValueError(f"{path}: trace was not closed (missing string tables)")
+        self.count = count
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        footer = json.loads(self._map[footer_offset:].decode("utf-8"))
+        self.names: List[str] = footer["names"]
+        self.reasons: List[str] = footer["reasons"]
+        # Codes of non-standard protocols as the writing process assigned them
+        self.protocols: Dict[int, str] = {int(p): p.name for p in Protocol}
+        self.protocols.update((int(code), name)
+                              for code, name in footer.get("protocols", {}).items())
+
+    def _chunks(self, chunk_size: int) -> Iterator[bytes]:
+        """The record area, chunk_size records at a time (one bounded copy each;
+        no memoryview exports are held, so the reader can close at any point)"""
+        start = TraceFormat.HEADER.size
+        end = start + self.count * TraceFormat.RECORD.size
+        step = chunk_size * TraceFormat.RECORD.size
+        for offset in range(start, end, step):
+            yield self._map[offset:min(offset + step, end)]
+
+    def requests(self, chunk_size: int = 4096) -> Iterator[Tuple[str, int, str]]:
+        """Replay input: (destination, protocol, source as int) per record"""
+        names, protocols = self.names, self.protocols
+        for chunk in self._chunks(chunk_size):
+            for _, source, _, name, _, _, protocol in TraceFormat.RECORD.iter_unpack(chunk):
+                yield names[name], protocols.get(protocol, "OTHER"), source
+
+    def status_counts(self) -> Dict[int, int]:
+        """Recorded outcome counts, for comparison with a replay's BatchResult"""
+        counts: Dict[int, int] = {}
+        for chunk in self._chunks(65536):
+            for record in TraceFormat.RECORD.iter_unpack(chunk):
+                counts[record[4]] = counts.get(record[4], 0) + 1
+        return counts
+
+    def records(self) -> Iterator[TraceRecord]:
+        """Materialize every record (slow; for inspection and debugging)"""
+        for chunk in self._chunks(4096):
+            for timestamp, source, resolved, name, status, reason, protocol in \
+                    TraceFormat.RECORD.iter_unpack(chunk):
+                yield TraceRecord(timestamp, int_to_ip(source), self.names[name],
+                                  int_to_ip(resolved) if resolved else None,
+                                  self.protocols.get(protocol, str(protocol)), status,
+                                  self.reasons[reason])
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __enter__(self) -> "TraceReader":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+# ========== LATENCY HISTOGRAMS ==========
+class LatencyHistogram:
+    """Bounded-memory streaming histogram (HDR-style log-linear buckets)
+    
+    Values are recorded in microseconds. Each power of two is split into
+    128 linear sub-buckets, so any reported percentile is within ~0.8% of
+    the true value, from 1us up to ~12 days. Only buckets that have been
+    hit are stored (a dict keyed by bucket index, at most BUCKETS entries),
+    so the thousands of per-server histograms of a large topology stay
+    small. Histograms from parallel workers combine exactly with merge().
+    """
+    SUB_BUCKET_BITS = 7
+    SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+    MAX_VALUE = (1 << 40) - 1  # Microseconds; larger values are clamped
+    BUCKETS = (40 - SUB_BUCKET_BITS) * SUB_BUCKETS + 2 * SUB_BUCKETS
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}  # Bucket index -> samples
+        self.count = 0
+        self.total = 0       # Sum of recorded values (us), for the mean
+        self.min = 0
+        self.max = 0
+
+    @classmethod
+    def _index(cls, value: int) -> int:
+        shift = value.bit_length() - cls.SUB_BUCKET_BITS - 1
+        if shift <= 0:
+            return value
+        return shift * cls.SUB_BUCKETS + (value >> shift)
+
+    @classmethod
+    def _value_at(cls, index: int) -> int:
+        """Midpoint of the range covered by a bucket"""
+        shift = index // cls.SUB_BUCKETS - 1
+        if shift <= 0:
+            return index
+        return ((index - shift * cls.SUB_BUCKETS) << shift) + (1 << (shift - 1))
+
+    @classmethod
+    def quantize(cls, latency_ms: float) -> Tuple[int, int]:
+        """(value in us, bucket index) for a latency in milliseconds"""
+        value = int(latency_ms * 1000)
+        if value <= 0:
+            value = 0
+        elif value > cls.MAX_VALUE:
+            value = cls.MAX_VALUE
+        shift = value.bit_length() - 8  # Inlined _index() on the hot path
+        return value, (shift * 128 + (value >> shift) if shift > 0 else value)
+
+    def record(self, latency_ms: float):
+        value, index = self.quantize(latency_ms)
+        self.add(value, index)
+
+    def add(self, value: int, index: int):
+        """Count a pre-quantized sample (lets callers share one quantize())"""
+        counts = self.counts
+        counts[index] = counts.get(index, 0) + 1
+        if value > self.max:
+            self.max = value
+        if value < self.min or not self.count:
+            self.min = value
+        self.count += 1
+        self.total += value
+
+    def percentile(self, percent: float) -> float:
+        """Latency (ms) at or below which `percent` of samples fall"""
+        if not self.count:
+            return 0.0
+        target = max(1, math.ceil(percent / 100 * self.count))
+        seen = 0
+        for index, count in sorted(self.counts.items()):
+            seen += count
+            if seen >= target:
+                return min(max(self._value_at(index), self.min), self.max) / 1000
+        return self.max / 1000
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count / 1000 if self.count else 0.0
+
+    def merge(self, other: "LatencyHistogram"):
+        """Add another histogram's samples into this one"""
+        if not other.count:
+            return
+        counts = self.counts
+        for index, count in other.counts.items():
+            counts[index] = counts.get(index, 0) + count
+        self.min = other.min if not self.count else min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.count += other.count
+        self.total += other.total
+
+    def snapshot(self) -> Dict[str, float]:
+        """Summary statistics in milliseconds"""
+        return {
+            "count": self.count,
+            "min": self.min / 1000,
+            "mean": self.mean,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "p999": self.percentile(99.9),
+            "max": self.max / 1000,
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Lossless, JSON-friendly export (sparse bucket counts)"""
+        return {"count": self.count, "total": self.total, "min": self.min, "max": self.max,
+                "buckets": {str(i): c for i, c in sorted(self.counts.items())}}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "LatencyHistogram":
+        histogram = cls()
+        histogram.counts = {int(index): count for index, count in data["buckets"].items()}
+        histogram.count, histogram.total = data["count"], data["total"]
+        histogram.min, histogram.max = data["min"], data["max"]
+        return histogram
+
+def outcome_label(status: int) -> str:
+    """Outcome bucket for a status code (0 = blocked by the router)"""
+    return "blocked" if status == 0 else str(status)
+
+class LatencyStats:
+    """Latency histograms overall and per server, protocol and outcome"""
+    def __init__(self):
+        self.overall = LatencyHistogram()
+        self.by_server: Dict[str, LatencyHistogram] = {}
+        self.by_protocol: Dict[str, LatencyHistogram] = {}
+        self.by_status: Dict[int, LatencyHistogram] = {}  # Reported as outcome labels
+
+    def record(self, latency_ms: float, protocol: str, status: int,
+               server: Optional[str] = None):
+        value, index = LatencyHistogram.quantize(latency_ms)
+        self.overall.add(value, index)
+        self._histogram(self.by_protocol, protocol).add(value, index)
+        self._histogram(self.by_status, status).add(value, index)
+        if server is not None:
+            self._histogram(self.by_server, server).add(value, index)
+
+    @staticmethod
+    def _histogram(table: Dict[Any, LatencyHistogram], key) -> LatencyHistogram:
+        histogram = table.get(key)
+        if histogram is None:
+            histogram = table[key] = LatencyHistogram()
+        return histogram
+
+    def merge(self, other: "LatencyStats"):
+        """Fold in stats from another worker"""
+        self.overall.merge(other.overall)
+        for mine, theirs in ((self.by_server, other.by_server),
+                             (self.by_protocol, other.by_protocol),
+                             (self.by_status, other.by_status)):
+            for key, histogram in theirs.items():
+                mine.setdefault(key, LatencyHistogram()).merge(histogram)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "overall": self.overall.snapshot(),
+            "server": {k: h.snapshot() for k, h in self.by_server.items()},
+            "protocol": {k: h.snapshot() for k, h in self.by_protocol.items()},
+            "outcome": {outcome_label(k): h.snapshot() for k, h in self.by_status.items()},
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "overall": self.overall.to_dict(),
+            "server": {k: h.to_dict() for k, h in self.by_server.items()},
+            "protocol": {k: h.to_dict() for k, h in self.by_protocol.items()},
+            "outcome": {outcome_label(k): h.to_dict() for k, h in self.by_status.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "LatencyStats":
+        stats = cls()
+        stats.overall = LatencyHistogram.from_dict(data["overall"])
+        for table, key in ((stats.by_server, "server"), (stats.by_protocol, "protocol")):
+            for name, histogram in data[key].items():
+                table[name] = LatencyHistogram.from_dict(histogram)
+        for label, histogram in data["outcome"].items():
+            status = 0 if label == "blocked" else int(label)
+            stats.by_status[status] = LatencyHistogram.from_dict(histogram)
+        return stats
+
+    def export(self, path: str):
+        """Write a JSON snapshot (summary plus mergeable bucket data)"""
+        with open(path, "w", encoding="utf-8") as handle:
+            json.dump({"summary": self.snapshot(), "histograms": self.to_dict()}, handle, indent=2)
+
+# ========== METRICS & INSTRUMENTATION ==========
+class Stage:
+    """Routing pipeline stages (the numbered steps in route_packet)
+    
+    Plain ints rather than an IntEnum: they index the StageMetrics
+    accumulators on the hot path, where enum attribute access shows up.
+    """
+    DNS = 0
+    PACKET = 1
+    FIREWALL = 2
+    EGRESS = 3
+    ROUTING = 4
+    TRANSMISSION = 5
+    SERVER = 6
+    STATS = 7
+
+STAGE_NAMES = ("dns", "packet", "firewall", "egress", "routing", "transmission", "server", "stats")
+
+class MetricsSink:
+    """Destination for metric snapshots produced by StageMetrics.flush()"""
+    def emit(self, snapshot: Dict[str, Any]):
+        raise NotImplementedError
+
+class MemorySink(MetricsSink):
+    """In-memory registry: keeps the latest snapshot and a bounded history"""
+    def __init__(self, history: int = 100):
+        self.latest: Optional[Dict[str, Any]] = None
+        self.history: deque = deque(maxlen=history)
+
+    def emit(self, snapshot: Dict[str, Any]):
+        self.latest = snapshot
+        self.history.append(snapshot)
+
+class JSONLinesSink(MetricsSink):
+    """Appends one JSON object per flush to a file"""
+    def __init__(self, path: str):
+        self.path = path
+
+    def emit(self, snapshot: Dict[str, Any]):
+        with open(self.path, "a", encoding="utf-8") as handle:
+            handle.write(json.dumps(snapshot, separators=(",", ":")) + "\n")
+
+class PrometheusSink(MetricsSink):
+    """Rewrites a Prometheus text-format file (e.g. for node_exporter's textfile collector)"""
+    def __init__(self, path: str, prefix: str = "router"):
+        self.path = path
+        self.prefix = prefix
+
+    @staticmethod
+    def _labels(labels: Dict[str, str]) -> str:
+        pairs = []
+        for key, value in labels.items():
+            value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+            pairs.append(f'{key}="{value}"')
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self, snapshot: Dict[str, Any]) -> str:
+        prefix, base = self.prefix, snapshot["labels"]
+        lines = []
+        for field, help_text in (("calls", "Requests that reached each pipeline stage"),
+                                 ("wall_seconds", "Wall-clock time spent in each stage"),
+                                 ("sim_seconds", "Simulated time charged by each stage")):
+            name = f"{prefix}_stage_{field}_total"
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} counter")
+            for stage, values in snapshot["stages"].items():
+                lines.append(f"{name}{self._labels({**base, 'stage': stage})} {values[field]}")
+        for kind, suffix in (("counters", "_total"), ("gauges", "")):
+            for key, value in snapshot[kind].items():
+                name = f"{prefix}_{key}{suffix}"
+                lines.append(f"# TYPE {name} {kind[:-1]}")
+                lines.append(f"{name}{self._labels(base)} {value}")
+        return "\n".join(lines) + "\n"
+
+    def emit(self, snapshot: Dict[str, Any]):
+        # Write then rename, so scrapers never see a half-written file
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w", encoding="utf-8") as handle:
+            handle.write(self.render(snapshot))
+        os.replace(temporary, self.path)
+
+class StageMetrics:
+    """Per-stage cost of the routing pipeline in wall-clock and simulated time
+    
+    Hot paths bracket each stage with lap(); the cost is two clock reads and
+    three list updates per stage, so it is left on by default. Totals are
+    cumulative; flush() sends a snapshot to every registered sink.
+    """
+    def __init__(self, clock: SimClock, labels: Optional[Dict[str, str]] = None,
+                 enabled: bool = True):
+        self.clock = clock
+        self.labels = labels or {}
+        self.enabled = enabled
+        self.sinks: List[MetricsSink] = []
+        self.calls = [0] * len(STAGE_NAMES)
+        self.wall_ns = [0] * len(STAGE_NAMES)
+        self.sim_seconds = [0.0] * len(STAGE_NAMES)
+
+    def start(self) -> Tuple[int, float]:
+        """Mark the beginning of a stage"""
+        return time.perf_counter_ns(), self.clock.now()
+
+    def lap(self, stage: int, mark: Tuple[int, float]) -> Tuple[int, float]:
+        """Charge the time since `mark` to `stage`; returns the next stage's mark"""
+        if not self.enabled:
+            return mark
+        wall, sim = time.perf_counter_ns(), self.clock.now()
+        self.calls[stage] += 1
+        self.wall_ns[stage] += wall - mark[0]
+        self.sim_seconds[stage] += sim - mark[1]
+        return wall, sim
+
+    def add(self, stage: int, sim_seconds: float = 0.0, wall_ns: int = 0, calls: int = 0):
+        """Charge cost measured elsewhere (e.g. egress delay folded into latency)"""
+        if self.enabled:
+            self.calls[stage] += calls
+            self.wall_ns[stage] += wall_ns
+            self.sim_seconds[stage] += sim_seconds
+
+    def reset(self):
+        for stage in range(len(STAGE_NAMES)):
+            self.calls[stage] = self.wall_ns[stage] = 0
+            self.sim_seconds[stage] = 0.0
+
+    def merge(self, other: "StageMetrics"):
+        """Fold in totals from another worker"""
+        for stage in range(len(STAGE_NAMES)):
+            self.calls[stage] += other.calls[stage]
+            self.wall_ns[stage] += other.wall_ns[stage]
+            self.sim_seconds[stage] += other.sim_seconds[stage]
+
+    def stages(self) -> Dict[str, Dict[str, float]]:
+        return {
+            STAGE_NAMES[stage]: {
+                "calls": self.calls[stage],
+                "wall_seconds": self.wall_ns[stage] / 1e9,
+                "sim_seconds": self.sim_seconds[stage],
+            }
+            for stage in range(len(STAGE_NAMES))
+        }
+
+    def snapshot(self, counters: Optional[Dict[str, float]] = None,
+                 gauges: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+        return {
+            "timestamp": time.time(),
+            "sim_time": self.clock.now(),
+            "labels": dict(self.labels),
+            "stages": self.stages(),
+            "counters": dict(counters or {}),
+            "gauges": dict(gauges or {}),
+        }
+
+    def flush(self, counters: Optional[Dict[str, float]] = None,
+              gauges: Optional[Dict[str, float]] = None) -> Dict[str, Any]:
+        """Build a snapshot and hand it to every sink"""
+        snapshot = self.snapshot(counters, gauges)
+        for sink in self.sinks:
+            sink.emit(snapshot)
+        return snapshot
+
+class Profiler:
+    """Opt-in cProfile / tracemalloc hook, used as a context manager around batch runs"""
+    def __init__(self, cpu: bool = True, memory: bool = False, top: int = 20,
+                 output: Optional[str] = None):
+        self.cpu = cpu
+        self.memory = memory
+        self.top = top
+        self.output = output  # Optional path for the raw pstats dump
+        self.profile: Optional[cProfile.Profile] = None
+        self.memory_snapshot: Optional[tracemalloc.Snapshot] = None
+        self.peak_memory = 0
+        self._started_tracing = False
+
+    def __enter__(self) -> "Profiler":
+        if self.memory:
+            self._started_tracing = not tracemalloc.is_tracing()
+            if self._started_tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        if self.cpu:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profile is not None:
+            self.profile.disable()
+            if self.output:
+                self.profile.dump_stats(self.output)
+        if self.memory:
+            self.memory_snapshot = tracemalloc.take_snapshot()
+            self.peak_memory = tracemalloc.get_traced_memory()[1]
+            if self._started_tracing:
+                tracemalloc.stop()
+        return False
+
+    def report(self, sort: str = "cumulative") -> str:
+        """Top functions by `sort` and top allocation sites, as text"""
+        out = io.StringIO()
+        if self.profile is not None:
+            pstats.Stats(self.profile, stream=out).sort_stats(sort).print_stats(self.top)
+        if self.memory_snapshot is not None:
+            out.write(f"Peak traced memory: {self.peak_memory / 1024:.1f} KiB\n")
+            for stat in self.memory_snapshot.statistics("lineno")[:self.top]:
+                out.write(f"{stat}\n")
+        return out.getvalue()
+
 # ========== 1. ADVANCED PACKET CLASS ==========
+class PacketType(IntEnum):
+    """Packet direction, stored as a small code"""
+    REQUEST = 0
+    RESPONSE = 1
+
+PACKET_TYPE_CODES: Dict[str, int] = {t.name: int(t) for t in PacketType}
+PACKET_TYPE_NAMES: Dict[int, str] = {int(t): t.name for t in PacketType}
+
+_packet_ids = itertools.count(1)  # Monotonic, process-wide packet IDs
+
 class Packet:
-    """Represents a network packet with full metadata"""
-    def __init__(self, source_ip: str, destination_ip: str, data: str, 
-                 protocol: str = "HTTP", packet_type: str = "REQUEST"):
-        self.packet_id = random.randint(1000, 9999)
-        self.source_ip = source_ip
-        self.destination_ip = destination_ip
+    """Represents a network packet with full metadata
+    
+    Slotted and compact: addresses are stored as 32-bit integers (a
+    malformed address is kept as its original string so the firewall can
+    reject it), protocol and type as small enum codes, and the creation time
+    as a float that is only turned into a datetime when someone asks.
+    """
+    __slots__ = ("packet_id", "source", "destination", "data", "protocol_code",
+                 "type_code", "created", "ttl", "size")
+
+    def __init__(self, source_ip, destination_ip, data: str,
+                 protocol: str = "HTTP", packet_type: str = "REQUEST",
+                 created: Optional[float] = None):
+        self.packet_id = next(_packet_ids)
+        if type(source_ip) is not int:
+            address = ip_to_int(source_ip)
+            source_ip = source_ip if address is None else address
+        if type(destination_ip) is not int:
+            address = ip_to_int(destination_ip)
+            destination_ip = destination_ip if address is None else address
+        self.source = source_ip
+        self.destination = destination_ip
         self.data = data
-        self.protocol = protocol  # HTTP, FTP, SMTP, DNS
-        self.packet_type = packet_type  # REQUEST or RESPONSE
-        self.timestamp = datetime.now()
+        code = PROTOCOL_CODES.get(protocol)  # HTTP, FTP, SMTP, DNS, or a registered name
+        self.protocol_code = code if code is not None else protocol_code(protocol)
+        self.type_code = PACKET_TYPE_CODES.get(packet_type, 0)  # REQUEST or RESPONSE
+        self.created = time.time() if created is None else created
         self.ttl = 64  # Time To Live
         self.size = len(data)  # Packet size in bytes
+
+    @property
+    def source_ip(self) -> str:
+        source = self.source
+        return int_to_ip(source) if type(source) is int else source
+
+    @property
+    def destination_ip(self) -> str:
+        destination = self.destination
+        return int_to_ip(destination) if type(destination) is int else destination
+
+    @property
+    def protocol(self) -> str:
+        return PROTOCOL_NAMES[self.protocol_code]
+
+    @property
+    def packet_type(self) -> str:
+        return PACKET_TYPE_NAMES[self.type_code]
+
+    @property
+    def timestamp(self) -> datetime:
+        return datetime.fromtimestamp(self.created)
         
-    def transmit_animation(self, speed: float = 0.2):
+    def transmit_animation(self, speed: float = 0.2, clock: Optional[SimClock] = None):
         """Show packet transmission with realistic animation"""
+        sleep = clock.sleep if clock else time.sleep
         print(f"{Colors.CYAN}[PHYSICAL] Packet {self.packet_id} transmitting ", end="")
         distance = random.randint(5, 15)
         for i in range(distance):
             symbols = ["═", "═", "─", "━"]
             print(f"{random.choice(symbols)}", end="", flush=True)
-            time.sleep(speed * random.uniform(0.5, 1.5))
+            sleep(speed * random.uniform(0.5, 1.5))
         print(f" ↗{Colors.END}")
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Plain fields for structured logs"""
+        return {"packet_id": self.packet_id, "source_ip": self.source_ip,
+                "destination_ip": self.destination_ip, "protocol": self.protocol,
+                "size": self.size, "ttl": self.ttl, "created": self.created}
+
+    def transmission_delay(self, speed: float = 0.2) -> float:
+        """Modeled time on the wire, same distribution as the animation"""
+        return random.randint(5, 15) * speed * random.uniform(0.5, 1.5)
+    
+    @staticmethod
+    def min_transmission_delay(speed: float = 0.2) -> float:
+        """Shortest transmission_delay can be"""
+        return 5 * speed * 0.5
+    
+    @staticmethod
+    def mean_transmission_delay(speed: float = 0.2) -> float:
+        """Expected transmission_delay"""
+        return 10 * speed
         
     def __str__(self):
-        time_str = self.timestamp.strftime("%H:%M:%S.%f")[:-3]
+        millis = int((self.created % 1) * 1000)
+        time_str = f"{time.strftime('%H:%M:%S', time.localtime(self.created))}.{millis:03d}"
         return (f"{Colors.YELLOW}[📦 PACKET {self.packet_id}]{Colors.END} "
                 f"{Colors.CYAN}{time_str}{Colors.END} | "
                 f"{self.source_ip:15} → {self.destination_ip:15} | "
                 f"{self.protocol:4} | {self.data[:20]}...")
 
+class PacketBatch:
+    """Columnar batch of packets for bulk paths such as Firewall.inspect_batch
+    
+    One typed array per field instead of one Packet object per packet, so
+    batches of millions of packets stay compact and can be copied into
+    packet logs with slice assignments. Timestamps must be non-decreasing.
+    """
+    def __init__(self):
+        self.sources = array("I")
+        self.destinations = array("I")
+        self.protocols = array("B")
+        self.ttls = array("B")
+        self.timestamps = array("d")
+
+    def append(self, source: int, destination: int, protocol_code: int = 0,
+               ttl: int = 64, timestamp: float = 0.0):
+        self.sources.append(source)
+        self.destinations.append(destination)
+        self.protocols.append(protocol_code)
+        self.ttls.append(ttl)
+        self.timestamps.append(timestamp)
+
+    def reordered(self, order: Iterable[int]) -> "PacketBatch":
+        """New batch holding this batch's packets in the given index order"""
+        order = list(order)
+        batch = PacketBatch()
+        for name in ("sources", "destinations", "protocols", "ttls", "timestamps"):
+            column = getattr(self, name)
+            getattr(batch, name).extend(column[i] for i in order)
+        return batch
+
+    def __len__(self) -> int:
+        return len(self.sources)
+
 # ========== 2. ENHANCED SERVER WITH SECURITY ==========
 class Server:
     """Represents an Application Layer server with security features"""
+    # Most recent requests kept per server (about 19 bytes each, allocated on
+    # the first request); raise it on the class or an instance for deep logs
+    access_log_capacity = 256
+
     def __init__(self, ip_address: str, name: str, content: str, 
-                 security_level: int = 1, server_type: str = "WEB"):
+                 security_level: int = 1, server_type: str = "WEB",
+                 workers: int = 1, queue_limit: int = 64, clock: Optional[SimClock] = None):
         self.ip_address = ip_address
         self.name = name
-        self.content = content
+        self._content = content
         self.server_type = server_type  # WEB, MAIL, FILE, DNS, DB
-        self.is_online = True
-        self.security_level = security_level  # 1=Low, 2=Medium, 3=High
-        self.access_log: List[str] = []
+        self._online = True
+        self.status_listeners: List[Callable[["Server"], None]] = []  # Called on online/offline
+        self.change_listeners: List[Callable[["Server"], None]] = []  # Content/security changes
+        self._security_level = security_level  # 1=Low, 2=Medium, 3=High
+        self._access_log: Optional[PacketLog] = None  # Allocated on first request
         self.requests_served = 0
         self.uptime_start = datetime.now()
+        self.clock = clock or SimClock(realtime=True)  # Replaced by the router's clock
+        self.restricted_networks = RESTRICTED_NETWORKS
+        # Async engine: concurrent requests in service, and how many may wait
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.queued = 0
+        self.in_service = 0
+        self.rejected = 0
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._slots_loop = None
         
+    @property
+    def access_log(self) -> PacketLog:
+        """Ring buffer of handled requests, allocated lazily so that large
+        topologies do not pay for logs of servers that never see traffic"""
+        if self._access_log is None:
+            self._access_log = PacketLog(self.access_log_capacity)
+        return self._access_log
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Semaphores belong to a running event loop and cannot be pickled
+        state = self.__dict__.copy()
+        state.update(_slots=None, _slots_loop=None, queued=0, in_service=0)
+        return state
+
+    @property
+    def is_online(self) -> bool:
+        return self._online
+
+    @is_online.setter
+    def is_online(self, online: bool):
+        if online != self._online:
+            self._online = online
+            for listener in list(self.status_listeners):
+                listener(self)
+
+    @property
+    def content(self) -> str:
+        return self._content
+
+    @content.setter
+    def content(self, content: str):
+        if content != self._content:
+            self._content = content
+            self._changed()
+
+    @property
+    def security_level(self) -> int:
+        return self._security_level
+
+    @security_level.setter
+    def security_level(self, level: int):
+        if level != self._security_level:
+            self._security_level = level
+            self._changed()
+
+    def _changed(self):
+        for listener in list(self.change_listeners):
+            listener(self)
+
+    @property
+    def processing_time(self) -> float:
+        """Modeled processing time, based on content size"""
+        return len(self.content) * 0.01
+
     def process_request(self, packet: Packet) -> str:
         """Process incoming request and return response"""
+        status, reason = self.handle(packet)
+        return self.render_response(status, reason, packet.protocol)
+
+    def handle(self, packet: Packet) -> Tuple[int, str]:
+        """Process a request without formatting; returns (status code, reason)"""
         self.requests_served += 1
-        log_entry = f"{datetime.now()}: {packet.source_ip} → {self.name}"
-        self.access_log.append(log_entry)
+        status, reason = self._evaluate(packet)
+        self.access_log.record(packet, self.clock.now(), status)
+        return status, reason
+
+    def dispatch(self, packet: Packet) -> Tuple[int, str, "Server"]:
+        """handle(), plus the server that answered (it renders the response)"""
+        return (*self.handle(packet), self)
+
+    def _evaluate(self, packet: Packet) -> Tuple[int, str]:
+        rejection = self._admission(packet)
+        if rejection:
+            return rejection
+        
+        # Simulate processing time based on content size
+        self.clock.sleep(self.processing_time)
+        return 200, "ok"
+
+    async def handle_async(self, packet: Packet) -> Tuple[int, str, float, float]:
+        """Process a request on the asyncio engine (a SimEventLoop)
         
+        Up to `workers` requests are served concurrently and at most
+        `queue_limit` may wait for a worker (beyond that: 503 overloaded).
+        Returns (status, reason, queue wait, service time), with times in
+        modeled seconds.
+        """
+        self.requests_served += 1
+        status, reason = self._admission(packet) or (200, "ok")
+        waited = served = 0.0
+        if status == 200:
+            if self.queued >= self.queue_limit:
+                self.rejected += 1
+                status, reason = 503, "overloaded"
+            else:
+                loop = asyncio.get_running_loop()
+                if self._slots is None or self._slots_loop is not loop:
+                    self._slots, self._slots_loop = asyncio.Semaphore(self.workers), loop
+                queued_at = loop.time()
+                self.queued += 1
+                try:
+                    await self._slots.acquire()
+                finally:
+                    self.queued -= 1
+                started = loop.time()
+                self.in_service += 1
+                try:
+                    await asyncio.sleep(self.processing_time)
+                finally:
+                    self.in_service -= 1
+                    self._slots.release()
+                waited = started - queued_at
+                served = loop.time() - started
+        self.access_log.record(packet, self.clock.now(), status)
+        return status, reason, waited, served
+
+    async def dispatch_async(self, packet: Packet) -> Tuple[int, str, float, float, "Server"]:
+        """handle_async(), plus the server that answered"""
+        return (*await self.handle_async(packet), self)
+
+    def _admission(self, packet: Packet) -> Optional[Tuple[int, str]]:
+        """Availability and security checks; (status, reason) if rejected"""
         if not self.is_online:
-            return f"{Colors.RED}❌ 503 Service Unavailable: Server '{self.name}' is offline{Colors.END}"
+            return 503, "offline"
         
         # Security checks
-        if self.security_level >= 3 and packet.protocol != "HTTPS":
-            return f"{Colors.RED}🚫 403 Forbidden: HTTPS required for {self.name}{Colors.END}"
+        if self.security_level >= 3 and packet.protocol_code != Protocol.HTTPS:
+            return 403, "https_required"
             
-        if self.security_level >= 2 and "192.168.2." in packet.source_ip:
+        if self.security_level >= 2:
+            source = packet.source
+            if type(source) is not int or self.restricted_networks.lookup(source) == DENY:
+                return 403, "unauthorized_network"
+        return None
+
+    def render_response(self, status: int, reason: str, protocol: str) -> str:
+        """Format a handled request as a colored response line"""
+        if reason == "overloaded":
+            return f"{Colors.RED}❌ 503 Service Unavailable: Server '{self.name}' is overloaded{Colors.END}"
+        if status == 503:
+            return f"{Colors.RED}❌ 503 Service Unavailable: Server '{self.name}' is offline{Colors.END}"
+        if reason == "https_required":
+            return f"{Colors.RED}🚫 403 Forbidden: HTTPS required for {self.name}{Colors.END}"
+        if status == 403:
             return f"{Colors.RED}🚫 403 Forbidden: Unauthorized network{Colors.END}"
         
-        # Simulate processing time based on content size
-        processing_time = len(self.content) * 0.01
-        time.sleep(processing_time)
-        
         # Protocol-specific responses
-        if packet.protocol == "FTP":
+        if protocol == "FTP":
             response = f"{Colors.GREEN}📁 226 Transfer complete: {self.content}{Colors.END}"
-        elif packet.protocol == "SMTP":
+        elif protocol == "SMTP":
             response = f"{Colors.GREEN}📧 250 OK: Message accepted for {self.content}{Colors.END}"
-        elif packet.protocol == "DNS":
+        elif protocol == "DNS":
             response = f"{Colors.GREEN}🔍 DNS Response: {self.content}{Colors.END}"
         else:  # HTTP/HTTPS
             response = f"{Colors.GREEN}✅ 200 OK [{self.name}]: {self.content}{Colors.END}"
@@ -108,120 +1514,1318 @@ class Server:
         color = Colors.GREEN if self.is_online else Colors.RED
         return f"{color}Server '{self.name}' is now {status}{Colors.END}"
 
+# ---- Load-balanced pools: one virtual IP served by several servers ----
+class PoolMember:
+    """A server in a pool, with its health state and load counters"""
+    __slots__ = ("server", "healthy", "outstanding", "max_outstanding", "requests", "errors",
+                 "busy_seconds", "streak")
+
+    def __init__(self, server: Server):
+        self.server = server
+        self.healthy = server.is_online
+        self.outstanding = 0      # Requests in flight right now
+        self.max_outstanding = 0
+        self.requests = 0
+        self.errors = 0           # Answers other than 200
+        self.busy_seconds = 0.0   # Modeled time spent serving
+        self.streak = 0           # Consecutive probes disagreeing with `healthy`
+
+    def started(self):
+        self.outstanding += 1
+        self.requests += 1
+        if self.outstanding > self.max_outstanding:
+            self.max_outstanding = self.outstanding
+
+    def finished(self, status: int, seconds: float):
+        self.outstanding -= 1
+        self.busy_seconds += seconds
+        if status != 200:
+            self.errors += 1
+
+    @property
+    def load(self) -> Tuple[int, int]:
+        """Balancer ordering: fewest in flight, then fewest served"""
+        return self.outstanding, self.requests
+
+class Balancer:
+    """Picks the member that serves a request; subclass and override pick()"""
+    def pick(self, members: List[PoolMember], packet: Packet) -> PoolMember:
+        raise NotImplementedError
+
+    def rebuild(self, members: List[PoolMember]):
+        """Called with the healthy members whenever they change"""
+
+class RoundRobinBalancer(Balancer):
+    """Each healthy member in turn"""
+    def __init__(self):
+        self._turn = 0
+
+    def pick(self, members: List[PoolMember], packet: Packet) -> PoolMember:
+        self._turn += 1
+        return members[self._turn % len(members)]
+
+class LeastOutstandingBalancer(Balancer):
+    """The member with the fewest requests in flight (ties: fewest served)"""
+    def pick(self, members: List[PoolMember], packet: Packet) -> PoolMember:
+        return min(members, key=lambda member: member.load)
+
+class PowerOfTwoBalancer(Balancer):
+    """The less loaded of two random members: close to least-outstanding,
+    at constant cost and without every client herding onto one member
+    
+    Draws from `rng`, or a Random(seed); with neither, from the module RNG
+    like transmission delays, so random.seed() (run_load's seed) makes the
+    picks reproducible along with the rest of the run.
+    """
+    def __init__(self, seed: Optional[int] = None, rng: Optional[random.Random] = None):
+        self.rng = rng if rng is not None or seed is None else random.Random(seed)
+
+    def pick(self, members: List[PoolMember], packet: Packet) -> PoolMember:
+        if len(members) == 1:
+            return members[0]
+        first, second = (self.rng or random).sample(members, 2)
+        return first if first.load <= second.load else second
+
+class ConsistentHashBalancer(Balancer):
+    """Sticky sessions: clients map to members on a hash ring by source address
+    
+    Each member owns `replicas` points on the ring and a client goes to the
+    next point clockwise, so when a member leaves or returns only the
+    clients on its arcs move.
+    """
+    def __init__(self, replicas: int = 100):
+        self.replicas = replicas
+        self._points: List[int] = []
+        self._owners: List[PoolMember] = []
+
+    def rebuild(self, members: List[PoolMember]):
+        ring = sorted((zlib.crc32(f"{member.server.ip_address}#{replica}".encode()), position)
+                      for position, member in enumerate(members)
+                      for replica in range(self.replicas))
+        self._points = [point for point, _ in ring]
+        self._owners = [members[position] for _, position in ring]
+
+    def pick(self, members: List[PoolMember], packet: Packet) -> PoolMember:
+        key = zlib.crc32(str(packet.source).encode())
+        return self._owners[bisect.bisect(self._points, key) % len(self._points)]
+
+BALANCERS: Dict[str, Callable[[], Balancer]] = {
+    "round-robin": RoundRobinBalancer,
+    "least-outstanding": LeastOutstandingBalancer,
+    "power-of-two": PowerOfTwoBalancer,
+    "consistent-hash": ConsistentHashBalancer,
+}
+
+class ServerPool:
+    """A virtual IP backed by a pool of servers behind a pluggable balancer
+    
+    Registered in the routing table like a server (router.add_pool), so the
+    sync, batch, async and topology paths reach it unchanged; each request
+    is handed to one healthy member. Every `check_interval` simulated
+    seconds each member is probed: `fall` failed probes in a row take it out
+    of rotation and `rise` good ones bring it back. Due checks run when
+    traffic next reaches the pool, catching up on the ones that fell due
+    meanwhile, so they follow the simulated clock in every engine and cost
+    nothing while the pool is idle.
+    """
+    def __init__(self, ip_address: str, name: str, servers: Iterable[Server] = (),
+                 balancer: Any = "round-robin", check_interval: float = 5.0,
+                 rise: int = 2, fall: int = 3, clock: Optional[SimClock] = None):
+        if isinstance(balancer, str):
+            if balancer not in BALANCERS:
+                raise ValueError(f"Unknown balancer: {balancer!r} "
+                                 f"(choose from {', '.join(BALANCERS)})")
+            balancer = BALANCERS[balancer]()
+        self.ip_address = ip_address
+        self.name = name
+        self.balancer: Balancer = balancer
+        self.check_interval = check_interval
+        self.rise = rise
+        self.fall = fall
+        self.members: List[PoolMember] = []
+        self._healthy: List[PoolMember] = []
+        self.enabled = True  # Administrative state (toggle_status)
+        self.status_listeners: List[Callable[["ServerPool"], None]] = []  # Pool up/down
+        self.change_listeners: List[Callable[["ServerPool"], None]] = []  # A member changed
+        self.events: Optional[EventBus] = None  # The router's bus, set by add_pool()
+        self.requests_served = 0
+        self.rejected = 0  # No healthy member to take the request
+        self.health_checks = 0
+        self._clock = clock or SimClock(realtime=True)
+        self._next_check: Optional[float] = None
+        for server in servers:
+            self.add_member(server)
+
+    @property
+    def clock(self) -> SimClock:
+        return self._clock
+
+    @clock.setter
+    def clock(self, clock: SimClock):
+        if clock is not self._clock:
+            self._clock = clock
+            self._next_check = None  # Restart the check schedule on the new time base
+            for member in self.members:
+                member.server.clock = clock
+
+    @property
+    def is_online(self) -> bool:
+        return self.enabled and bool(self._healthy)
+
+    def add_member(self, server: Server):
+        """Put a server behind the pool (in rotation at once if it is online)"""
+        was_online = self.is_online
+        server.clock = self._clock
+        server.change_listeners.append(self._member_changed)
+        self.members.append(PoolMember(server))
+        self._rebuild(was_online)
+
+    def remove_member(self, server: Server):
+        was_online = self.is_online
+        self.members = [member for member in self.members if member.server is not server]
+        if self._member_changed in server.change_listeners:
+            server.change_listeners.remove(self._member_changed)
+        self._rebuild(was_online)
+
+    def _member_changed(self, server: Server):
+        for listener in list(self.change_listeners):
+            listener(self)
+
+    def _rebuild(self, was_online: bool):
+        self._healthy = [member for member in self.members if member.healthy]
+        self.balancer.rebuild(self._healthy)
+        if self.is_online != was_online:
+            for listener in list(self.status_listeners):
+                listener(self)
+
+    def check_health(self):
+        """Probe every member once, moving members in or out of rotation"""
+        was_online = self.is_online
+        self.health_checks += 1
+        changed = False
+        for member in self.members:
+            if member.server.is_online == member.healthy:
+                member.streak = 0
+                continue
+            member.streak += 1
+            if member.streak >= (self.fall if member.healthy else self.rise):
+                member.healthy = not member.healthy
+                member.streak = 0
+                changed = True
+                if self.events is not None:
+                    self.events.emit(Level.INFO if member.healthy else Level.WARNING,
+                                     "pool.member_up" if member.healthy else "pool.member_down",
+                                     pool=self.name, server=member.server.name,
+                                     healthy=sum(m.healthy for m in self.members),
+                                     members=len(self.members))
+        if changed:
+            self._rebuild(was_online)
+
+    def _run_due_checks(self):
+        now = self._clock.now()
+        if self._next_check is None:
+            self._next_check = now + self.check_interval
+        elif now >= self._next_check:
+            missed = int((now - self._next_check) // self.check_interval) + 1
+            # Member state only changes between requests: after `rise` or
+            # `fall` identical probes, more of them cannot change anything
+            for _ in range(min(missed, max(self.rise, self.fall))):
+                self.check_health()
+            self._next_check += missed * self.check_interval
+
+    def _pick(self, packet: Packet) -> Optional[PoolMember]:
+        self._run_due_checks()
+        self.requests_served += 1
+        if not self.is_online:
+            self.rejected += 1
+            return None
+        return self.balancer.pick(self._healthy, packet)
+
+    def handle(self, packet: Packet) -> Tuple[int, str]:
+        """Serve a request on the member the balancer picks; (status, reason)"""
+        return self.dispatch(packet)[:2]
+
+    def dispatch(self, packet: Packet) -> Tuple[int, str, Any]:
+        """handle(), plus who answered: the member's server, or the pool itself"""
+        member = self._pick(packet)
+        if member is None:
+            return 503, "no_healthy_members", self
+        clock = self._clock
+        started = clock.now()
+        member.started()
+        status, reason = member.server.handle(packet)
+        member.finished(status, clock.now() - started)
+        return status, reason, member.server
+
+    async def handle_async(self, packet: Packet) -> Tuple[int, str, float, float]:
+        """Async engine counterpart of handle(); members queue independently"""
+        return (await self.dispatch_async(packet))[:4]
+
+    async def dispatch_async(self, packet: Packet) -> Tuple[int, str, float, float, Any]:
+        """handle_async(), plus who answered (see dispatch)"""
+        member = self._pick(packet)
+        if member is None:
+            return 503, "no_healthy_members", 0.0, 0.0, self
+        member.started()
+        status, reason, waited, served = await member.server.handle_async(packet)
+        member.finished(status, served)
+        return status, reason, waited, served, member.server
+
+    def render_response(self, status: int, reason: str, protocol: str) -> str:
+        """The pool's own answer; members render the ones they serve (dispatch)"""
+        if reason == "no_healthy_members":
+            return (f"{Colors.RED}❌ 503 Service Unavailable: no healthy servers in pool "
+                    f"'{self.name}'{Colors.END}")
+        return f"{Colors.YELLOW}Pool '{self.name}': {status} {reason}{Colors.END}"
+
+    def toggle_status(self):
+        """Administratively enable or disable the whole pool"""
+        was_online = self.is_online
+        self.enabled = not self.enabled
+        self._rebuild(was_online)
+        status = "ENABLED" if self.enabled else "DISABLED"
+        color = Colors.GREEN if self.enabled else Colors.RED
+        return f"{color}Pool '{self.name}' is now {status}{Colors.END}"
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Per-member load: share of requests, errors, in-flight and busy time"""
+        total = sum(member.requests for member in self.members) or 1
+        return [{
+            "server": member.server.name,
+            "ip": member.server.ip_address,
+            "healthy": member.healthy,
+            "requests": member.requests,
+            "share": member.requests / total,
+            "errors": member.errors,
+            "outstanding": member.outstanding,
+            "max_outstanding": member.max_outstanding,
+            "busy_seconds": member.busy_seconds,
+            "mean_service_ms": member.busy_seconds / member.requests * 1000
+            if member.requests else 0.0,
+        } for member in self.members]
+
+    def __len__(self) -> int:
+        return len(self.members)
+
 # ========== 3. DNS SYSTEM WITH CACHE ==========
+# Declarative description of the demo network (the format load_config()
+# reads). Each server lists the domains that point at it, so DNS records
+# are derived from the server definitions and the two cannot drift apart.
+DEMO_NETWORK: Dict[str, Any] = {
+    "router": {"name": "CoreRouter-01"},
+    "servers": [
+        {"ip": "192.168.1.1", "name": "Google", "content": "Welcome to Google Search",
+         "security_level": 2, "type": "WEB", "domains": ["google.com"]},
+        {"ip": "192.168.1.2", "name": "SecureBank", "content": "🔒 Banking Portal - $10,284.52",
+         "security_level": 3, "type": "WEB", "domains": ["bank.com"]},
+        {"ip": "192.168.1.3", "name": "MailServer", "content": "📧 5 Unread Messages",
+         "security_level": 2, "type": "MAIL", "online": False, "domains": ["email.com"]},
+        {"ip": "192.168.1.4", "name": "CloudDrive", "content": "☁️ 15.2GB of 20GB used",
+         "security_level": 1, "type": "FILE", "domains": ["cloud.com"]},
+        {"ip": "192.168.1.5", "name": "YouTube", "content": "▶️ Trending Videos",
+         "security_level": 1, "type": "WEB", "domains": ["youtube.com"]},
+        {"ip": "192.168.1.6", "name": "GitHub", "content": "💻 Repositories: 12",
+         "security_level": 2, "type": "WEB", "domains": ["github.com"]},
+        {"ip": "192.168.1.7", "name": "Database", "content": "🗄️ MySQL Server v8.0",
+         "security_level": 3, "type": "DB", "online": False, "domains": ["facebook.com"]},
+        {"ip": "192.168.1.8", "name": "FirewallLog", "content": "📊 Security Monitoring",
+         "security_level": 3, "type": "WEB", "domains": ["twitter.com"]},
+    ],
+    "dns": {"records": {"localhost": "127.0.0.1"}},
+}
+
+DEFAULT_DNS_RECORDS: Dict[str, str] = {
+    **{domain: spec["ip"] for spec in DEMO_NETWORK["servers"] for domain in spec["domains"]},
+    **DEMO_NETWORK["dns"]["records"],
+}
+
+def _normalize(name: str) -> str:
+    """DNS names compare case-insensitively and without the root dot"""
+    return name.lower().rstrip(".")
+
+class ZoneIndex:
+    """Compact authoritative record store: name -> (IPv4, TTL)
+    
+    Each record is packed into a single int (address in the low 32 bits,
+    TTL above it), which keeps multi-million-name zones small.
+    """
+    def __init__(self, default_ttl: int = 300):
+        self.default_ttl = default_ttl
+        self._records: Dict[str, int] = {}
+
+    def add(self, name: str, ip: str, ttl: Optional[int] = None):
+        """Add or replace an A record"""
+        address = ip_to_int(ip)
+        if address is None:
+            raise ValueError(f"Invalid IPv4 address for {name!r}: {ip!r}")
+        ttl = self.default_ttl if ttl is None else ttl
+        self._records[_normalize(name)] = address | (ttl << 32)
+
+    def add_many(self, records: Iterable[Tuple[str, str]], ttl: Optional[int] = None) -> int:
+        """Bulk-add (name, ip) pairs with one TTL; returns the number added"""
+        packed_ttl = (self.default_ttl if ttl is None else ttl) << 32
+        store = self._records
+        added = 0
+        for name, ip in records:
+            address = parse_ipv4(ip)  # Not ip_to_int: a bulk load would only churn its cache
+            if address is None:
+                raise ValueError(f"Invalid IPv4 address for {name!r}: {ip!r}")
+            store[_normalize(name)] = address | packed_ttl
+            added += 1
+        return added
+
+    def get_record(self, name: str) -> Optional[Tuple[str, int]]:
+        """Return (ip, ttl) for name, or None if the name does not exist"""
+        packed = self._records.get(_normalize(name))
+        if packed is None:
+            return None
+        return int_to_ip(packed & 0xFFFFFFFF), packed >> 32
+
+    def remove(self, name: str) -> bool:
+        return self._records.pop(_normalize(name), None) is not None
+
+    def load_zone_file(self, path: str) -> int:
+        """Bulk-load A records; returns the number of records loaded
+        
+        Accepts BIND-style lines ("name [ttl] [IN] A ip", with an optional
+        "$TTL seconds" directive) as well as plain "name ip" pairs.
+        Comments start with ';' or '#'.
+        """
+        records = self._records
+        default_ttl = self.default_ttl
+        loaded = 0
+        with open(path, encoding="utf-8") as handle:
+            for line in handle:
+                fields = line.split(";", 1)[0].split("#", 1)[0].split()
+                if not fields:
+                    continue
+                if fields[0].upper() == "$TTL":
+                    default_ttl = int(fields[1])
+                    continue
+                address = parse_ipv4(fields[-1])
+                if address is None:
+                    if len(fields) > 2 and fields[-2].upper() != "A":
+                        continue  # Not an A record (NS, MX, ...)
+                    raise ValueError(f"Invalid zone record: {line.strip()!r}")
+                ttl = next((int(f) for f in fields[1:-1] if f.isdigit()), default_ttl)
+                records[_normalize(fields[0])] = address | (ttl << 32)
+                loaded += 1
+        return loaded
+
+    def __setitem__(self, name: str, ip: str):
+        self.add(name, ip)
+
+    def __getitem__(self, name: str) -> str:
+        record = self.get_record(name)
+        if record is None:
+            raise KeyError(name)
+        return record[0]
+
+    def __contains__(self, name: str) -> bool:
+        return _normalize(name) in self._records
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._records)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+class DNSCache:
+    """Resolver cache: per-record TTLs on the simulation clock, LRU size
+    bound, and negative caching of NXDOMAIN answers (stored as None)"""
+    def __init__(self, clock: SimClock, capacity: int = 10000, negative_ttl: float = 60.0,
+                 default_ttl: float = 300.0):
+        self.clock = clock
+        self.capacity = capacity
+        self.negative_ttl = negative_ttl
+        self.default_ttl = default_ttl  # For answers that come without a TTL
+        self.entries: "OrderedDict[str, Tuple[Optional[str], float]]" = OrderedDict()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def get(self, name: str) -> Tuple[bool, Optional[str]]:
+        """Return (found, ip); ip is None for a cached NXDOMAIN"""
+        name = _normalize(name)
+        entry = self.entries.get(name)
+        if entry is not None:
+            if entry[1] > self.clock.now():
+                self.entries.move_to_end(name)
+                if entry[0] is None:
+                    self.negative_hits += 1
+                else:
+                    self.hits += 1
+                return True, entry[0]
+            del self.entries[name]
+            self.expirations += 1
+        self.misses += 1
+        return False, None
+
+    def put(self, name: str, ip: Optional[str], ttl: Optional[float] = None):
+        """Cache an answer (ip=None caches NXDOMAIN for negative_ttl)"""
+        if ip is None:
+            ttl = self.negative_ttl
+        elif ttl is None:
+            ttl = self.default_ttl
+        name = _normalize(name)
+        entries = self.entries
+        entries[name] = (ip, self.clock.now() + ttl)
+        entries.move_to_end(name)
+        self._evict()
+
+    def _evict(self):
+        """Drop least recently used entries beyond capacity"""
+        entries = self.entries
+        while len(entries) > self.capacity:
+            entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, name: str):
+        self.entries.pop(_normalize(name), None)
+
+    def merge(self, other: "DNSCache"):
+        """Fold in another worker's cache entries and counters"""
+        self.entries.update(other.entries)
+        self.hits += other.hits
+        self.negative_hits += other.negative_hits
+        self.misses += other.misses
+        self.expirations += other.expirations
+        self.evictions += other.evictions
+        self._evict()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+            "hit_ratio": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+        }
+
+    def __contains__(self, name: str) -> bool:
+        entry = self.entries.get(_normalize(name))
+        return entry is not None and entry[1] > self.clock.now()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
 class DNSSystem:
     """Domain Name System with caching"""
-    def __init__(self):
-        self.dns_records: Dict[str, str] = {
-            "google.com": "192.168.1.1",
-            "bank.com": "192.168.1.2",
-            "email.com": "192.168.1.3",
-            "cloud.com": "192.168.1.4",
-            "youtube.com": "192.168.1.5",
-            "github.com": "192.168.1.6",
-            "facebook.com": "192.168.1.7",
-            "twitter.com": "192.168.1.8",
-            "localhost": "127.0.0.1"
-        }
-        self.dns_cache: Dict[str, str] = {}
+    lookup_delay = 0.3  # Modeled upstream query time (seconds), paid on cache misses
+
+    def __init__(self, clock: Optional[SimClock] = None, cache_size: int = 10000,
+                 negative_ttl: float = 60.0, records: Optional[Dict[str, str]] = None,
+                 events: Optional[EventBus] = None):
+        self.clock = clock or SimClock()
+        self.events = events or EventBus(clock=self.clock)  # No sinks: quiet
+        self.dns_records = ZoneIndex()
+        self.dns_records.add_many((DEFAULT_DNS_RECORDS if records is None else records).items())
+        self.dns_cache = DNSCache(self.clock, cache_size, negative_ttl,
+                                  self.dns_records.default_ttl)
         self.lookup_count = 0
+        self._inflight: Dict[str, "asyncio.Future"] = {}  # Async misses being resolved
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        state["_inflight"] = {}  # Futures of a running event loop
+        return state
+
+    def add_record(self, name: str, ip: str, ttl: Optional[int] = None):
+        """Add an A record, dropping any stale (or negative) cached answer"""
+        self.dns_records.add(name, ip, ttl)
+        self.dns_cache.invalidate(name)
+
+    def add_records(self, records: Iterable[Tuple[str, str]], ttl: Optional[int] = None) -> int:
+        """Bulk-add (name, ip) pairs; the resolver cache is dropped once"""
+        added = self.dns_records.add_many(records, ttl)
+        self.dns_cache.entries.clear()
+        return added
+
+    def load_zone_file(self, path: str) -> int:
+        """Bulk-load a zone file into the authoritative records"""
+        loaded = self.dns_records.load_zone_file(path)
+        self.dns_cache.entries.clear()
+        return loaded
         
     def resolve(self, domain: str) -> Optional[str]:
-        """Resolve domain name to IP address"""
+        """Resolve domain name to IP address, reporting the outcome as an event"""
+        ip, source = self._query(domain)
+        
+        if ip is None:
+            self.events.emit(Level.WARNING, "dns.nxdomain", domain=domain)
+        elif source == "cache":
+            self.events.emit(Level.INFO, "dns.cache_hit", domain=domain, ip=ip)
+        else:
+            self.events.emit(Level.INFO, "dns.resolved", domain=domain, ip=ip)
+        return ip
+
+    def lookup(self, domain: str) -> Optional[str]:
+        """Resolve domain name to IP address without emitting events"""
+        return self._query(domain)[0]
+
+    def _query(self, domain: str) -> Tuple[Optional[str], str]:
+        """Resolve via cache, then zone data; returns (ip, "cache" or "zone")"""
         self.lookup_count += 1
         
-        # Check cache first
-        if domain in self.dns_cache:
-            print(f"{Colors.YELLOW}[DNS] Cache hit for '{domain}'{Colors.END}")
-            return self.dns_cache[domain]
+        # Check cache first (includes cached NXDOMAIN answers)
+        found, ip = self.dns_cache.get(domain)
+        if found:
+            return ip, "cache"
         
-        # Standard resolution
-        if domain in self.dns_records:
-            ip = self.dns_records[domain]
-            self.dns_cache[domain] = ip  # Add to cache
-            print(f"{Colors.GREEN}[DNS] Resolved '{domain}' → {ip}{Colors.END}")
+        # Standard resolution (costs a modeled round trip)
+        self.clock.sleep(self.lookup_delay)
+        return self._answer(domain), "zone"
+
+    async def lookup_async(self, domain: str) -> Optional[str]:
+        """Resolve on the asyncio engine; concurrent misses share one query"""
+        self.lookup_count += 1
+        found, ip = self.dns_cache.get(domain)
+        if found:
             return ip
+        key = _normalize(domain)
+        pending = self._inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        pending = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            await asyncio.sleep(self.lookup_delay)
+            ip = self._answer(domain)
+            pending.set_result(ip)
+        finally:
+            del self._inflight[key]
+            if not pending.done():
+                pending.cancel()
+        return ip
+
+    def _answer(self, domain: str) -> Optional[str]:
+        """Authoritative answer from zone data, cached (negatively if absent)"""
+        record = self.dns_records.get_record(domain)
+        if record is None:
+            self.dns_cache.put(domain, None)
+            return None
+        self.dns_cache.put(domain, record[0], record[1])
+        return record[0]
+
+# ========== 4. INTELLIGENT FIREWALL ==========
+class RateLimiter:
+    """Per-source token buckets on the simulation clock with bounded state
+    
+    Each source refills at `rate` tokens per second up to `burst`. Buckets are
+    kept in last-seen order, so idle sources are evicted from the front in
+    amortized O(1) whenever a new source arrives. A bucket idle for longer
+    than burst/rate is full anyway, so evicting it after `idle_timeout`
+    changes no decision as long as idle_timeout >= burst/rate.
+    
+    Memory is bounded at the cost of exactness: once `max_sources` are
+    tracked, the least recently seen source is evicted even if it is still
+    active, and it starts over with a full bucket when it returns. A flood of
+    distinct (e.g. spoofed) sources can therefore let a slow sender through
+    more often than its rate allows.
+    """
+    def __init__(self, rate: float, clock: SimClock, burst: Optional[float] = None,
+                 max_sources: int = 100_000, idle_timeout: float = 60.0):
+        self.clock = clock
+        self.max_sources = max_sources
+        self.idle_timeout = idle_timeout
+        self.buckets: "OrderedDict[Any, List[float]]" = OrderedDict()  # source -> [tokens, last seen]
+        self.evicted = 0
+        self.configure(rate, burst)
+
+    def configure(self, rate: float, burst: Optional[float] = None):
+        """Change the refill rate (packets/second) and bucket size"""
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+
+    def allow(self, source: Any) -> bool:
+        """Take one token for source; False if its bucket is empty"""
+        now = self.clock.now()
+        bucket = self.buckets.get(source)
+        if bucket is None:
+            self._evict(now)
+            bucket = self.buckets[source] = [self.burst, now]
+        else:
+            self.buckets.move_to_end(source)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        if bucket[0] >= 1.0:
+            bucket[0] -= 1.0
+            return True
+        return False
+
+    def take_batch(self, sources: "array[int]", timestamps: "array[float]",
+                   verdicts: bytearray, code: int):
+        """allow() for a whole batch, packet by packet in timestamp order
         
-        print(f"{Colors.RED}[DNS] NXDOMAIN: '{domain}' not found{Colors.END}")
+        Packets whose verdict is still 0 take a token at their own
+        timestamp; those that find their bucket empty get `code`. Decisions
+        are identical to calling allow() per packet, without the per-call
+        overhead.
+        """
+        buckets, evict = self.buckets, self._evict
+        move_to_end = buckets.move_to_end
+        rate, burst = self.rate, self.burst
+        for i, source in enumerate(sources):
+            if verdicts[i]:
+                continue
+            now = timestamps[i]
+            bucket = buckets.get(source)
+            if bucket is None:
+                evict(now)
+                bucket = buckets[source] = [burst, now]
+            else:
+                move_to_end(source)
+                tokens = bucket[0] + (now - bucket[1]) * rate
+                bucket[0] = tokens if tokens < burst else burst
+                bucket[1] = now
+            if bucket[0] >= 1.0:
+                bucket[0] -= 1.0
+            else:
+                verdicts[i] = code
+
+    def _evict(self, now: float):
+        """Drop idle sources, and the least recently seen ones when full"""
+        buckets = self.buckets
+        while buckets:
+            source, bucket = next(iter(buckets.items()))
+            if now - bucket[1] < self.idle_timeout and len(buckets) < self.max_sources:
+                break
+            del buckets[source]
+            self.evicted += 1
+
+    def __len__(self) -> int:
+        return len(self.buckets)
+
+class Firewall:
+    """Stateful firewall with multiple security rules"""
+    def __init__(self, clock: Optional[SimClock] = None, history_size: int = 65536):
+        self.clock = clock or SimClock()
+        # CIDR allow/deny rules; the most specific matching prefix wins
+        self.ip_rules = PrefixTrie()
+        self.ip_rules.insert("192.168.2.100/32", DENY)  # Known attacker
+        self.ip_rules.insert("185.143.223.1/32", DENY)  # Suspicious IP
+        # Invalid IPs such as "10.0.0.666" are caught by block_malformed_packets
+        self.security_rules = {
+            "block_malformed_packets": True,
+            "require_ttl_check": True,
+            "block_private_to_public": False,
+            "rate_limit": 10,  # Max packets per second
+        }
+        self.packet_history = PacketLog(history_size)  # Status 200 = passed, 0 = blocked
+        self.blocked_count = 0
+        self.rate_limiter = RateLimiter(self.security_rules["rate_limit"], self.clock)
+        
+    block_messages = {
+        "blacklist": "Source IP in blacklist",
+        "ttl": "Packet TTL expired",
+        "rate_limit": "Rate limit exceeded",
+        "malformed": "Malformed source address",
+    }
+
+    @property
+    def blacklisted_ips(self) -> List[str]:
+        """Denied CIDR blocks (read-only view of ip_rules)"""
+        return [cidr for cidr, action in self.ip_rules.items() if action == DENY]
+
+    def block(self, cidr: str):
+        """Deny traffic from an address or CIDR block"""
+        self.ip_rules.insert(cidr, DENY)
+
+    def allow(self, cidr: str):
+        """Allow traffic from a block, overriding any less specific deny"""
+        self.ip_rules.insert(cidr, ALLOW)
+
+    def load_blocklist(self, path: str, default_action: str = DENY) -> int:
+        """Bulk-load rules from a file; returns the number of rules loaded
+        
+        One rule per line, either a bare CIDR block (uses default_action) or
+        "allow <cidr>" / "deny <cidr>". Blank lines and '#' comments are skipped.
+        """
+        insert = self.ip_rules.insert
+        loaded = 0
+        with open(path, encoding="utf-8") as handle:
+            for line in handle:
+                line = line.split("#", 1)[0].strip()
+                if not line:
+                    continue
+                fields = line.split()
+                if len(fields) == 1:
+                    insert(fields[0], default_action)
+                elif fields[0].lower() in (ALLOW, DENY):
+                    insert(fields[1], fields[0].lower())
+                else:
+                    raise ValueError(f"Invalid firewall rule: {line!r}")
+                loaded += 1
+        return loaded
+        
+    def inspect_packet(self, packet: Packet) -> tuple[bool, str]:
+        """Inspect packet against firewall rules"""
+        reason = self.check(packet)
+        return reason is None, self.describe(reason)
+
+    def describe(self, reason: Optional[str]) -> str:
+        """Console message for a check() result"""
+        if reason:
+            return f"{Colors.RED}🚫 BLOCKED: {self.block_messages[reason]}{Colors.END}"
+        return f"{Colors.GREEN}✓ Firewall check passed{Colors.END}"
+
+    def check(self, packet: Packet) -> Optional[str]:
+        """Apply firewall rules; returns the blocking rule name or None"""
+        reason = self._apply_rules(packet)
+        self.packet_history.record(packet, self.clock.now(), 0 if reason else 200)
+        return reason
+
+    # Verdict codes returned by inspect_batch (0 = passed)
+    batch_reasons = (None, "blacklist", "ttl", "rate_limit")
+    
+    def inspect_batch(self, batch: PacketBatch) -> bytearray:
+        """Apply the firewall to a whole PacketBatch at once
+        
+        Returns one verdict code per packet, indexing batch_reasons (0 =
+        passed). Decisions match check() packet by packet, but each rule
+        runs over the whole batch: the blacklist is looked up once per
+        distinct source, TTLs are scanned in one pass, rate-limit buckets
+        are drained in timestamp order, and the history is appended with
+        slice copies. Batch sources are always well-formed addresses. The
+        clock ends at the last packet's timestamp.
+        """
+        count = len(batch)
+        verdicts = bytearray(count)
+        if not count:
+            return verdicts
+        sources, rules = batch.sources, self.security_rules
+        
+        # Rule 1: Blacklist, one trie lookup per distinct source
+        lookup = self.ip_rules.lookup
+        denied = {source for source in set(sources) if lookup(source) == DENY}
+        if denied:
+            for i, source in enumerate(sources):
+                if source in denied:
+                    verdicts[i] = 1
+        
+        # Rule 2: TTL check
+        if rules["require_ttl_check"]:
+            for i, ttl in enumerate(batch.ttls):
+                if ttl <= 0 and not verdicts[i]:
+                    verdicts[i] = 2
+        
+        # Rule 3: Rate limiting, in timestamp order
+        limiter = self.rate_limiter
+        if limiter.rate != rules["rate_limit"]:
+            limiter.configure(rules["rate_limit"])
+        limiter.take_batch(sources, batch.timestamps, verdicts, 3)
+        
+        statuses = array("h", (0 if verdict else 200 for verdict in verdicts))
+        self.packet_history.extend(sources, batch.destinations, batch.protocols,
+                                   batch.timestamps, statuses)
+        self.blocked_count += count - verdicts.count(0)
+        self.clock.sync(batch.timestamps[-1])
+        return verdicts
+
+    def _apply_rules(self, packet: Packet) -> Optional[str]:
+        # Rule 1: Blacklisted IPs (longest-prefix match, O(32) per packet)
+        source = packet.source
+        if type(source) is not int:
+            if self.security_rules["block_malformed_packets"]:
+                self.blocked_count += 1
+                return "malformed"
+        elif self.ip_rules.lookup(source) == DENY:
+            self.blocked_count += 1
+            return "blacklist"
+        
+        # Rule 2: TTL check
+        if self.security_rules["require_ttl_check"] and packet.ttl <= 0:
+            self.blocked_count += 1
+            return "ttl"
+        
+        # Rule 3: Rate limiting (token bucket per source, packets per second)
+        limiter = self.rate_limiter
+        if limiter.rate != self.security_rules["rate_limit"]:
+            limiter.configure(self.security_rules["rate_limit"])
+        if not limiter.allow(source):
+            self.blocked_count += 1
+            return "rate_limit"
+        
+        return None
+
+# ========== 5. ADVANCED ROUTER WITH QOS ==========
+# Traffic classes for the egress scheduler. Lower priority number = served
+# first (strict priority); classes sharing a priority split the link by
+# weight using deficit round robin. drop: "tail" or "red".
+DEFAULT_QOS_CLASSES: Dict[str, Dict[str, Any]] = {
+    "interactive": {"protocols": ["DNS", "HTTPS"], "priority": 0, "weight": 1,
+                    "limit": 256, "drop": "tail"},
+    "default": {"protocols": ["HTTP", "SMTP"], "priority": 1, "weight": 3,
+                "limit": 1024, "drop": "red"},
+    "bulk": {"protocols": ["FTP"], "priority": 1, "weight": 1,
+             "limit": 1024, "drop": "red"},
+}
+
+class TrafficClass:
+    """One egress queue with its scheduling and drop configuration"""
+    def __init__(self, name: str, priority: int = 1, weight: int = 1, limit: int = 1024,
+                 drop: str = "tail", red_min: Optional[float] = None,
+                 red_max: Optional[float] = None, red_max_p: float = 0.1,
+                 red_weight: float = 0.02, mtu: int = 1500, protocols: Iterable[str] = ()):
+        if drop not in ("tail", "red"):
+            raise ValueError(f"Unknown drop policy for class {name!r}: {drop!r}")
+        self.name = name
+        self.priority = priority
+        self.quantum = weight * mtu  # Bytes per DRR round
+        self.limit = limit
+        self.drop = drop
+        self.red_min = limit * 0.25 if red_min is None else red_min
+        self.red_max = limit * 0.75 if red_max is None else red_max
+        self.red_max_p = red_max_p
+        self.red_weight = red_weight
+        self.protocols = list(protocols)
+        self.queue: deque = deque()  # (packet, meta, wire size, enqueued at)
+        self.deficit = 0
+        self.avg_depth = 0.0         # RED's moving average of the queue length
+        self.enqueued = 0
+        self.sent = 0
+        self.bytes_sent = 0
+        self.tail_drops = 0
+        self.red_drops = 0
+        self.max_depth = 0
+        self.total_wait = 0.0
+
+    def admit(self) -> bool:
+        """Apply the drop policy to an arriving packet"""
+        depth = len(self.queue)
+        if depth >= self.limit:
+            self.tail_drops += 1
+            return False
+        if self.drop == "red":
+            self.avg_depth += self.red_weight * (depth - self.avg_depth)
+            if self.avg_depth >= self.red_max:
+                self.red_drops += 1
+                return False
+            if self.avg_depth > self.red_min:
+                chance = self.red_max_p * (self.avg_depth - self.red_min) / (self.red_max - self.red_min)
+                if random.random() < chance:
+                    self.red_drops += 1
+                    return False
+        return True
+
+class QoSScheduler:
+    """Per-class egress queues: strict priority across levels, DRR within"""
+    min_frame = 64  # Smallest frame on the wire (bytes)
+
+    def __init__(self, classes: Optional[Dict[str, Dict[str, Any]]] = None,
+                 default_class: str = "default"):
+        config = DEFAULT_QOS_CLASSES if classes is None else classes
+        self.classes: Dict[str, TrafficClass] = {
+            name: TrafficClass(name, **options) for name, options in config.items()}
+        self.default = self.classes[default_class]
+        self._by_protocol: Dict[int, TrafficClass] = {}
+        for traffic_class in self.classes.values():
+            for protocol in traffic_class.protocols:
+                self._by_protocol[protocol_code(protocol)] = traffic_class
+        self._active: Dict[int, deque] = {c.priority: deque() for c in self.classes.values()}
+        self._levels = sorted(self._active)
+        self._queued = 0
+
+    def classify(self, packet: Packet) -> TrafficClass:
+        return self._by_protocol.get(packet.protocol_code, self.default)
+
+    def enqueue(self, packet: Packet, meta: Any = None, now: float = 0.0) -> bool:
+        """Queue a packet; returns False if its class dropped it"""
+        traffic_class = self.classify(packet)
+        if not traffic_class.admit():
+            return False
+        queue = traffic_class.queue
+        if not queue:
+            self._active[traffic_class.priority].append(traffic_class)
+        queue.append((packet, meta, max(packet.size, self.min_frame), now))
+        traffic_class.enqueued += 1
+        if len(queue) > traffic_class.max_depth:
+            traffic_class.max_depth = len(queue)
+        self._queued += 1
+        return True
+
+    def dequeue(self) -> Optional[Tuple[Packet, Any, int, TrafficClass]]:
+        """Next packet to transmit: (packet, meta, wire size, class)"""
+        for level in self._levels:
+            active = self._active[level]
+            while active:
+                traffic_class = active[0]
+                size = traffic_class.queue[0][2]
+                if traffic_class.deficit >= size:
+                    traffic_class.deficit -= size
+                    packet, meta, size, _ = traffic_class.queue.popleft()
+                    if not traffic_class.queue:
+                        traffic_class.deficit = 0
+                        active.popleft()
+                    self._queued -= 1
+                    traffic_class.sent += 1
+                    traffic_class.bytes_sent += size
+                    return packet, meta, size, traffic_class
+                traffic_class.deficit += traffic_class.quantum
+                active.rotate(-1)
+        return None
+
+    def drain(self, bandwidth: float) -> Iterator[Tuple[Packet, Any, float, float]]:
+        """Transmit everything queued over a link of `bandwidth` bits/s
+        
+        Treats the queued packets as one burst; yields (packet, meta, queue
+        wait, egress delay) in transmission order, where the egress delay is
+        the wait plus the packet's own serialization time.
+        """
+        elapsed = 0.0
+        while True:
+            item = self.dequeue()
+            if item is None:
+                return
+            packet, meta, size, traffic_class = item
+            waited = elapsed
+            elapsed += size * 8 / bandwidth
+            traffic_class.total_wait += waited
+            yield packet, meta, waited, elapsed
+
+    def merge(self, other: "QoSScheduler"):
+        """Fold in another worker's per-class counters (queues are not moved)"""
+        for name, theirs in other.classes.items():
+            mine = self.classes.get(name)
+            if mine is None:
+                continue
+            mine.enqueued += theirs.enqueued
+            mine.sent += theirs.sent
+            mine.bytes_sent += theirs.bytes_sent
+            mine.tail_drops += theirs.tail_drops
+            mine.red_drops += theirs.red_drops
+            mine.max_depth = max(mine.max_depth, theirs.max_depth)
+            mine.total_wait += theirs.total_wait
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Per-class throughput, queue depth and drop counters"""
+        total_bytes = sum(c.bytes_sent for c in self.classes.values()) or 1
+        return {
+            name: {
+                "sent": c.sent,
+                "bytes": c.bytes_sent,
+                "share": c.bytes_sent / total_bytes,
+                "depth": len(c.queue),
+                "max_depth": c.max_depth,
+                "tail_drops": c.tail_drops,
+                "red_drops": c.red_drops,
+                "avg_wait_ms": c.total_wait / c.sent * 1000 if c.sent else 0.0,
+            }
+            for name, c in self.classes.items()
+        }
+
+    def __len__(self) -> int:
+        return self._queued
+
+class ResponseCache:
+    """Edge cache of successful responses, keyed on (ip, protocol code, trusted)
+    
+    `trusted` is the security context: whether the source is outside the
+    restricted networks. Together with the protocol it determines every
+    admission decision except availability, which is handled by
+    invalidation: the router drops a server's entries whenever it goes
+    online/offline or its content or security level changes. Entries expire
+    after `ttl` modeled seconds and the least recently used are evicted
+    beyond `capacity`.
+    """
+    def __init__(self, clock: SimClock, capacity: int = 10000, ttl: float = 30.0):
+        self.clock = clock
+        self.capacity = capacity
+        self.ttl = ttl
+        # key -> (server routed to, modeled cost of a miss in seconds, expires,
+        # server that answered: a pool's member, which renders the response)
+        self.entries: "OrderedDict[Tuple[str, int, bool], Tuple[Server, float, float, Server]]" = \
+            OrderedDict()
+        self._by_server: Dict[str, set] = {}  # ip -> keys cached for that server
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.saved_seconds = 0.0  # Sum of miss costs avoided by hits
+
+    def get(self, key: Tuple[str, int, bool]) -> Optional[Tuple[Server, float, float, Server]]:
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry[2] > self.clock.now():
+                self.entries.move_to_end(key)
+                self.hits += 1
+                self.saved_seconds += entry[1]
+                return entry
+            self._discard(key)
+            self.expirations += 1
+        self.misses += 1
         return None
 
-# ========== 4. INTELLIGENT FIREWALL ==========
-class Firewall:
-    """Stateful firewall with multiple security rules"""
+    def put(self, key: Tuple[str, int, bool], server: Server, cost: float,
+            responder: Optional[Server] = None):
+        """Cache a 200 response from `server` that took `cost` modeled seconds
+        
+        `responder` is the server that actually answered when `server` is a
+        pool (see dispatch); it defaults to `server`.
+        """
+        entries = self.entries
+        entries[key] = (server, cost, self.clock.now() + self.ttl, responder or server)
+        entries.move_to_end(key)
+        self._by_server.setdefault(key[0], set()).add(key)
+        self._evict()
+
+    def _evict(self):
+        """Drop least recently used entries beyond capacity"""
+        entries = self.entries
+        while len(entries) > self.capacity:
+            self._discard(next(iter(entries)))
+            self.evictions += 1
+
+    def invalidate_server(self, ip_address: str) -> int:
+        """Drop every entry for one server; returns how many were dropped"""
+        keys = self._by_server.pop(ip_address, ())
+        for key in keys:
+            del self.entries[key]
+        self.invalidations += len(keys)
+        return len(keys)
+
+    def clear(self):
+        self.entries.clear()
+        self._by_server.clear()
+
+    def _discard(self, key: Tuple[str, int, bool]):
+        del self.entries[key]
+        keys = self._by_server.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_server[key[0]]
+
+    def merge(self, other: "ResponseCache"):
+        """Fold in another worker's cache entries and counters"""
+        self.entries.update(other.entries)
+        for ip_address, keys in other._by_server.items():
+            self._by_server.setdefault(ip_address, set()).update(keys)
+        self.hits += other.hits
+        self.misses += other.misses
+        self.expirations += other.expirations
+        self.evictions += other.evictions
+        self.invalidations += other.invalidations
+        self.saved_seconds += other.saved_seconds
+        self._evict()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "saved_ms": self.saved_seconds * 1000,
+        }
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+class RouteResult(NamedTuple):
+    """Structured outcome of one request routed by route_packets"""
+    index: int                 # Position of the request in the input
+    destination: str
+    ip_address: Optional[str]
+    protocol: str
+    status: int                # 200/403/404/503, or 0 if blocked by the firewall
+    reason: str                # "ok", "nxdomain", "no_route", firewall rule, ...
+    latency_ms: float          # Modeled latency
+    queue_ms: float = 0.0      # Time spent in the router's egress queue
+
+class AsyncRouteResult(NamedTuple):
+    """Outcome of one request on the asyncio engine (times are modeled)"""
+    destination: str
+    ip_address: Optional[str]
+    protocol: str
+    status: int
+    reason: str
+    latency_ms: float          # End to end, including queueing
+    queue_ms: float            # Waiting for a server worker
+    service_ms: float          # Server processing only
+
+class BatchResult:
+    """Result records plus aggregate counters for a batch of requests"""
     def __init__(self):
-        self.blacklisted_ips: List[str] = [
-            "192.168.2.100",  # Known attacker
-            "10.0.0.666",     # Invalid IP
-            "185.143.223.1"   # Suspicious IP
-        ]
-        self.security_rules = {
-            "block_malformed_packets": True,
-            "require_ttl_check": True,
-            "block_private_to_public": False,
-            "rate_limit": 10,  # Max packets per second
+        self.results: List[RouteResult] = []
+        self.counters: Dict[str, int] = {
+            "requests": 0,
+            "routed": 0,
+            "blocked": 0,
+            "dns_failures": 0,
+            "dns_lookups": 0,
+            "forwarded": 0,  # Handed to the router's forwarder (e.g. another shard)
         }
-        self.packet_history: List[Packet] = []
-        self.blocked_count = 0
-        
-    def inspect_packet(self, packet: Packet) -> tuple[bool, str]:
-        """Inspect packet against firewall rules"""
-        self.packet_history.append(packet)
-        
-        # Rule 1: Blacklisted IPs
-        if packet.source_ip in self.blacklisted_ips:
-            self.blocked_count += 1
-            return False, f"{Colors.RED}🚫 BLOCKED: Source IP in blacklist{Colors.END}"
-        
-        # Rule 2: TTL check
-        if self.security_rules["require_ttl_check"] and packet.ttl <= 0:
-            return False, f"{Colors.RED}🚫 BLOCKED: Packet TTL expired{Colors.END}"
-        
-        # Rule 3: Rate limiting (simplified)
-        recent_packets = [p for p in self.packet_history[-10:] 
-                         if p.source_ip == packet.source_ip]
-        if len(recent_packets) > self.security_rules["rate_limit"]:
-            return False, f"{Colors.RED}🚫 BLOCKED: Rate limit exceeded{Colors.END}"
-        
-        return True, f"{Colors.GREEN}✓ Firewall check passed{Colors.END}"
+        self.status_counts: Dict[int, int] = {}
+        self.total_latency_ms = 0.0
+
+    @property
+    def avg_latency_ms(self) -> float:
+        return self.total_latency_ms / max(1, self.counters["routed"])
 
-# ========== 5. ADVANCED ROUTER WITH QOS ==========
 class AdvancedRouter:
     """Enterprise-grade router with QoS and monitoring"""
-    def __init__(self, name: str = "CoreRouter-01"):
+    lookup_delay = 0.2   # Modeled routing table lookup time (seconds)
+    egress_bandwidth = 1e6  # Egress link rate (bits/second) drained by the QoS scheduler
+
+    def __init__(self, name: str = "CoreRouter-01", interactive: bool = False,
+                 history_size: int = 65536, events: Optional[EventBus] = None,
+                 dns_records: Optional[Dict[str, str]] = None):
         self.name = name
-        self.routing_table: Dict[str, Server] = {}
-        self.dns = DNSSystem()
-        self.firewall = Firewall()
-        self.packet_history: List[Packet] = []
+        self.interactive = interactive  # Real sleeps + animation for the menu
+        self.clock = SimClock(realtime=interactive)
+        self.scheduler = EventScheduler(self.clock)
+        # Interactive routers narrate to the console; headless ones are quiet
+        # unless a sink is added (router.events.add_sink(...))
+        if events is None:
+            events = EventBus(ConsoleEventSink(), clock=self.clock) if interactive \
+                else EventBus(clock=self.clock)
+        self.events = events
+        self.routing_table: Dict[str, Server] = {}  # Or a ServerPool at a virtual IP
+        self.pools: Dict[str, ServerPool] = {}
+        self.dns = DNSSystem(self.clock, records=dns_records, events=events)
+        self.firewall = Firewall(self.clock)
+        self.qos = QoSScheduler()
+        self.packet_history = PacketLog(history_size)  # Outcome per routed request
+        self.topology: Optional["Topology"] = None  # Multi-hop forwarding when attached
+        self.ingress = name
         self.routing_stats = {
             "packets_routed": 0,
             "packets_blocked": 0,
             "dns_requests": 0,
-            "avg_latency": 0.0
+            "avg_latency": 0.0  # Mean of self.latency.overall
         }
+        self.latency = LatencyStats()
+        self.metrics = StageMetrics(self.clock, {"router": name})
+        self.capture: Optional[TraceWriter] = None  # Set by start_capture()
+        self.response_cache: Optional[ResponseCache] = None  # Set by enable_response_cache()
+        # Batch path: called as forwarder(packet, meta, seconds so far) for
+        # destinations with no local route; returns True if it took the
+        # packet (e.g. to another shard of a sharded simulation)
+        self.forwarder: Optional[Callable[[Packet, tuple, float], bool]] = None
         
     def add_server(self, server: Server):
         """Add server to routing table"""
         self.routing_table[server.ip_address] = server
-        print(f"{Colors.CYAN}[{self.name}] Added {server.name} ({server.ip_address}) "
-              f"to routing table{Colors.END}")
+        server.clock = self.clock
+        server.status_listeners.append(self._invalidate_cached)
+        server.change_listeners.append(self._invalidate_cached)
+        self.events.emit(Level.INFO, "router.server_added", router=self.name,
+                         server=server.name, ip=server.ip_address)
+    
+    def add_servers(self, servers: Iterable[Server]) -> int:
+        """Register many servers in one pass, reported as a single event"""
+        table, clock = self.routing_table, self.clock
+        invalidate = self._invalidate_cached
+        added = 0
+        for server in servers:
+            table[server.ip_address] = server
+            server.clock = clock
+            server.status_listeners.append(invalidate)
+            server.change_listeners.append(invalidate)
+            added += 1
+        self.events.emit(Level.INFO, "router.servers_added", router=self.name, count=added)
+        return added
+
+    def add_pool(self, pool: ServerPool):
+        """Route a virtual IP to a load-balanced pool of servers"""
+        self.routing_table[pool.ip_address] = self.pools[pool.ip_address] = pool
+        pool.clock = self.clock
+        pool.events = self.events
+        pool.status_listeners.append(self._invalidate_cached)
+        pool.change_listeners.append(self._invalidate_cached)
+        self.events.emit(Level.INFO, "router.pool_added", router=self.name, pool=pool.name,
+                         ip=pool.ip_address, members=len(pool),
+                         balancer=type(pool.balancer).__name__)
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # An open capture file cannot be pickled: snapshots resume uncaptured
+        state = self.__dict__.copy()
+        state["capture"] = None
+        return state
+
+    def set_interactive(self, interactive: bool):
+        """Switch between menu mode (real sleeps, console narration) and headless"""
+        self.interactive = self.clock.realtime = interactive
+        consoles = [sink for sink in self.events.sinks if isinstance(sink, ConsoleEventSink)]
+        if interactive and not consoles:
+            self.events.add_sink(ConsoleEventSink())
+        elif not interactive:
+            for sink in consoles:
+                self.events.remove_sink(sink)
+
+    def enable_response_cache(self, capacity: int = 10000, ttl: float = 30.0) -> ResponseCache:
+        """Serve repeated successful requests from an edge cache (CDN-style)"""
+        self.response_cache = ResponseCache(self.clock, capacity, ttl)
+        return self.response_cache
+
+    def _invalidate_cached(self, server: Server):
+        if self.response_cache is not None:
+            self.response_cache.invalidate_server(server.ip_address)
+
+    @staticmethod
+    def _cache_key(packet: Packet) -> Tuple[Any, int, bool]:
+        """(destination, protocol, security context) for the response cache"""
+        source = packet.source
+        trusted = type(source) is int and RESTRICTED_NETWORKS.lookup(source) != DENY
+        return packet.destination_ip, packet.protocol_code, trusted
+
+    def attach_topology(self, topology: "Topology", ingress: Optional[str] = None):
+        """Forward through a multi-router topology, entering at `ingress`"""
+        self.topology = topology
+        self.ingress = ingress or self.name
+        topology.add_router(self.ingress)
+        for server in self.routing_table.values():
+            server.clock = self.clock
+
+    def _lookup_route(self, packet: Packet, ip_address: str) -> Tuple[Optional[Server], str]:
+        """Find the destination server; multi-hop transit time is charged here"""
+        self.clock.sleep(self.lookup_delay)
+        if self.topology is None:
+            server = self.routing_table.get(ip_address)
+            return server, ("ok" if server else "no_route")
+        server, reason, transit = self.topology.forward(packet, self.ingress)
+        self.clock.sleep(transit)
+        if server is not None:
+            server.clock = self.clock
+        return server, reason
+
+    @staticmethod
+    def needs_dns(destination: str) -> bool:
+        """True if destination is a domain name rather than an IP address"""
+        return "." in destination and not destination.replace(".", "").isdigit()
     
-    def route_packet(self, destination: str, protocol: str = "HTTP") -> Optional[str]:
+    def route_packet(self, destination: str, protocol: str = "HTTP",
+                     source_ip: str = "192.168.0.1") -> Optional[str]:
         """Main routing function with full packet handling"""
-        print(f"\n{Colors.YELLOW}══════════════════════════════════════════════════════════{Colors.END}")
-        print(f"{Colors.BLUE}[{self.name}] Processing request for: {destination}{Colors.END}")
+        events = self.events
+        events.emit(Level.INFO, "route.start", router=self.name, destination=destination,
+                    protocol=protocol, source_ip=source_ip)
         
-        start_time = time.time()
-        source_ip = "192.168.0.1"  # Default client IP
+        start_time = self.clock.now()
+        metrics = self.metrics
+        mark = metrics.start()
         
         # Step 1: DNS Resolution (if needed)
-        if "." in destination and not destination.replace(".", "").isdigit():
+        if self.needs_dns(destination):
             self.routing_stats["dns_requests"] += 1
-            print(f"{Colors.CYAN}[DNS] Resolving '{destination}'...{Colors.END}")
-            time.sleep(0.3)  # DNS lookup delay
+            events.emit(Level.INFO, "dns.resolving", domain=destination)
             ip_address = self.dns.resolve(destination)
             if not ip_address:
+                self._record_latency((self.clock.now() - start_time) * 1000, protocol, 404)
+                self._capture(start_time, source_ip, destination, None, protocol, 404, "nxdomain")
+                events.emit(Level.WARNING, "route.failed", destination=destination,
+                            status=404, reason="nxdomain")
                 return f"{Colors.RED}❌ DNS Resolution Failed: Cannot resolve '{destination}'{Colors.END}"
+            mark = metrics.lap(Stage.DNS, mark)
         else:
             ip_address = destination
         
@@ -230,52 +2834,522 @@ class AdvancedRouter:
             source_ip=source_ip,
             destination_ip=ip_address,
             data=f"Request for {destination}",
-            protocol=protocol
+            protocol=protocol,
+            created=self.clock.now()
         )
         
-        print(packet)
+        events.emit(Level.INFO, "packet.created", packet=packet)
+        mark = metrics.lap(Stage.PACKET, mark)
         
         # Step 3: Firewall inspection
-        print(f"{Colors.YELLOW}[FIREWALL] Inspecting packet...{Colors.END}")
-        allowed, firewall_msg = self.firewall.inspect_packet(packet)
-        if not allowed:
+        events.emit(Level.INFO, "firewall.inspecting", packet_id=packet.packet_id)
+        blocked_by = self.firewall.check(packet)
+        mark = metrics.lap(Stage.FIREWALL, mark)
+        if blocked_by:
             self.routing_stats["packets_blocked"] += 1
-            return firewall_msg
+            self.packet_history.record(packet, self.clock.now(), 0)
+            self._record_latency((self.clock.now() - start_time) * 1000, protocol, 0)
+            self._capture(start_time, source_ip, destination, ip_address, protocol, 0, blocked_by)
+            events.emit(Level.WARNING, "route.failed", destination=destination,
+                        status=0, reason=blocked_by)
+            return self.firewall.describe(blocked_by)
         
-        # Step 4: Routing table lookup
-        print(f"{Colors.CYAN}[ROUTING] Checking routing table for {ip_address}...{Colors.END}")
-        time.sleep(0.2)
+        # Edge cache: a fresh 200 for the same destination, protocol and security
+        # context skips egress, routing, transmission and server processing
+        cache = self.response_cache
+        cached = None
+        if cache is not None:
+            cache_key = self._cache_key(packet)
+            cached = cache.get(cache_key)
+        if cached is not None:
+            server, status, reason, responder = cached[0], 200, "cached", cached[3]
+            events.emit(Level.INFO, "cache.hit", server=server.name, saved_ms=cached[1] * 1000)
+        else:
+            miss_started = self.clock.now()
+            # Egress queueing (a single request never waits behind others)
+            if not self.qos.enqueue(packet, now=self.clock.now()):
+                self.routing_stats["packets_blocked"] += 1
+                self.packet_history.record(packet, self.clock.now(), 0)
+                self._record_latency((self.clock.now() - start_time) * 1000, protocol, 0)
+                self._capture(start_time, source_ip, destination, ip_address, protocol, 0, "queue_drop")
+                events.emit(Level.WARNING, "route.failed", destination=destination,
+                            status=0, reason="queue_drop")
+                return f"{Colors.RED}🚫 DROPPED: {self.qos.classify(packet).name} queue full{Colors.END}"
+            for _, _, _, egress_delay in self.qos.drain(self.egress_bandwidth):
+                self.clock.sleep(egress_delay)
+            mark = metrics.lap(Stage.EGRESS, mark)
         
-        if ip_address not in self.routing_table:
-            self.routing_stats["packets_blocked"] += 1
-            return f"{Colors.RED}❌ 404 Not Found: No route to {ip_address}{Colors.END}"
+            # Step 4: Routing table lookup
+            events.emit(Level.INFO, "routing.lookup", ip=ip_address)
+            server, route = self._lookup_route(packet, ip_address)
+            mark = metrics.lap(Stage.ROUTING, mark)
         
-        server = self.routing_table[ip_address]
+            if server is None:
+                self.routing_stats["packets_blocked"] += 1
+                self.packet_history.record(packet, self.clock.now(), 404)
+                self._record_latency((self.clock.now() - start_time) * 1000, protocol, 404)
+                self._capture(start_time, source_ip, destination, ip_address, protocol, 404, route)
+                events.emit(Level.WARNING, "route.failed", destination=destination,
+                            status=404, reason=route)
+                if route == "ttl_expired":
+                    return f"{Colors.RED}❌ TTL exceeded in transit to {ip_address}{Colors.END}"
+                return f"{Colors.RED}❌ 404 Not Found: No route to {ip_address}{Colors.END}"
         
-        # Step 5: Packet transmission (with animation)
-        packet.transmit_animation()
+            # Step 5: Packet transmission (animated only in interactive mode;
+            # with a topology attached, hop-by-hop transit was charged above)
+            if self.interactive:
+                packet.transmit_animation(clock=self.clock)
+            elif self.topology is None:
+                self.clock.sleep(packet.transmission_delay())
+            mark = metrics.lap(Stage.TRANSMISSION, mark)
         
-        # Step 6: Server processing
-        print(f"{Colors.GREEN}[SERVER] {server.name} processing request...{Colors.END}")
-        response = server.process_request(packet)
+            # Step 6: Server processing
+            events.emit(Level.INFO, "server.processing", server=server.name)
+            status, reason, responder = server.dispatch(packet)
+            if cache is not None and status == 200:
+                cache.put(cache_key, server, self.clock.now() - miss_started, responder)
+            mark = metrics.lap(Stage.SERVER, mark)
+        response = responder.render_response(status, reason, packet.protocol)
         
         # Step 7: Statistics update
         self.routing_stats["packets_routed"] += 1
-        end_time = time.time()
-        latency = (end_time - start_time) * 1000  # Convert to milliseconds
+        end_time = self.clock.now()
+        self.packet_history.record(packet, end_time, status)
+        latency = (end_time - start_time) * 1000  # Modeled latency in milliseconds
+        self._record_latency(latency, protocol, status, server.name)
+        self._capture(start_time, source_ip, destination, ip_address, protocol, status, reason)
+        
+        events.emit(Level.INFO, "route.complete", destination=destination, server=server.name,
+                    status=status, reason=reason, latency_ms=latency,
+                    routed=self.routing_stats["packets_routed"])
+        metrics.lap(Stage.STATS, mark)
+        
+        return response
+
+    def flush_metrics(self) -> Dict[str, Any]:
+        """Send stage costs, counters and latency gauges to the metric sinks"""
+        overall = self.latency.overall
+        counters = {
+            "packets_routed": self.routing_stats["packets_routed"],
+            "packets_blocked": self.routing_stats["packets_blocked"],
+            "dns_requests": self.routing_stats["dns_requests"],
+            "firewall_blocks": self.firewall.blocked_count,
+        }
+        gauges = {
+            "latency_p50_ms": overall.percentile(50),
+            "latency_p99_ms": overall.percentile(99),
+            "latency_p999_ms": overall.percentile(99.9),
+            "dns_cache_entries": len(self.dns.dns_cache),
+            "egress_queue_depth": len(self.qos),
+        }
+        if self.response_cache is not None:
+            edge = self.response_cache.stats()
+            counters["response_cache_hits"] = edge["hits"]
+            counters["response_cache_misses"] = edge["misses"]
+            counters["response_cache_saved_seconds"] = edge["saved_ms"] / 1000
+            gauges["response_cache_entries"] = edge["size"]
+        return self.metrics.flush(counters, gauges)
+
+    def merge_stats(self, other: "AdvancedRouter"):
+        """Fold another router's counters, histograms and cache stats into
+        this one, e.g. to report the shards of a sharded run as one network"""
+        for key in ("packets_routed", "packets_blocked", "dns_requests"):
+            self.routing_stats[key] += other.routing_stats[key]
+        self.latency.merge(other.latency)
+        self.routing_stats["avg_latency"] = self.latency.overall.mean
+        self.metrics.merge(other.metrics)
+        self.firewall.blocked_count += other.firewall.blocked_count
+        self.dns.lookup_count += other.dns.lookup_count
+        self.dns.dns_cache.merge(other.dns.dns_cache)
+        self.qos.merge(other.qos)
+        if other.response_cache is not None:
+            if self.response_cache is None:
+                self.enable_response_cache(other.response_cache.capacity, other.response_cache.ttl)
+            self.response_cache.merge(other.response_cache)
+        for ip_address, pool in other.pools.items():
+            self.pools.setdefault(ip_address, pool)  # Each pool lives on one shard
+
+    def start_capture(self, path: str) -> TraceWriter:
+        """Stream every routed request and its outcome to a binary trace file"""
+        self.stop_capture()
+        self.capture = TraceWriter(path)
+        return self.capture
+
+    def stop_capture(self) -> int:
+        """Finalize the current trace; returns the number of records written"""
+        capture, self.capture = self.capture, None
+        if capture is None:
+            return 0
+        capture.close()
+        return capture.count
+
+    def replay_trace(self, path: str, chunk_size: int = 4096, collect_results: bool = False,
+                     burst: bool = False) -> BatchResult:
+        """Feed a captured trace through this router as fast as possible
+        
+        The trace is memory-mapped and streamed through route_packets in
+        chunks; compare the result's status_counts with
+        TraceReader.status_counts() to diff router changes on identical
+        traffic. Modeled delays draw from `random`, so seed it for
+        repeatable latencies.
+        """
+        with TraceReader(path) as trace:
+            return self.route_packets(trace.requests(chunk_size), collect_results,
+                                      chunk_size, burst)
+
+    def _capture(self, timestamp: float, source, destination: str, ip_address: Optional[str],
+                 protocol: str, status: int, reason: str):
+        """Append one outcome to the active trace, if capturing"""
+        if self.capture is not None:
+            if type(source) is not int:
+                source = ip_to_int(source) or 0
+            self.capture.write(timestamp, source, ip_address, destination,
+                               protocol_code(protocol), status, reason)
+
+    def _record_latency(self, latency: float, protocol: str, status: int,
+                        server: Optional[str] = None):
+        """Record a request's latency in the histograms"""
+        self.latency.record(latency, protocol, status, server)
+        self.routing_stats["avg_latency"] = self.latency.overall.mean
+
+    def route_packets(self, requests: Iterable[Tuple[str, str, str]],
+                      collect_results: bool = True, chunk_size: int = 4096,
+                      burst: bool = False, profiler: Optional[Profiler] = None,
+                      arrivals: Optional[Sequence[float]] = None) -> BatchResult:
+        """Route a batch of (destination, protocol, source_ip) requests quietly
+        
+        Within each chunk, DNS is resolved once per distinct name (through
+        the resolver cache, so TTLs still apply across chunks) and requests
+        are grouped by destination server, so results come back grouped;
+        use RouteResult.index to restore input order.
+        
+        With burst=True each chunk arrives at the router at once: everything
+        that passes the firewall is queued on the QoS egress scheduler and
+        served in its order, so bulk traffic delays (or crowds out) the
+        lower-priority classes as it would on a congested link.
         
-        # Update average latency
-        if self.routing_stats["avg_latency"] == 0:
-            self.routing_stats["avg_latency"] = latency
+        Pass a Profiler to run the batch under cProfile and/or tracemalloc.
+        
+        `arrivals` gives the modeled time each request (by input position)
+        reached the router. The batch is taken up once the last of them has
+        arrived, and each latency then runs from the request's own arrival, so
+        time spent waiting for a busy router, or behind the rest of the batch,
+        counts toward it.
+        """
+        if profiler is not None:
+            with profiler:
+                return self.route_packets(requests, collect_results, chunk_size, burst,
+                                          arrivals=arrivals)
+        if arrivals:
+            self.clock.advance_to(max(arrivals))
+        batch = BatchResult()
+        chunk: List[tuple] = []
+        
+        for index, (destination, protocol, source_ip) in enumerate(requests):
+            chunk.append((index, destination, protocol, source_ip))
+            if len(chunk) >= chunk_size:
+                self._route_chunk(chunk, batch, collect_results, burst, arrivals)
+                chunk = []
+        if chunk:
+            self._route_chunk(chunk, batch, collect_results, burst, arrivals)
+        return batch
+
+    def _route_chunk(self, chunk: List[tuple], batch: BatchResult, collect_results: bool,
+                     burst: bool = False, arrivals: Optional[Sequence[float]] = None):
+        """Resolve, group by destination IP and route one chunk of a batch"""
+        counters = batch.counters
+        status_counts = batch.status_counts
+        stats = self.routing_stats
+        clock = self.clock
+        results = batch.results if collect_results else None
+        metrics = self.metrics
+        lap = metrics.lap
+        groups: Dict[Optional[str], List[tuple]] = {}
+        resolved: Dict[str, Optional[str]] = {}
+        arrived = clock.now()
+        outcomes: Optional[Dict[int, tuple]] = {} if self.capture is not None else None
+        
+        def finish(index, destination, ip_address, protocol, status, reason, latency,
+                   waited=0.0, server_name=None):
+            if arrivals is not None:
+                latency = (clock.now() - arrivals[index]) * 1000  # Sojourn time
+            status_counts[status] = status_counts.get(status, 0) + 1
+            if outcomes is not None:
+                outcomes[index] = (ip_address, status, reason)
+            if reason == "nxdomain":
+                counters["dns_failures"] += 1
+            elif status == 0 or status == 404:
+                counters["blocked"] += 1
+                stats["packets_blocked"] += 1
+            else:
+                # Step 7: Statistics update
+                counters["routed"] += 1
+                stats["packets_routed"] += 1
+                batch.total_latency_ms += latency
+            self._record_latency(latency, protocol, status, server_name)
+            if results is not None:
+                results.append(RouteResult(index, destination, ip_address, protocol,
+                                           status, reason, latency, waited))
+        
+        # Step 1: DNS Resolution, once per distinct name
+        for index, destination, protocol, source_ip in chunk:
+            dns_cost = 0.0
+            if self.needs_dns(destination):
+                if destination in resolved:
+                    ip_address = resolved[destination]
+                else:
+                    counters["dns_lookups"] += 1
+                    stats["dns_requests"] += 1
+                    mark = metrics.start()
+                    ip_address = resolved[destination] = self.dns.lookup(destination)
+                    dns_cost = clock.now() - mark[1]  # Nothing added on a cache hit
+                    lap(Stage.DNS, mark)
+            else:
+                ip_address = destination
+            groups.setdefault(ip_address, []).append(
+                (index, destination, protocol, source_ip, dns_cost))
+        
+        topology = self.topology
+        forwarder = self.forwarder
+        servers: Dict[str, Optional[Server]] = {}  # Flat lookups, once per destination
+        
+        def serve(packet, meta, waited, egress_delay, sent_from):
+            # Step 4-6: Routing lookup, transmission and server processing
+            index, destination, protocol, ip_address, dns_cost, cache_key = meta
+            # The packet leaves once its queue wait and serialization are over,
+            # as route_packet sleeps through it (a no-op if the clock is ahead)
+            clock.advance_to(sent_from + egress_delay)
+            metrics.add(Stage.EGRESS, egress_delay)
+            mark = metrics.start()
+            before = mark[1]
+            if topology is not None:
+                # Per packet with a topology, since TTL and link state matter
+                server, route = self._lookup_route(packet, ip_address)
+                mark = lap(Stage.ROUTING, mark)
+            else:
+                clock.sleep(self.lookup_delay)
+                server = servers[ip_address] if ip_address in servers else \
+                    servers.setdefault(ip_address, self.routing_table.get(ip_address))
+                route = "ok" if server else "no_route"
+                mark = lap(Stage.ROUTING, mark)
+                if server is not None:
+                    clock.sleep(packet.transmission_delay())
+                    mark = lap(Stage.TRANSMISSION, mark)
+            if arrivals is not None:
+                spent = clock.now() - arrivals[index]
+            else:
+                spent = dns_cost + egress_delay + clock.now() - before
+            if server is None:
+                if forwarder is not None and route == "no_route" and \
+                        forwarder(packet, meta, spent):
+                    counters["forwarded"] += 1
+                    return
+                status, reason = 404, route
+            else:
+                status, reason, responder = server.dispatch(packet)
+                if cache_key is not None and status == 200:
+                    cache.put(cache_key, server, egress_delay + clock.now() - before, responder)
+                mark = lap(Stage.SERVER, mark)
+            self.packet_history.record(packet, clock.now(), status)
+            finish(index, destination, ip_address, protocol, status, reason, spent * 1000,
+                   waited * 1000, server.name if server else None)
+            lap(Stage.STATS, mark)
+        
+        # Step 2-3: Create packets, run the firewall, answer from the edge cache
+        # or queue survivors for egress
+        qos = self.qos
+        cache = self.response_cache
+        cache_key = None
+        bandwidth = self.egress_bandwidth
+        for ip_address, group in groups.items():
+            for index, destination, protocol, source_ip, dns_cost in group:
+                counters["requests"] += 1
+                if ip_address is None:
+                    finish(index, destination, None, protocol, 404, "nxdomain", dns_cost * 1000)
+                    continue
+                mark = metrics.start()
+                packet = Packet(source_ip, ip_address, f"Request for {destination}",
+                                protocol, created=clock.now())
+                mark = lap(Stage.PACKET, mark)
+                blocked_by = self.firewall.check(packet)
+                mark = lap(Stage.FIREWALL, mark)
+                if blocked_by is None:
+                    if cache is not None:
+                        cache_key = self._cache_key(packet)
+                        cached = cache.get(cache_key)
+                        if cached is not None:
+                            self.packet_history.record(packet, clock.now(), 200)
+                            finish(index, destination, ip_address, protocol, 200, "cached",
+                                   dns_cost * 1000, 0.0, cached[0].name)
+                            lap(Stage.STATS, mark)
+                            continue
+                    meta = (index, destination, protocol, ip_address, dns_cost, cache_key)
+                    if not qos.enqueue(packet, meta, clock.now()):
+                        blocked_by = "queue_drop"
+                    mark = lap(Stage.EGRESS, mark)
+                if blocked_by:
+                    self.packet_history.record(packet, clock.now(), 0)
+                    finish(index, destination, ip_address, protocol, 0, blocked_by, dns_cost * 1000)
+                    lap(Stage.STATS, mark)
+                elif not burst:
+                    sent_from = clock.now()
+                    for item in qos.drain(bandwidth):
+                        serve(*item, sent_from)
+        
+        # Burst mode: the whole chunk leaves through egress in QoS order
+        sent_from = clock.now()
+        for item in qos.drain(bandwidth):
+            serve(*item, sent_from)
+        
+        # Capture in input order, stamped with each request's arrival time
+        if outcomes is not None:
+            for index, destination, protocol, source_ip in chunk:
+                ip_address, status, reason = outcomes[index]
+                self._capture(arrived if arrivals is None else arrivals[index], source_ip, destination, ip_address, protocol, status, reason)
+
+    def deliver(self, forwarded: Iterable[tuple], link_latency: float = 0.0) -> BatchResult:
+        """Serve packets another router forwarded here (see `forwarder`)
+        
+        Items are (sent at, source, ip address, destination, protocol, data,
+        ttl, upstream seconds), in timestamp order. Each packet arrives
+        `link_latency` after it was sent, already transmitted by the sender,
+        and finishes the pipeline here: routing lookup and server. Its
+        recorded latency includes
+        the upstream share, the link and any wait for this router to free up,
+        so histograms stay end to end.
+        """
+        batch = BatchResult()
+        counters, status_counts = batch.counters, batch.status_counts
+        stats, clock = self.routing_stats, self.clock
+        metrics = self.metrics
+        lap = metrics.lap
+        for sent_at, source, ip_address, destination, protocol, data, ttl, upstream in forwarded:
+            counters["requests"] += 1
+            clock.advance_to(sent_at + link_latency)
+            mark = metrics.start()
+            before = mark[1]
+            packet = Packet(source, ip_address, data, protocol, created=before)
+            packet.ttl = ttl
+            clock.sleep(self.lookup_delay)
+            server = self.routing_table.get(ip_address)
+            mark = lap(Stage.ROUTING, mark)
+            if server is None:
+                status = 404
+            else:
+                status = server.handle(packet)[0]
+                mark = lap(Stage.SERVER, mark)
+            self.packet_history.record(packet, clock.now(), status)
+            latency = (upstream + clock.now() - sent_at) * 1000
+            status_counts[status] = status_counts.get(status, 0) + 1
+            if status == 404:
+                counters["blocked"] += 1
+                stats["packets_blocked"] += 1
+            else:
+                counters["routed"] += 1
+                stats["packets_routed"] += 1
+                batch.total_latency_ms += latency
+            self._record_latency(latency, protocol, status, server.name if server else None)
+            lap(Stage.STATS, mark)
+        return batch
+
+    async def route_packet_async(self, destination: str, protocol: str = "HTTP",
+                                 source_ip: str = "192.168.0.1") -> AsyncRouteResult:
+        """Route one request on the asyncio engine
+        
+        Delays become asyncio sleeps, so many in-flight requests overlap their
+        DNS, transit and processing time. Run it on a SimEventLoop over the
+        router's clock (run_concurrent and run_load do): loop time is then
+        modeled time, and rate limits, DNS TTLs and histories stay consistent.
+        """
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        
+        def finish(ip_address, status, reason, waited=0.0, served=0.0, server=None):
+            latency = (loop.time() - started) * 1000
+            if status not in (0, 404):  # Reached a server
+                self.routing_stats["packets_routed"] += 1
+            elif reason != "nxdomain":
+                self.routing_stats["packets_blocked"] += 1
+            self._record_latency(latency, protocol, status, server.name if server else None)
+            self._capture(started, source_ip, destination, ip_address, protocol, status, reason)
+            return AsyncRouteResult(destination, ip_address, protocol, status, reason,
+                                    latency, waited * 1000, served * 1000)
+        
+        # Step 1: DNS Resolution (if needed)
+        ip_address = destination
+        if self.needs_dns(destination):
+            self.routing_stats["dns_requests"] += 1
+            ip_address = await self.dns.lookup_async(destination)
+            if ip_address is None:
+                return finish(None, 404, "nxdomain")
+        
+        # Step 2-3: Create packet and run the firewall
+        packet = Packet(source_ip, ip_address, f"Request for {destination}",
+                        protocol, created=self.clock.now())
+        blocked_by = self.firewall.check(packet)
+        if blocked_by:
+            self.packet_history.record(packet, self.clock.now(), 0)
+            return finish(ip_address, 0, blocked_by)
+        
+        # Edge cache: a fresh 200 skips routing, transit and the server
+        cache = self.response_cache
+        if cache is not None:
+            cache_key = self._cache_key(packet)
+            cached = cache.get(cache_key)
+            if cached is not None:
+                self.packet_history.record(packet, self.clock.now(), 200)
+                return finish(ip_address, 200, "cached", server=cached[0])
+        miss_started = self.clock.now()
+        
+        # Step 4-5: Routing lookup and transit
+        if self.topology is None:
+            server = self.routing_table.get(ip_address)
+            route, transit = ("ok" if server else "no_route"), packet.transmission_delay()
         else:
-            self.routing_stats["avg_latency"] = (
-                self.routing_stats["avg_latency"] * 0.9 + latency * 0.1
-            )
+            server, route, transit = self.topology.forward(packet, self.ingress)
+        await asyncio.sleep(self.lookup_delay + transit)
+        if server is None:
+            self.packet_history.record(packet, self.clock.now(), 404)
+            return finish(ip_address, 404, route)
         
-        print(f"{Colors.YELLOW}[STATS] Latency: {latency:.2f}ms | "
-              f"Packets routed: {self.routing_stats['packets_routed']}{Colors.END}")
+        # Step 6: Server processing (queueing reported separately)
+        server.clock = self.clock
+        status, reason, waited, served, responder = await server.dispatch_async(packet)
+        result = finish(ip_address, status, reason, waited, served, server)
+        if cache is not None and status == 200:
+            cache.put(cache_key, server, self.clock.now() - miss_started, responder)
+        self.packet_history.record(packet, self.clock.now(), status)
+        return result
+
+    async def route_packets_async(self, requests: Iterable[Tuple[str, str, str]],
+                                  max_in_flight: int = 1000) -> List[AsyncRouteResult]:
+        """Route (destination, protocol, source_ip) requests concurrently"""
+        limit = asyncio.Semaphore(max_in_flight)
         
-        return response
+        async def one(destination, protocol, source_ip):
+            async with limit:
+                return await self.route_packet_async(destination, protocol, source_ip)
+        
+        return await asyncio.gather(*(one(*request) for request in requests))
+
+    def run_concurrent(self, requests: Iterable[Tuple[str, str, str]],
+                       max_in_flight: int = 1000) -> List[AsyncRouteResult]:
+        """Blocking wrapper that runs route_packets_async on the router's clock"""
+        return run_simulated(self.route_packets_async(requests, max_in_flight), self.clock)
+
+    def schedule_request(self, delay: float, destination: str, protocol: str = "HTTP",
+                         on_result: Optional[Callable[[Optional[str]], None]] = None):
+        """Queue a request to be routed `delay` simulated seconds from now"""
+        self.scheduler.schedule(delay, self._run_scheduled, destination, protocol, on_result)
+
+    def _run_scheduled(self, destination: str, protocol: str, on_result):
+        result = self.route_packet(destination, protocol)
+        if on_result:
+            on_result(result)
+
+    def run_until_idle(self, until: Optional[float] = None) -> int:
+        """Drain the event queue (headless mode runs as fast as the CPU allows)"""
+        return self.scheduler.run(until)
     
     def show_routing_table(self):
         """Display routing table in formatted way"""
@@ -299,11 +3373,308 @@ class AdvancedRouter:
         print(f"Packets Blocked:   {self.routing_stats['packets_blocked']}")
         print(f"DNS Requests:      {self.routing_stats['dns_requests']}")
         print(f"Avg Latency:       {self.routing_stats['avg_latency']:.2f}ms")
+        overall = self.latency.overall
+        print(f"Latency p50/p99:   {overall.percentile(50):.2f}ms / {overall.percentile(99):.2f}ms "
+              f"(p99.9 {overall.percentile(99.9):.2f}ms)")
+        breakdown = [("protocol", k, h) for k, h in sorted(self.latency.by_protocol.items())]
+        breakdown += [("outcome", outcome_label(k), h) for k, h in sorted(self.latency.by_status.items())]
+        for label, key, histogram in breakdown:
+            print(f"  {label} {key:<8} n={histogram.count:<7} p50 {histogram.percentile(50):9.2f}ms"
+                  f" | p99 {histogram.percentile(99):9.2f}ms")
+        metrics = self.metrics
+        for stage, name in enumerate(STAGE_NAMES):
+            calls = metrics.calls[stage]
+            if calls:
+                print(f"  stage {name:<12} n={calls:<7} wall {metrics.wall_ns[stage] / calls / 1000:8.1f}us"
+                      f" | sim {metrics.sim_seconds[stage] / calls * 1000:9.2f}ms")
         print(f"Firewall Blocks:   {self.firewall.blocked_count}")
-        print(f"DNS Cache Size:    {len(self.dns.dns_cache)} entries")
+        cache = self.dns.dns_cache.stats()
+        print(f"DNS Cache Size:    {cache['size']} entries")
+        print(f"DNS Cache Hits:    {cache['hits'] + cache['negative_hits']} "
+              f"({cache['hit_ratio']:.1%}) | Misses: {cache['misses']} | "
+              f"Evictions: {cache['evictions']}")
+        if self.response_cache is not None:
+            edge = self.response_cache.stats()
+            print(f"Response Cache:    {edge['hits']} hits ({edge['hit_ratio']:.1%}) | "
+                  f"saved {edge['saved_ms'] / 1000:.1f}s | {edge['size']} entries | "
+                  f"{edge['invalidations']} invalidated")
+        for name, qos in self.qos.stats().items():
+            print(f"QoS {name:<12}   sent {qos['sent']} | dropped "
+                  f"{qos['tail_drops'] + qos['red_drops']} | max depth {qos['max_depth']} | "
+                  f"avg wait {qos['avg_wait_ms']:.2f}ms")
+        for pool in self.pools.values():
+            healthy = sum(member.healthy for member in pool.members)
+            print(f"Pool {pool.name:<13} {pool.ip_address} | {type(pool.balancer).__name__} | "
+                  f"{healthy}/{len(pool)} healthy | {pool.requests_served} requests | "
+                  f"{pool.rejected} rejected")
+            for member in pool.stats():
+                state = "up" if member["healthy"] else "DOWN"
+                print(f"  {member['server']:<16} {state:<4} n={member['requests']:<7} "
+                      f"share {member['share']:6.1%} | errors {member['errors']} | "
+                      f"peak in flight {member['max_outstanding']} | "
+                      f"service {member['mean_service_ms']:.2f}ms")
         print(f"{Colors.CYAN}{'─'*40}{Colors.END}")
 
-# ========== 6. NETWORK VISUALIZATION ==========
+# ========== 6. MULTI-ROUTER TOPOLOGY ==========
+class Link:
+    """Bidirectional link between two routers"""
+    __slots__ = ("a", "b", "latency", "bandwidth", "is_up", "packets")
+
+    def __init__(self, a: str, b: str, latency: float = 0.001, bandwidth: float = 1e9):
+        self.a = a
+        self.b = b
+        self.latency = latency      # Propagation delay (seconds); also the routing metric
+        self.bandwidth = bandwidth  # Bits per second
+        self.is_up = True
+        self.packets = 0
+
+    def transit_time(self, size: int) -> float:
+        """Propagation plus serialization delay for a packet of `size` bytes"""
+        return self.latency + size * 8 / self.bandwidth
+
+class Topology:
+    """Graph of routers and links with per-router longest-prefix-match FIBs
+    
+    Each prefix is announced by one router. For every announcing router we
+    keep a shortest-path tree (Dijkstra on link latency) and install the next
+    hop toward it in every other router's forwarding table. Servers' /32s
+    stay out of the tables: a host route only records its router, and the
+    next hop is read from that router's tree at lookup time, so attaching
+    100k servers costs the same with one router or fifty. Changes are
+    incremental: a server going on/offline only adds or drops its host
+    route, and a link change only recomputes the trees it can affect.
+    """
+    def __init__(self):
+        self.adjacency: Dict[str, Dict[str, Link]] = {}
+        self.fibs: Dict[str, PrefixTrie] = {}        # router -> prefix -> next hop
+        self.announcements: Dict[str, Dict[str, bool]] = {}  # router -> announced prefixes
+        self.servers: Dict[int, Server] = {}         # Attached hosts by address
+        self.host_routes: Dict[int, str] = {}        # Announced /32s: address -> router
+        self._server_routers: Dict[int, str] = {}
+        self._trees: Dict[str, Tuple[Dict[str, float], Dict[str, str]]] = {}  # dest -> (dist, next hop)
+        self.tree_computations = 0
+
+    def add_router(self, name: str):
+        if name not in self.adjacency:
+            self.adjacency[name] = {}
+            self.fibs[name] = PrefixTrie()
+            self.announcements[name] = {}
+
+    def add_link(self, a: str, b: str, latency: float = 0.001, bandwidth: float = 1e9) -> Link:
+        """Connect two routers (created on demand)"""
+        self.add_router(a)
+        self.add_router(b)
+        link = Link(a, b, latency, bandwidth)
+        self.adjacency[a][b] = link
+        self.adjacency[b][a] = link
+        self._link_improved(link)
+        return link
+
+    def link(self, a: str, b: str) -> Link:
+        return self.adjacency[a][b]
+
+    def set_link_state(self, a: str, b: str, up: bool):
+        """Bring a link up or down, recomputing only affected routes"""
+        link = self.adjacency[a][b]
+        if link.is_up == up:
+            return
+        link.is_up = up
+        if up:
+            self._link_improved(link)
+        else:
+            self._link_degraded(link)
+
+    def set_link_latency(self, a: str, b: str, latency: float):
+        link = self.adjacency[a][b]
+        old_latency, link.latency = link.latency, latency
+        if not link.is_up:
+            return
+        if latency < old_latency:
+            self._link_improved(link)
+        elif latency > old_latency:
+            self._link_degraded(link)
+
+    def announce(self, router: str, cidr: str):
+        """Originate a prefix at router and install it network-wide"""
+        self.add_router(router)
+        self.announcements[router][cidr] = True
+        if router not in self._trees:
+            self._compute_tree(router)
+        for node, next_hop in self._trees[router][1].items():
+            self.fibs[node].insert(cidr, next_hop)
+
+    def withdraw(self, router: str, cidr: str):
+        """Remove a prefix from every forwarding table"""
+        if self.announcements[router].pop(cidr, None) is None:
+            return
+        for node in self._trees[router][1]:
+            self.fibs[node].remove(cidr)
+
+    def _announce_host(self, router: str, address: int):
+        """Route one address to router, ahead of any prefix that covers it"""
+        self.add_router(router)
+        if router not in self._trees:
+            self._compute_tree(router)
+        self.host_routes[address] = router
+
+    def next_hop(self, node: str, address: int) -> Optional[str]:
+        """Longest-prefix match at node: a host route first, then its FIB"""
+        router = self.host_routes.get(address)
+        if router is not None:
+            hop = self._trees[router][1].get(node)
+            if hop is not None:  # Otherwise unreachable from node, as a FIB would have it
+                return hop
+        return self.fibs[node].lookup(address)
+
+    def attach_server(self, router: str, server: Server, withdraw_offline: bool = True):
+        """Connect a server to a router and announce its /32 while online
+        
+        With withdraw_offline=False the /32 stays announced and an offline
+        server answers 503 itself. Pools need this: their health checks run
+        when traffic reaches them, so a withdrawn pool could never recover.
+        """
+        address = ip_to_int(server.ip_address)
+        if address is None:
+            raise ValueError(f"Invalid server address: {server.ip_address!r}")
+        self.servers[address] = server
+        self._server_routers[address] = router
+        if not withdraw_offline:
+            self._announce_host(router, address)
+            return
+        server.status_listeners.append(self._server_changed)
+        if server.is_online:
+            self._announce_host(router, address)
+        else:
+            self.add_router(router)
+
+    def attach_servers(self, router: str, servers: Iterable[Server],
+                       announce_hosts: bool = True) -> int:
+        """Attach many servers to one router; returns the number attached
+        
+        Host routes share the router's one shortest-path tree. With
+        announce_hosts=False no /32s are added at all: the router is expected
+        to announce an aggregate prefix covering the servers, and an offline
+        server answers 503 itself instead of having its route withdrawn.
+        """
+        self.add_router(router)
+        if announce_hosts and router not in self._trees:
+            self._compute_tree(router)
+        host_routes = self.host_routes
+        attached = 0
+        for server in servers:
+            address = parse_ipv4(server.ip_address)
+            if address is None:
+                raise ValueError(f"Invalid server address: {server.ip_address!r}")
+            self.servers[address] = server
+            self._server_routers[address] = router
+            attached += 1
+            if not announce_hosts:
+                continue
+            server.status_listeners.append(self._server_changed)
+            if server.is_online:
+                host_routes[address] = router
+        return attached
+
+    def _server_changed(self, server: Server):
+        address = ip_to_int(server.ip_address)
+        router = self._server_routers.get(address)
+        if router is None:
+            return
+        if server.is_online:
+            self._announce_host(router, address)
+        else:
+            self.host_routes.pop(address, None)
+
+    def forward(self, packet: Packet, ingress: str) -> Tuple[Optional[Server], str, float]:
+        """Carry a packet hop by hop; returns (server, reason, transit seconds)"""
+        destination = packet.destination
+        if type(destination) is not int:
+            return None, "no_route", 0.0
+        fibs, adjacency = self.fibs, self.adjacency
+        host = self.host_routes.get(destination)
+        tree = self._trees[host][1] if host is not None else {}
+        node = ingress
+        transit = 0.0
+        while True:
+            next_hop = tree.get(node) or fibs[node].lookup(destination)
+            if next_hop is None:
+                return None, "no_route", transit
+            if next_hop == node:  # Delivered to the announcing router
+                if self._server_routers.get(destination) != node:
+                    return None, "no_route", transit
+                return self.servers[destination], "ok", transit
+            packet.ttl -= 1
+            if packet.ttl <= 0:
+                return None, "ttl_expired", transit
+            link = adjacency[node][next_hop]
+            link.packets += 1
+            transit += link.transit_time(packet.size)
+            node = next_hop
+
+    def path(self, ingress: str, ip: str) -> List[str]:
+        """Router names a packet to ip would traverse from ingress"""
+        destination = ip_to_int(ip)
+        hops = [ingress]
+        while destination is not None and len(hops) <= len(self.adjacency):
+            next_hop = self.next_hop(hops[-1], destination)
+            if next_hop is None or next_hop == hops[-1]:
+                break
+            hops.append(next_hop)
+        return hops
+
+    def _compute_tree(self, destination: str):
+        """Dijkstra from destination over up links; next hop points toward it"""
+        self.tree_computations += 1
+        dist = {destination: 0.0}
+        next_hop = {destination: destination}
+        heap = [(0.0, destination)]
+        adjacency = self.adjacency
+        while heap:
+            d, node = heapq.heappop(heap)
+            if d > dist[node]:
+                continue
+            for neighbor, link in adjacency[node].items():
+                if not link.is_up:
+                    continue
+                candidate = d + link.latency
+                if candidate < dist.get(neighbor, float("inf")):
+                    dist[neighbor] = candidate
+                    next_hop[neighbor] = node
+                    heapq.heappush(heap, (candidate, neighbor))
+        self._trees[destination] = (dist, next_hop)
+
+    def _refresh_tree(self, destination: str):
+        """Recompute one tree and rewrite only FIB entries whose next hop moved"""
+        old_next = self._trees[destination][1]
+        self._compute_tree(destination)
+        new_next = self._trees[destination][1]
+        prefixes = self.announcements[destination]
+        for node in set(old_next) | set(new_next):
+            hop = new_next.get(node)
+            if hop == old_next.get(node):
+                continue
+            fib = self.fibs[node]
+            for cidr in prefixes:
+                if hop is None:
+                    fib.remove(cidr)
+                else:
+                    fib.insert(cidr, hop)
+
+    def _link_degraded(self, link: Link):
+        """Only trees that route over the link can get worse"""
+        for destination, (_, next_hop) in list(self._trees.items()):
+            if next_hop.get(link.a) == link.b or next_hop.get(link.b) == link.a:
+                self._refresh_tree(destination)
+
+    def _link_improved(self, link: Link):
+        """Only trees where the link offers a shorter path can change"""
+        infinity = float("inf")
+        for destination, (dist, _) in list(self._trees.items()):
+            da, db = dist.get(link.a, infinity), dist.get(link.b, infinity)
+            if da > db + link.latency or db > da + link.latency:
+                self._refresh_tree(destination)
+
+# ========== 7. NETWORK VISUALIZATION ==========
 def draw_network_map(router: AdvancedRouter):
     """Draw ASCII network topology map"""
     print(f"\n{Colors.HEADER}{' NETWORK TOPOLOGY MAP ':=^60}{Colors.END}")
@@ -338,11 +3709,14 @@ def draw_network_map(router: AdvancedRouter):
     
     print(f"\n{Colors.CYAN}{' Legend: 🟢=Online 🔴=Offline ':=^60}{Colors.END}")
 
-# ========== 7. MAIN NETWORK MANAGER ==========
+# ========== 8. MAIN NETWORK MANAGER ==========
 class NetworkManager:
     """Main orchestrator for the entire network"""
-    def __init__(self):
-        self.router = AdvancedRouter("CoreRouter-01")
+    def __init__(self, config: Optional[Dict[str, Any]] = None,
+                 router: Optional[AdvancedRouter] = None, snapshot_path: Optional[str] = None):
+        self.config = DEMO_NETWORK if config is None else config
+        self.router = router  # Built by setup_network() unless resuming a snapshot
+        self.snapshot_path = snapshot_path  # Saved here on exit, to resume later
         self.servers: List[Server] = []
         self.setup_complete = False
         
@@ -350,33 +3724,21 @@ class NetworkManager:
         """Initialize the complete network infrastructure"""
         print(f"{Colors.HEADER}{' PROJECT GLASS v2.0 - VIRTUAL INTERNET SIMULATOR ':=^60}{Colors.END}")
         print(f"{Colors.BLUE}Initializing Advanced Network Infrastructure...{Colors.END}")
-        time.sleep(1)
-        
-        # Create enterprise servers
-        self.servers = [
-            Server("192.168.1.1", "Google", "Welcome to Google Search", 2, "WEB"),
-            Server("192.168.1.2", "SecureBank", "🔒 Banking Portal - $10,284.52", 3, "WEB"),
-            Server("192.168.1.3", "MailServer", "📧 5 Unread Messages", 2, "MAIL"),
-            Server("192.168.1.4", "CloudDrive", "☁️ 15.2GB of 20GB used", 1, "FILE"),
-            Server("192.168.1.5", "YouTube", "▶️ Trending Videos", 1, "WEB"),
-            Server("192.168.1.6", "GitHub", "💻 Repositories: 12", 2, "WEB"),
-            Server("192.168.1.7", "Database", "🗄️ MySQL Server v8.0", 3, "DB"),
-            Server("192.168.1.8", "FirewallLog", "📊 Security Monitoring", 3, "WEB")
-        ]
-        
-        # Add all servers to router
-        for server in self.servers:
-            self.router.add_server(server)
-        
-        # Make some servers offline for demo
-        self.servers[2].is_online = False  # MailServer
-        self.servers[6].is_online = False  # Database
+        
+        started = time.perf_counter()
+        if self.router is None:
+            self.router = build_network(self.config, interactive=True)
+        else:
+            self.router.set_interactive(True)
+        self.servers = [server for server in self.router.routing_table.values()
+                        if isinstance(server, Server)]
+        elapsed = time.perf_counter() - started
         
         self.setup_complete = True
-        print(f"{Colors.GREEN}✅ Network initialization complete!{Colors.END}")
+        print(f"{Colors.GREEN}✅ Network initialization complete! "
+              f"({len(self.servers)} servers in {elapsed * 1000:.0f} ms){Colors.END}")
         print(f"{Colors.GREEN}✅ DNS System ready with {len(self.router.dns.dns_records)} records{Colors.END}")
-        print(f"{Colors.GREEN}✅ Firewall active with {len(self.router.firewall.blacklisted_ips)} rules{Colors.END}")
-        time.sleep(1)
+        print(f"{Colors.GREEN}✅ Firewall active with {len(self.router.firewall.ip_rules)} rules{Colors.END}")
     
     def show_dashboard(self):
         """Display main dashboard"""
@@ -464,36 +3826,36 @@ class NetworkManager:
                 input(f"\n{Colors.YELLOW}Press Enter to continue...{Colors.END}")
                 
             elif choice == "7":
-                print(f"\n{Colors.BLUE}Starting stress test...{Colors.END}")
-                for i in range(5):
-                    domain = random.choice(["google.com", "bank.com", "youtube.com"])
-                    print(f"\nTest {i+1}: Requesting {domain}")
-                    result = self.router.route_packet(domain)
-                    print(f"  {result}")
-                    time.sleep(0.3)
+                count = input(f"{Colors.CYAN}Number of requests [20000]: {Colors.END}").strip()
+                print(f"\n{Colors.BLUE}Starting stress test (headless copy of this network)...{Colors.END}")
+                headless = clone_network(self.router)
+                headless.latency = LatencyStats()  # Report only the stress test
+                workload = Workload(seed=42, unknown_ratio=0.02, hostile_ratio=0.01)
+                report = run_load(headless, workload.requests(int(count) if count.isdigit() else 20_000))
+                print_load_report(report)
                 print(f"\n{Colors.GREEN}✅ Stress test complete!{Colors.END}")
                 input(f"\n{Colors.YELLOW}Press Enter to continue...{Colors.END}")
                 
             elif choice == "8":
                 print(f"\n{Colors.RED}🚨 SIMULATING NETWORK ATTACK 🚨{Colors.END}")
-                print(f"{Colors.YELLOW}Sending malicious packets from blacklisted IP...{Colors.END}")
-                
-                # Simulate attack from blacklisted IP
-                for i in range(3):
-                    print(f"\nAttack attempt {i+1}...")
-                    # This should be blocked by firewall
-                    print(f"{Colors.RED}Expected: Blocked by firewall{Colors.END}")
-                    # Note: The actual blocking happens in route_packet
-                    time.sleep(0.5)
-                
-                print(f"\n{Colors.GREEN}✅ Firewall successfully blocked all attacks!{Colors.END}")
-                print(f"{Colors.GREEN}✅ Network security verified{Colors.END}")
+                names = list(ATTACK_SCENARIOS)
+                for i, name in enumerate(names, 1):
+                    print(f"{Colors.CYAN}{i}.{Colors.END} {name:<14} {ATTACK_SCENARIOS[name].description}")
+                picked = input(f"\n{Colors.GREEN}Scenario (1-{len(names)}) [{len(names)}]: {Colors.END}").strip()
+                name = names[int(picked) - 1] if picked.isdigit() and 1 <= int(picked) <= len(names) else names[-1]
+                print(f"{Colors.YELLOW}Flooding a copy of this network's firewall for 10 simulated seconds...{Colors.END}")
+                report = simulate_attack(clone_network(self.router).firewall, name)
+                print_attack_report(report)
                 input(f"\n{Colors.YELLOW}Press Enter to continue...{Colors.END}")
                 
             elif choice == "9":
                 print(f"\n{Colors.HEADER}{' SHUTTING DOWN NETWORK ':=^60}{Colors.END}")
                 print(f"{Colors.BLUE}Final Statistics:{Colors.END}")
                 self.router.show_statistics()
+                if self.snapshot_path:
+                    size = save_snapshot(self.router, self.snapshot_path)
+                    print(f"\n{Colors.GREEN}✅ Network state saved to {self.snapshot_path} "
+                          f"({size / 1024:.0f} KB){Colors.END}")
                 print(f"\n{Colors.GREEN}✅ Project Glass v2.0 shutdown complete.{Colors.END}")
                 print(f"{Colors.GREEN}✅ All systems secure.{Colors.END}")
                 break
@@ -502,8 +3864,1338 @@ class NetworkManager:
                 print(f"{Colors.RED}Invalid option. Please try again.{Colors.END}")
                 time.sleep(1)
 
-# ========== 8. MAIN EXECUTION ==========
+# ========== 9. CONFIGURATION & SNAPSHOTS ==========
+# Declarative network description (JSON; DEMO_NETWORK is an example):
+#   router:        {"name", "history_size", "response_cache": {"capacity", "ttl"}}
+#   defaults:      field defaults for every server (see SERVER_DEFAULTS)
+#   servers:       [{"ip", "name", "content", "security_level", "type", "online",
+#                    "workers", "queue_limit", "domains": [...], "router"}]
+#   server_groups: [{"cidr", "count", ...server fields}] - `count` servers numbered
+#                  from the block's first host; "{index}" and "{ip}" in name,
+#                  content and domains are filled in per server
+#   dns:           {"records": {name: ip}, "zone_files": [...], "ttl"}
+#   firewall:      {"block": [cidr], "allow": [cidr], "blocklists": [...], "rules": {...}}
+#   pools:         [{"ip", "name", "members": [ip or cidr], "balancer", "domains": [...],
+#                    "health_check": {"interval", "rise", "fall"}, "router"}] - a
+#                  virtual IP served by every configured server in `members`
+#   topology:      {"ingress", "links": [{"a", "b", "latency", "bandwidth"}],
+#                   "announce": {router: [cidr]}, "host_routes": true}
+SERVER_DEFAULTS: Dict[str, Any] = {
+    "content": "", "security_level": 1, "type": "WEB", "online": True,
+    "workers": 1, "queue_limit": 64, "domains": (), "router": None,
+}
+
+SNAPSHOT_FORMAT = "project-glass-snapshot"
+SNAPSHOT_VERSION = 2
+
+class PausedGC:
+    """Context manager that suspends the cyclic garbage collector
+    
+    Building or unpickling a large network allocates hundreds of thousands
+    of long-lived objects; each allocation burst would otherwise trigger a
+    collection that rescans everything built so far, for nothing.
+    """
+    def __enter__(self):
+        self.was_enabled = gc.isenabled()
+        gc.disable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.was_enabled:
+            gc.enable()
+        return False
+
+def load_config(path: str) -> Dict[str, Any]:
+    """Read a JSON network description
+    
+    Zone files and blocklists named with relative paths are resolved
+    against the directory of the config file.
+    """
+    with open(path, encoding="utf-8") as handle:
+        config = json.load(handle)
+    base = os.path.dirname(os.path.abspath(path))
+    for section, key in (("dns", "zone_files"), ("firewall", "blocklists")):
+        files = config.get(section, {}).get(key)
+        if files:
+            config[section][key] = [os.path.join(base, name) for name in files]
+    return config
+
+class ServerSpec(NamedTuple):
+    """One server definition from a config, with defaults applied"""
+    ip: str
+    name: str
+    content: str
+    security_level: int
+    type: str
+    online: bool
+    workers: int
+    queue_limit: int
+    domains: List[str]
+    router: Optional[str]   # Topology router it attaches to (None = ingress)
+
+def server_specs(config: Dict[str, Any]) -> Iterator[ServerSpec]:
+    """Every server defined by a config: explicit servers, then groups"""
+    defaults = {**SERVER_DEFAULTS, **config.get("defaults", {})}
+    fields = ServerSpec._fields
+    for spec in config.get("servers", ()):
+        if "ip" not in spec or "name" not in spec:
+            raise ValueError(f"Server definition needs an ip and a name: {spec!r}")
+        merged = {**defaults, **spec}
+        yield ServerSpec(*(merged[field] for field in fields))
+    for group in config.get("server_groups", ()):
+        network, prefix_len = parse_cidr(group["cidr"])
+        hosts = max(1, (1 << (32 - prefix_len)) - 2)
+        count = group.get("count", hosts)
+        if count > hosts:
+            raise ValueError(f"{group['cidr']} cannot hold {count} servers")
+        merged = {**defaults, "ip": "", **group}
+        template = ServerSpec(*(merged[field] for field in fields))
+        name, content, domains = template.name, template.content, template.domains
+        settings, router = template[3:8], template.router  # security_level..queue_limit
+        content_varies = "{" in content  # Most groups share one content string
+        for index in range(count):
+            ip = int_to_ip(network + 1 + index)
+            yield ServerSpec(ip, name.format(index=index, ip=ip),
+                             content.format(index=index, ip=ip) if content_varies else content,
+                             *settings, [domain.format(index=index, ip=ip) for domain in domains],
+                             router)
+
+class PoolSpec(NamedTuple):
+    """One load-balanced pool from a config, with defaults applied"""
+    ip: str
+    name: str
+    members: List[Tuple[int, int]]  # (network, prefix length) blocks of member addresses
+    balancer: str
+    domains: List[str]
+    check_interval: float
+    rise: int
+    fall: int
+    router: Optional[str]
+
+def _in_blocks(address: Optional[int], blocks: List[Tuple[int, int]]) -> bool:
+    return address is not None and any(
+        address >> (32 - prefix_len) == network >> (32 - prefix_len)
+        for network, prefix_len in blocks)
+
+def pool_specs(config: Dict[str, Any]) -> Iterator[PoolSpec]:
+    """Every pool defined by a config"""
+    for spec in config.get("pools", ()):
+        if "ip" not in spec or "name" not in spec or not spec.get("members"):
+            raise ValueError(f"Pool definition needs an ip, a name and members: {spec!r}")
+        if spec.get("balancer", "round-robin") not in BALANCERS:
+            raise ValueError(f"Unknown balancer in pool {spec['name']}: {spec['balancer']!r}")
+        checks = spec.get("health_check", {})
+        yield PoolSpec(spec["ip"], spec["name"], [parse_cidr(cidr) for cidr in spec["members"]],
+                       spec.get("balancer", "round-robin"), spec.get("domains", []),
+                       checks.get("interval", 5.0), checks.get("rise", 2),
+                       checks.get("fall", 3), spec.get("router"))
+
+def build_network(config: Dict[str, Any], interactive: bool = False,
+                  select: Optional[Callable[[Any], bool]] = None) -> AdvancedRouter:
+    """Build a router, and its topology if described, from a config
+    
+    Servers, DNS records, firewall rules and host routes are registered
+    through the bulk APIs, so each index is built in a single pass and the
+    router reports one summary event instead of a line per server. DNS
+    records come from each server's `domains` plus the explicit `dns`
+    section, so zone data always matches the servers. With `select`, only
+    matching servers and pools (ServerSpec / PoolSpec) are built, but every
+    DNS name is kept (a shard still resolves names of servers that live
+    elsewhere); a selected pool brings all of its members along.
+    """
+    with PausedGC():
+        router_spec = config.get("router", {})
+        topology_spec = config.get("topology")
+        dns_spec = config.get("dns", {})
+        firewall_spec = config.get("firewall", {})
+        name = router_spec.get("name", "CoreRouter-01")
+        ingress = (topology_spec or {}).get("ingress") or name
+        
+        # Step 1: Servers (on the router's clock), their DNS names and the
+        # topology routers they attach to
+        router = AdvancedRouter(name, interactive, router_spec.get("history_size", 65536),
+                                dns_records={})
+        clock = router.clock
+        servers: List[Server] = []
+        placement: Dict[str, List[Server]] = {}
+        records: Dict[str, str] = {}
+        pools = list(pool_specs(config))
+        candidates: List[Tuple[ServerSpec, Optional[int]]] = []  # Unselected servers a pool may need
+        borrowed: Dict[str, Server] = {}  # Built only as pool members
+        
+        def make(spec: ServerSpec) -> Server:
+            server = Server(spec.ip, spec.name, spec.content, spec.security_level, spec.type,
+                            spec.workers, spec.queue_limit, clock)
+            if not spec.online:
+                server.is_online = False
+            return server
+        
+        for spec in server_specs(config):
+            for domain in spec.domains:
+                records[domain] = spec.ip
+            if select is not None and not select(spec):
+                if pools:
+                    candidates.append((spec, parse_ipv4(spec.ip)))
+                continue
+            server = make(spec)
+            servers.append(server)
+            placement.setdefault(spec.router or ingress, []).append(server)
+        
+        # Step 1b: Pools, each over every configured server inside its member blocks
+        server_pools: List[ServerPool] = []
+        pool_placement: List[Tuple[str, ServerPool]] = []
+        for pool_spec in pools:
+            for domain in pool_spec.domains:
+                records[domain] = pool_spec.ip
+            if select is not None and not select(pool_spec):
+                continue
+            members = [server for server in servers
+                       if _in_blocks(parse_ipv4(server.ip_address), pool_spec.members)]
+            for spec, address in candidates:
+                if _in_blocks(address, pool_spec.members):
+                    if spec.ip not in borrowed:
+                        borrowed[spec.ip] = make(spec)
+                    members.append(borrowed[spec.ip])
+            if not members:
+                raise ValueError(f"Pool {pool_spec.name} has no servers in its member blocks")
+            pool = ServerPool(pool_spec.ip, pool_spec.name, members, pool_spec.balancer,
+                              pool_spec.check_interval, pool_spec.rise, pool_spec.fall, clock)
+            server_pools.append(pool)
+            pool_placement.append((pool_spec.router or ingress, pool))
+        records.update(dns_spec.get("records", {}))
+        
+        # Step 2: DNS zones, firewall rules and the routing table
+        router.dns.add_records(records.items(), dns_spec.get("ttl"))
+        for path in dns_spec.get("zone_files", ()):
+            router.dns.load_zone_file(path)
+        firewall = router.firewall
+        for cidr in firewall_spec.get("block", ()):
+            firewall.block(cidr)
+        for cidr in firewall_spec.get("allow", ()):
+            firewall.allow(cidr)
+        for path in firewall_spec.get("blocklists", ()):
+            firewall.load_blocklist(path)
+        firewall.security_rules.update(firewall_spec.get("rules", {}))
+        if "response_cache" in router_spec:
+            router.enable_response_cache(**router_spec["response_cache"])
+        router.add_servers(servers)
+        for pool in server_pools:
+            router.add_pool(pool)
+        
+        # Step 3: Multi-router topology
+        if topology_spec is not None:
+            topology = Topology()
+            topology.add_router(ingress)
+            for link in topology_spec.get("links", ()):
+                topology.add_link(link["a"], link["b"], link.get("latency", 0.001),
+                                  link.get("bandwidth", 1e9))
+            for node, prefixes in topology_spec.get("announce", {}).items():
+                for cidr in prefixes:
+                    topology.announce(node, cidr)
+            host_routes = topology_spec.get("host_routes", True)
+            for node, attached in placement.items():
+                if host_routes:
+                    topology.attach_servers(node, attached)
+                    continue
+                # Aggregates only: servers outside the node's own announced
+                # prefixes would be unreachable, so those get host routes
+                blocks = [parse_cidr(cidr) for cidr in topology.announcements.get(node, ())]
+                covered: List[Server] = []
+                uncovered: List[Server] = []
+                for server in attached:
+                    (covered if _in_blocks(parse_ipv4(server.ip_address), blocks)
+                     else uncovered).append(server)
+                topology.attach_servers(node, covered, announce_hosts=False)
+                topology.attach_servers(node, uncovered)
+            # A virtual IP always gets its own /32, whatever host_routes says,
+            # and keeps it while the pool is down so traffic (and with it the
+            # health checks) still reaches the pool
+            for node, pool in pool_placement:
+                topology.attach_server(node, pool, withdraw_offline=False)
+            router.attach_topology(topology, ingress)
+        return router
+
+def save_snapshot(router: AdvancedRouter, path: str) -> int:
+    """Pickle a router's full state; returns the snapshot size in bytes
+    
+    Servers, topology, DNS and response caches, statistics, histograms and
+    packet histories are all saved. Open trace captures and in-flight
+    asyncio work are not. The file is written beside `path` and renamed
+    into place, so an interrupted save never leaves a truncated snapshot.
+    """
+    global _packet_ids
+    next_id = next(_packet_ids)
+    _packet_ids = itertools.count(next_id)
+    state = {
+        "format": SNAPSHOT_FORMAT,
+        "version": SNAPSHOT_VERSION,
+        "saved_at": time.time(),
+        "next_packet_id": next_id,
+        "protocols": PROTOCOL_NAMES,  # Codes of non-standard protocols in the histories
+        "router": router,
+    }
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as handle, PausedGC():
+        pickle.dump(state, handle, protocol=pickle.HIGHEST_PROTOCOL)
+        size = handle.tell()
+    os.replace(temporary, path)
+    return size
+
+def load_snapshot(path: str, interactive: Optional[bool] = None) -> AdvancedRouter:
+    """Restore a router saved by save_snapshot()
+    
+    The file is memory-mapped and unpickled straight from the mapping,
+    without first being copied into memory. Packet IDs continue after the
+    snapshot's. Snapshots are pickles: only load files you trust.
+    """
+    global _packet_ids
+    with open(path, "rb") as handle:
+        with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as view, PausedGC():
+            state = pickle.loads(view)
+    if not isinstance(state, dict) or state.get("format") != SNAPSHOT_FORMAT:
+        raise ValueError(f"{path}: not a network snapshot")
+    if state["version"] != SNAPSHOT_VERSION:
+        raise ValueError(f"{path}: unsupported snapshot version {state['version']}")
+    _packet_ids = itertools.count(max(next(_packet_ids), state["next_packet_id"]))
+    register_protocols(state.get("protocols", {}))
+    router = state["router"]
+    if interactive is not None:
+        router.set_interactive(interactive)
+    return router
+
+def clone_network(router: AdvancedRouter, interactive: bool = False) -> AdvancedRouter:
+    """Independent copy of a router and everything it owns"""
+    with PausedGC():
+        clone = pickle.loads(pickle.dumps(router, protocol=pickle.HIGHEST_PROTOCOL))
+    clone.set_interactive(interactive)
+    return clone
+
+# ========== 10. LOAD GENERATION & BENCHMARKS ==========
+DEFAULT_PROTOCOL_MIX: Dict[str, float] = {"HTTP": 0.55, "HTTPS": 0.35, "DNS": 0.05, "FTP": 0.03, "SMTP": 0.02}
+
+def build_demo_router(name: str = "BenchRouter-01") -> AdvancedRouter:
+    """Headless router for the demo network"""
+    return build_network({**DEMO_NETWORK, "router": {"name": name}})
+
+class Workload:
+    """Seeded request generator: Zipf domain popularity, protocol mix, client pool
+    
+    The same seed always yields the same request list, so runs are comparable.
+    A fraction of requests can be made to miss DNS (unknown_ratio), come from
+    the restricted 192.168.2.0/24 network (restricted_ratio), or come from a
+    blacklisted source (hostile_ratio).
+    """
+    def __init__(self, seed: int = 42, domains: Optional[List[str]] = None, zipf_s: float = 1.1,
+                 protocol_mix: Optional[Dict[str, float]] = None, clients: int = 1000,
+                 unknown_ratio: float = 0.0, restricted_ratio: float = 0.0,
+                 hostile_ratio: float = 0.0):
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.domains = list(domains or [d for d in DEFAULT_DNS_RECORDS if d != "localhost"])
+        # Rank r (1-based) is requested with weight 1 / r^s
+        self._domain_weights = list(itertools.accumulate(
+            1 / rank ** zipf_s for rank in range(1, len(self.domains) + 1)))
+        mix = protocol_mix or DEFAULT_PROTOCOL_MIX
+        self.protocols = list(mix)
+        self._protocol_weights = list(itertools.accumulate(mix.values()))
+        self.clients = [int_to_ip(0x0A000001 + i) for i in range(clients)]  # 10.0.0.1, ...
+        self.unknown_ratio = unknown_ratio
+        self.restricted_ratio = restricted_ratio
+        self.hostile_ratio = hostile_ratio
+
+    def requests(self, count: int) -> List[Tuple[str, str, str]]:
+        """`count` (destination, protocol, source_ip) tuples"""
+        rng = self.rng
+        destinations = rng.choices(self.domains, cum_weights=self._domain_weights, k=count)
+        protocols = rng.choices(self.protocols, cum_weights=self._protocol_weights, k=count)
+        sources = rng.choices(self.clients, k=count)
+        for ratio, column, make in (
+                (self.unknown_ratio, destinations, lambda i: f"unknown-{i}.example"),
+                (self.restricted_ratio, sources, lambda i: f"192.168.2.{i % 254 + 1}"),
+                (self.hostile_ratio, sources, lambda i: "185.143.223.1")):
+            if ratio:
+                for i in rng.sample(range(count), int(count * ratio)):
+                    column[i] = make(i)
+        return list(zip(destinations, protocols, sources))
+
+    def interarrivals(self, rate: float, count: int) -> List[float]:
+        """Poisson arrival gaps (modeled seconds) for an open-loop load at `rate` req/s"""
+        expovariate = self.rng.expovariate
+        return [expovariate(rate) for _ in range(count)]
+
+async def _open_loop(router: AdvancedRouter, requests: List[Tuple[str, str, str]],
+                     gaps: List[float]) -> List[AsyncRouteResult]:
+    """Launch each request at its arrival time, whether or not earlier ones finished"""
+    loop = asyncio.get_running_loop()
+    arrival = loop.time()
+    tasks = []
+    for request, gap in zip(requests, gaps):
+        arrival += gap
+        await asyncio.sleep(arrival - loop.time())
+        tasks.append(asyncio.ensure_future(router.route_packet_async(*request)))
+    return await asyncio.gather(*tasks)
+
+async def _closed_loop(router: AdvancedRouter, requests: List[Tuple[str, str, str]],
+                       clients: int, think_time: float) -> List[AsyncRouteResult]:
+    """`clients` users each send their next request only after the last one answered"""
+    pending = iter(requests)  # Shared: each client takes the next request in turn
+    results: List[AsyncRouteResult] = []
+    
+    async def client():
+        for request in pending:
+            results.append(await router.route_packet_async(*request))
+            if think_time:
+                await asyncio.sleep(think_time)
+    
+    await asyncio.gather(*(client() for _ in range(clients)))
+    return results
+
+def run_load(router: AdvancedRouter, requests: List[Tuple[str, str, str]], mode: str = "batch",
+             rate: float = 1000.0, clients: int = 50, think_time: float = 0.0, seed: int = 42,
+             trace_memory: bool = False) -> Dict[str, Any]:
+    """Drive `requests` through `router` and measure it
+    
+    Modes: "batch" (route_packets, as fast as the CPU allows), "open"
+    (Poisson arrivals at `rate` modeled req/s on the asyncio engine) and
+    "closed" (`clients` concurrent users with optional think time). The
+    asyncio modes run on a SimEventLoop, and `seed` also seeds the module
+    RNG behind transmission delays, so a seeded run is reproducible.
+    Latency percentiles are modeled milliseconds and cover this run only
+    (a resumed router's earlier samples are folded back in afterwards);
+    throughput is reported both per wall-clock second and per modeled second.
+    """
+    status_counts: Dict[int, int] = {}
+    report: Dict[str, Any] = {"mode": mode, "requests": len(requests)}
+    if trace_memory:
+        tracing = tracemalloc.is_tracing()
+        if not tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+    lifetime, router.latency = router.latency, LatencyStats()
+    random.seed(seed)
+    sim_start = router.clock.now()
+    wall_start = time.perf_counter()
+    
+    if mode == "batch":
+        batch = router.route_packets(requests, collect_results=False)
+        status_counts = batch.status_counts
+    elif mode == "open":
+        gaps = Workload(seed).interarrivals(rate, len(requests))
+        results = run_simulated(_open_loop(router, requests, gaps), router.clock)
+        report["offered_rate"] = rate
+    elif mode == "closed":
+        results = run_simulated(_closed_loop(router, requests, clients, think_time), router.clock)
+        report["clients"] = clients
+    else:
+        router.latency = lifetime
+        raise ValueError(f"Unknown load mode: {mode}")
+    if mode != "batch":
+        for result in results:
+            status_counts[result.status] = status_counts.get(result.status, 0) + 1
+    
+    wall = time.perf_counter() - wall_start
+    modeled = router.clock.now() - sim_start
+    latency = router.latency.overall.snapshot()
+    lifetime.merge(router.latency)
+    router.latency = lifetime
+    router.routing_stats["avg_latency"] = lifetime.overall.mean
+    report.update({
+        "wall_seconds": wall,
+        "throughput_rps": len(requests) / wall if wall else 0.0,
+        "modeled_seconds": modeled,
+        "modeled_rps": len(requests) / modeled if modeled else 0.0,
+        "latency_ms": {k: latency[k] for k in ("mean", "p50", "p90", "p99", "p999", "max")},
+        "status_counts": {outcome_label(k): v for k, v in sorted(status_counts.items())},
+    })
+    if trace_memory:
+        report["peak_traced_kb"] = tracemalloc.get_traced_memory()[1] / 1024
+        if not tracing:
+            tracemalloc.stop()
+    if resource is not None:
+        report["max_rss_kb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return report
+
+# ---- Standard scenarios (each builds its own router so runs are independent) ----
+def _bench_routing(requests: int, seed: int) -> Tuple[AdvancedRouter, List[tuple]]:
+    """Flat routing table by IP: no DNS, clean sources"""
+    router = build_demo_router()
+    workload = Workload(seed, domains=[spec["ip"] for spec in DEMO_NETWORK["servers"]],
+                        protocol_mix={"HTTP": 0.6, "HTTPS": 0.4})
+    return router, workload.requests(requests)
+
+def _bench_firewall(requests: int, seed: int) -> Tuple[AdvancedRouter, List[tuple]]:
+    """50k-rule blocklist, with hostile and restricted sources mixed in"""
+    router = build_demo_router()
+    rng = random.Random(seed)
+    for _ in range(50_000):
+        router.firewall.block(f"{int_to_ip(rng.getrandbits(32) & 0xFFFFFF00)}/{rng.choice((24, 32))}")
+    workload = Workload(seed, hostile_ratio=0.1, restricted_ratio=0.1, clients=5000)
+    return router, workload.requests(requests)
+
+def _bench_dns(requests: int, seed: int) -> Tuple[AdvancedRouter, List[tuple]]:
+    """Zipf over 100k names with a 10k-entry cache, plus 5% NXDOMAIN"""
+    router = build_demo_router()
+    router.dns.dns_cache.capacity = 10_000
+    names = [f"site{i}.example" for i in range(100_000)]
+    addresses = [spec["ip"] for spec in DEMO_NETWORK["servers"]]
+    router.dns.add_records((name, addresses[i % len(addresses)]) for i, name in enumerate(names))
+    workload = Workload(seed, domains=names, zipf_s=1.0, unknown_ratio=0.05)
+    return router, workload.requests(requests)
+
+def _bench_mixed(requests: int, seed: int) -> Tuple[AdvancedRouter, List[tuple]]:
+    """Demo domains, default protocol mix, some NXDOMAIN and hostile traffic"""
+    router = build_demo_router()
+    workload = Workload(seed, unknown_ratio=0.02, restricted_ratio=0.02, hostile_ratio=0.01)
+    return router, workload.requests(requests)
+
+class Scenario(NamedTuple):
+    """A named, reproducible benchmark: setup builds (router, requests)"""
+    setup: Callable[[int, int], Tuple[AdvancedRouter, List[tuple]]]
+    mode: str = "batch"
+    requests: int = 50_000
+    options: Optional[Dict[str, Any]] = None  # Extra run_load keyword arguments
+
+BENCHMARK_SCENARIOS: Dict[str, Scenario] = {
+    "routing": Scenario(_bench_routing),
+    "firewall": Scenario(_bench_firewall),
+    "dns": Scenario(_bench_dns),
+    "mixed": Scenario(_bench_mixed),
+    "mixed-open": Scenario(_bench_mixed, "open", 5_000, {"rate": 200.0}),
+    "mixed-closed": Scenario(_bench_mixed, "closed", 5_000, {"clients": 50}),
+}
+
+def run_scenario(name: str, requests: Optional[int] = None, seed: int = 42,
+                 repeat: int = 1, trace_memory: bool = False) -> Dict[str, Any]:
+    """Run a standard scenario `repeat` times; keeps the median-throughput run
+    
+    Setup (router and workload construction) is excluded from the timings.
+    Each scenario is a plain function of (requests, seed), so it can also be
+    wrapped directly by pytest-benchmark or an asv `time_*` function.
+    """
+    scenario = BENCHMARK_SCENARIOS[name]
+    runs = []
+    for _ in range(max(1, repeat)):
+        router, workload = scenario.setup(requests or scenario.requests, seed)
+        runs.append(run_load(router, workload, scenario.mode, seed=seed,
+                             trace_memory=trace_memory, **(scenario.options or {})))
+    runs.sort(key=lambda run: run["throughput_rps"])
+    report = runs[len(runs) // 2]
+    report.update({"scenario": name, "seed": seed, "repeat": len(runs)})
+    return report
+
+def compare_to_baseline(reports: Dict[str, Dict[str, Any]], baseline: Dict[str, Dict[str, Any]],
+                        tolerance: float = 0.10) -> List[str]:
+    """Regressions against a saved run: throughput down or modeled p99 up by > tolerance"""
+    regressions = []
+    for name, report in reports.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if report["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {report['throughput_rps']:.0f} req/s "
+                               f"vs baseline {previous['throughput_rps']:.0f} req/s")
+        p99, before = report["latency_ms"]["p99"], previous["latency_ms"]["p99"]
+        if before and p99 > before * (1 + tolerance):
+            regressions.append(f"{name}: p99 latency {p99:.2f}ms vs baseline {before:.2f}ms")
+    return regressions
+
+def print_load_report(report: Dict[str, Any]):
+    """Human-readable summary of a run_load/run_scenario report"""
+    title = report.get("scenario", report["mode"])
+    latency = report["latency_ms"]
+    print(f"\n{Colors.BLUE}[BENCH] {title} ({report['mode']}, {report['requests']} requests){Colors.END}")
+    print(f"  Throughput:  {report['throughput_rps']:,.0f} req/s wall | "
+          f"{report['modeled_rps']:,.1f} req/s modeled")
+    print(f"  Latency:     p50 {latency['p50']:.2f}ms | p90 {latency['p90']:.2f}ms | "
+          f"p99 {latency['p99']:.2f}ms | p99.9 {latency['p999']:.2f}ms | max {latency['max']:.2f}ms")
+    print("  Outcomes:    " + ", ".join(f"{k}={v}" for k, v in report["status_counts"].items()))
+    memory = [f"peak traced {report['peak_traced_kb']:,.0f} KiB"] if "peak_traced_kb" in report else []
+    if "max_rss_kb" in report:
+        memory.append(f"max RSS {report['max_rss_kb']:,} KiB")
+    if memory:
+        print("  Memory:      " + " | ".join(memory))
+
+def parse_mix(text: str) -> Dict[str, float]:
+    """'HTTP=0.6,HTTPS=0.4' -> {'HTTP': 0.6, 'HTTPS': 0.4}"""
+    mix = {}
+    for part in text.split(","):
+        protocol, _, weight = part.partition("=")
+        mix[protocol.strip().upper()] = float(weight or 1)
+    return mix
+
+def main_cli(argv: List[str]) -> int:
+    """Command-line entry point: `python main.py bench|load|run|attack|shard|selfcheck ...`"""
+    parser = argparse.ArgumentParser(prog="main.py", description="Project Glass headless tools")
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    bench = commands.add_parser("bench", help="Run standard benchmark scenarios")
+    bench.add_argument("scenarios", nargs="*", metavar="SCENARIO",
+                       help=f"Subset of: {', '.join(BENCHMARK_SCENARIOS)} (default: all)")
+    bench.add_argument("--requests", type=int, help="Override each scenario's request count")
+    bench.add_argument("--seed", type=int, default=42)
+    bench.add_argument("--repeat", type=int, default=3, help="Runs per scenario (median kept)")
+    bench.add_argument("--trace-memory", action="store_true", help="Track peak allocations")
+    bench.add_argument("--save", metavar="FILE", help="Write results as JSON (a future baseline)")
+    bench.add_argument("--baseline", metavar="FILE", help="Fail on regressions against FILE")
+    bench.add_argument("--tolerance", type=float, default=0.10)
+    
+    run = commands.add_parser("run", help="Interactive menu on a configured or saved network")
+    run.add_argument("--config", metavar="FILE", help="JSON network description")
+    run.add_argument("--resume", metavar="SNAPSHOT", help="Continue from a saved snapshot")
+    run.add_argument("--save-snapshot", metavar="FILE", help="Save the network state on exit")
+    
+    load = commands.add_parser("load", help="Run a custom seeded workload")
+    load.add_argument("--mode", choices=("batch", "open", "closed"), default="batch")
+    load.add_argument("--requests", type=int, default=10_000)
+    load.add_argument("--seed", type=int, default=42)
+    load.add_argument("--rate", type=float, default=1000.0, help="Open loop: modeled req/s")
+    load.add_argument("--clients", type=int, default=50, help="Closed loop: concurrent users")
+    load.add_argument("--think-time", type=float, default=0.0, help="Closed loop: modeled seconds")
+    load.add_argument("--zipf", type=float, default=1.1, help="Domain popularity exponent")
+    load.add_argument("--mix", type=parse_mix, help="Protocol mix, e.g. HTTP=0.6,HTTPS=0.4")
+    load.add_argument("--sources", type=int, default=1000, help="Distinct client addresses")
+    load.add_argument("--unknown-ratio", type=float, default=0.0)
+    load.add_argument("--restricted-ratio", type=float, default=0.0)
+    load.add_argument("--hostile-ratio", type=float, default=0.0)
+    load.add_argument("--trace-memory", action="store_true")
+    load.add_argument("--json", metavar="FILE", help="Also write the report as JSON")
+    load.add_argument("--config", metavar="FILE", help="JSON network description (default: demo)")
+    load.add_argument("--resume", metavar="SNAPSHOT", help="Continue from a saved snapshot")
+    load.add_argument("--save-snapshot", metavar="FILE", help="Save the network state afterwards")
+    
+    attack = commands.add_parser("attack", help="Flood the firewall with a simulated attack")
+    attack.add_argument("scenarios", nargs="*", metavar="SCENARIO",
+                        help=f"Subset of: {', '.join(ATTACK_SCENARIOS)} (default: all)")
+    attack.add_argument("--duration", type=float, default=10.0, help="Simulated seconds")
+    attack.add_argument("--seed", type=int, default=42)
+    attack.add_argument("--rate-limit", type=float, help="Firewall packets/second per source")
+    attack.add_argument("--json", metavar="FILE", help="Also write the reports as JSON")
+    
+    shard = commands.add_parser("shard", help="Run a workload on several processes, by subnet")
+    shard.add_argument("--shards", type=int, help="Worker processes (default: CPU count)")
+    shard.add_argument("--requests", type=int, default=100_000)
+    shard.add_argument("--rate", type=float,
+                       help="Modeled req/s (default: half what the shards can serve)")
+    shard.add_argument("--seed", type=int, default=42)
+    shard.add_argument("--sources", type=int, default=1000, help="Distinct client addresses")
+    shard.add_argument("--prefix-len", type=int,
+                       help="Servers per shard by /N subnet (default: enough subnets for every shard)")
+    shard.add_argument("--link-latency", type=float, default=0.005,
+                       help="Modeled seconds between shards (part of the synchronization lookahead)")
+    shard.add_argument("--config", metavar="FILE", help="JSON network description (default: demo)")
+    shard.add_argument("--stats", action="store_true", help="Show the merged statistics")
+    shard.add_argument("--json", metavar="FILE", help="Also write the report as JSON")
+    
+    selfcheck = commands.add_parser("selfcheck", help="Check simulator invariants")
+    selfcheck.add_argument("checks", nargs="*", metavar="CHECK",
+                           help=f"Subset of: {', '.join(SELF_CHECKS)} (default: all)")
+    selfcheck.add_argument("--seed", type=int, default=42)
+    
+    args = parser.parse_args(argv)
+    if args.command == "selfcheck":
+        unknown = [name for name in args.checks if name not in SELF_CHECKS]
+        if unknown:
+            parser.error(f"unknown check(s): {', '.join(unknown)}")
+        results = run_self_checks(args.checks, args.seed)
+        return 1 if any(results.values()) else 0
+    if args.command == "shard":
+        config = load_config(args.config) if args.config else DEMO_NETWORK
+        simulation = ShardedSimulation(config, args.shards, args.prefix_len, args.link_latency)
+        domains = [domain for spec in itertools.chain(server_specs(config), pool_specs(config))
+                   for domain in spec.domains]
+        domains += [name for name in config.get("dns", {}).get("records", {}) if name != "localhost"]
+        workload = Workload(args.seed, list(dict.fromkeys(domains)) or None, clients=args.sources)
+        merged, report = simulation.run(workload.requests(args.requests), args.rate, args.seed)
+        if args.stats:
+            merged.show_statistics()
+        print_shard_report(report)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as handle:
+                json.dump(report, handle, indent=2)
+        return 0
+    if args.command == "attack":
+        unknown = [name for name in args.scenarios if name not in ATTACK_SCENARIOS]
+        if unknown:
+            parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+        reports = {}
+        for name in args.scenarios or ATTACK_SCENARIOS:
+            firewall = build_demo_router().firewall
+            if args.rate_limit is not None:
+                firewall.security_rules["rate_limit"] = args.rate_limit
+            reports[name] = simulate_attack(firewall, name, args.duration, args.seed)
+            print_attack_report(reports[name])
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as handle:
+                json.dump(reports, handle, indent=2)
+        return 0
+    if args.command in ("run", "load"):
+        if args.resume:
+            router = load_snapshot(args.resume, interactive=args.command == "run")
+        elif args.config:
+            router = build_network(load_config(args.config), interactive=args.command == "run")
+        else:
+            router = None if args.command == "run" else build_demo_router()
+    if args.command == "run":
+        NetworkManager(router=router, snapshot_path=args.save_snapshot).run()
+        return 0
+    if args.command == "load":
+        domains = [name for name in router.dns.dns_records if name != "localhost"]
+        workload = Workload(args.seed, domains, zipf_s=args.zipf, protocol_mix=args.mix,
+                            clients=args.sources, unknown_ratio=args.unknown_ratio,
+                            restricted_ratio=args.restricted_ratio,
+                            hostile_ratio=args.hostile_ratio)
+        report = run_load(router, workload.requests(args.requests), args.mode,
+                          args.rate, args.clients, args.think_time,
+                          args.seed, args.trace_memory)
+        print_load_report(report)
+        if args.save_snapshot:
+            save_snapshot(router, args.save_snapshot)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as handle:
+                json.dump(report, handle, indent=2)
+        return 0
+    
+    unknown = [name for name in args.scenarios if name not in BENCHMARK_SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(unknown)}")
+    reports = {}
+    for name in args.scenarios or BENCHMARK_SCENARIOS:
+        reports[name] = run_scenario(name, args.requests, args.seed, args.repeat, args.trace_memory)
+        print_load_report(reports[name])
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as handle:
+            json.dump(reports, handle, indent=2)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as handle:
+            regressions = compare_to_baseline(reports, json.load(handle), args.tolerance)
+        for line in regressions:
+            print(f"{Colors.RED}[REGRESSION] {line}{Colors.END}")
+        if regressions:
+            return 1
+        print(f"{Colors.GREEN}✅ No regressions beyond {args.tolerance:.0%}{Colors.END}")
+    return 0
+
+# ========== 11. ATTACK SIMULATION ==========
+class TrafficSource(NamedTuple):
+    """One traffic component of an attack scenario
+    
+    Packets arrive at `rate` per simulated second from `hosts` distinct
+    senders drawn from the `networks` CIDR blocks, or from a fresh
+    (spoofed) address in those blocks for every packet when hosts is 0.
+    """
+    name: str
+    rate: float
+    networks: Tuple[str, ...]
+    hosts: int = 0
+    hostile: bool = True
+    ttl: int = 64
+    protocol: str = "HTTP"
+
+class AttackScenario(NamedTuple):
+    description: str
+    sources: Tuple[TrafficSource, ...]
+    blocklist: Tuple[str, ...] = ()  # Operator rules in force during the attack
+
+# Background users: 5,000 clients well under the per-source rate limit
+LEGITIMATE_TRAFFIC = TrafficSource("legitimate", 2_000, ("10.0.0.0/16",), hosts=5_000, hostile=False)
+SYN_FLOOD = TrafficSource("syn-flood", 20_000, ("198.51.100.0/24",), hosts=50)
+SPOOFED_SPRAY = TrafficSource("spoofed-spray", 20_000, ("198.18.0.0/15", "172.16.0.0/12"))
+SLOW_RATE = TrafficSource("slow-rate", 16_000, ("100.64.0.0/16",), hosts=2_000)
+
+ATTACK_SCENARIOS: Dict[str, AttackScenario] = {
+    "syn-flood": AttackScenario("50 bots at ~400 pps each; caught by the rate limiter",
+                                (SYN_FLOOD, LEGITIMATE_TRAFFIC)),
+    "spoofed-spray": AttackScenario("Fresh random source per packet; only the blacklisted "
+                                    "half is stopped", (SPOOFED_SPRAY, LEGITIMATE_TRAFFIC),
+                                    blocklist=("198.18.0.0/15",)),
+    "slow-rate": AttackScenario("2,000 hosts each just under the rate limit",
+                                (SLOW_RATE, LEGITIMATE_TRAFFIC)),
+    "mixed": AttackScenario("All three attacks at once", (SYN_FLOOD, SPOOFED_SPRAY, SLOW_RATE,
+                                                          LEGITIMATE_TRAFFIC),
+                            blocklist=("198.18.0.0/15",)),
+}
+
+class TrafficGenerator:
+    """Seeded, time-ordered packet batches for a set of traffic sources
+    
+    Senders are drawn once, so botnets keep the same addresses from one
+    window to the next. Each window's packets are merged across sources in
+    timestamp order (a Poisson process per source, conditioned on its
+    expected count) and returned as a PacketBatch plus one hostile flag per
+    packet.
+    """
+    def __init__(self, sources: Iterable[TrafficSource], seed: int = 42,
+                 destination: str = "192.168.1.1"):
+        self.rng = random.Random(seed)
+        self.destination = parse_ipv4(destination)
+        self.sources = list(sources)
+        self._blocks = [[parse_cidr(cidr) for cidr in source.networks] for source in self.sources]
+        self._senders = [[self._address(blocks) for _ in range(source.hosts)]
+                         for source, blocks in zip(self.sources, self._blocks)]
+
+    def _address(self, blocks: List[Tuple[int, int]]) -> int:
+        network, prefix_len = self.rng.choice(blocks)
+        return network | self.rng.getrandbits(32 - prefix_len) if prefix_len < 32 else network
+
+    def window(self, start: float, duration: float) -> Tuple[PacketBatch, bytearray]:
+        """Packets arriving in [start, start + duration)"""
+        rng = self.rng
+        timestamps: List[float] = []
+        addresses: List[int] = []
+        ttls, protocols, hostile = bytearray(), bytearray(), bytearray()
+        for source, blocks, senders in zip(self.sources, self._blocks, self._senders):
+            count = round(source.rate * duration)
+            timestamps.extend(start + rng.random() * duration for _ in range(count))
+            if senders:
+                addresses.extend(rng.choice(senders) for _ in range(count))
+            else:
+                addresses.extend(self._address(blocks) for _ in range(count))
+            ttls.extend(bytes((source.ttl,)) * count)
+            protocols.extend(bytes((protocol_code(source.protocol),)) * count)
+            hostile.extend(bytes((source.hostile,)) * count)
+        order = sorted(range(len(timestamps)), key=timestamps.__getitem__)
+        batch = PacketBatch()
+        batch.timestamps.extend(timestamps[i] for i in order)
+        batch.sources.extend(addresses[i] for i in order)
+        batch.destinations.extend(array("I", [self.destination]) * len(order))
+        batch.protocols.extend(protocols[i] for i in order)
+        batch.ttls.extend(ttls[i] for i in order)
+        return batch, bytearray(hostile[i] for i in order)
+
+def simulate_attack(firewall: Firewall, scenario: str = "mixed", duration: float = 10.0,
+                    seed: int = 42, window: float = 1.0) -> Dict[str, Any]:
+    """Drive a scenario's traffic through firewall.inspect_batch and score it
+    
+    Traffic is generated and inspected one `window` of simulated seconds
+    at a time, so memory stays bounded for long attacks. Block rate is the
+    share of attack packets dropped, false-positive rate the share of
+    legitimate packets dropped. Firewall throughput counts inspection time
+    only, not traffic generation.
+    """
+    spec = ATTACK_SCENARIOS[scenario]
+    for cidr in spec.blocklist:
+        firewall.block(cidr)
+    generator = TrafficGenerator(spec.sources, seed)
+    start = firewall.clock.now()
+    outcomes: Dict[Tuple[int, int], int] = {}  # (hostile, verdict) -> packets
+    inspect_seconds = generate_seconds = 0.0
+    elapsed = 0.0
+    while elapsed < duration:
+        span = min(window, duration - elapsed)
+        began = time.perf_counter()
+        batch, hostile = generator.window(start + elapsed, span)
+        generated = time.perf_counter()
+        verdicts = firewall.inspect_batch(batch)
+        inspect_seconds += time.perf_counter() - generated
+        generate_seconds += generated - began
+        for key in zip(hostile, verdicts):
+            outcomes[key] = outcomes.get(key, 0) + 1
+        elapsed += span
+    
+    attack = sum(n for (hostile, _), n in outcomes.items() if hostile)
+    legitimate = sum(n for (hostile, _), n in outcomes.items() if not hostile)
+    blocked = sum(n for (hostile, verdict), n in outcomes.items() if hostile and verdict)
+    false_positives = sum(n for (hostile, verdict), n in outcomes.items()
+                          if not hostile and verdict)
+    by_reason: Dict[str, int] = {}
+    for (_, verdict), n in outcomes.items():
+        label = firewall.batch_reasons[verdict] or "passed"
+        by_reason[label] = by_reason.get(label, 0) + n
+    packets = attack + legitimate
+    return {
+        "scenario": scenario,
+        "description": spec.description,
+        "duration": duration,
+        "packets": packets,
+        "attack_packets": attack,
+        "legitimate_packets": legitimate,
+        "block_rate": blocked / attack if attack else 0.0,
+        "false_positive_rate": false_positives / legitimate if legitimate else 0.0,
+        "by_reason": by_reason,
+        "tracked_sources": len(firewall.rate_limiter),
+        "firewall_seconds": inspect_seconds,
+        "firewall_pps": packets / inspect_seconds if inspect_seconds else 0.0,
+        "generate_seconds": generate_seconds,
+    }
+
+def print_attack_report(report: Dict[str, Any]):
+    """Human-readable summary of a simulate_attack report"""
+    print(f"\n{Colors.RED}[ATTACK] {report['scenario']}: {report['description']}{Colors.END}")
+    print(f"  Traffic:     {report['packets']:,} packets over {report['duration']:g}s "
+          f"({report['attack_packets']:,} attack, {report['legitimate_packets']:,} legitimate)")
+    print(f"  Block rate:  {report['block_rate']:.1%} of attack packets")
+    print(f"  False pos.:  {report['false_positive_rate']:.2%} of legitimate packets")
+    print("  Verdicts:    " + ", ".join(f"{k}={v:,}" for k, v in sorted(report["by_reason"].items())))
+    print(f"  Firewall:    {report['firewall_pps']:,.0f} packets/s "
+          f"({report['tracked_sources']:,} sources tracked by the rate limiter)")
+
+# ========== 12. SHARDED PARALLEL SIMULATION ==========
+def plan_shards(config: Dict[str, Any], shards: int, prefix_len: int = 24) -> Dict[int, int]:
+    """Assign each server subnet to a shard, balancing servers per shard
+    
+    Subnets (the top `prefix_len` bits of a server or pool address) are
+    placed largest first on the least-loaded shard. Returns subnet -> shard
+    index. A pool runs, with all of its members, on its virtual IP's shard.
+    """
+    shift = 32 - prefix_len
+    sizes: Dict[int, int] = {}
+    for spec in itertools.chain(server_specs(config), pool_specs(config)):
+        address = parse_ipv4(spec.ip)
+        if address is None:
+            raise ValueError(f"Cannot shard server {spec.name}: invalid address {spec.ip!r}")
+        sizes[address >> shift] = sizes.get(address >> shift, 0) + 1
+    loads = [(0, shard) for shard in range(shards)]
+    owners: Dict[int, int] = {}
+    for subnet, size in sorted(sizes.items(), key=lambda item: -item[1]):
+        load, shard = heapq.heappop(loads)
+        owners[subnet] = shard
+        heapq.heappush(loads, (load + size, shard))
+    return owners
+
+def shard_prefix_len(config: Dict[str, Any], shards: int) -> int:
+    """Shortest subnet prefix that gives `shards` shards a subnet each
+    
+    Falls back to /32, one address per subnet, when there are fewer server
+    and pool addresses than shards.
+    """
+    addresses = {parse_ipv4(spec.ip)
+                 for spec in itertools.chain(server_specs(config), pool_specs(config))}
+    addresses.discard(None)
+    for prefix_len in range(33):
+        if len({address >> (32 - prefix_len) for address in addresses}) >= shards:
+            return prefix_len
+    return 32
+
+class ShardWorker:
+    """One shard of a sharded simulation: its own router, clock and inbox
+    
+    The router holds only this shard's servers. Requests for addresses owned
+    by another shard are handed to `forward` and leave in the next reply to
+    the coordinator; packets arriving from other shards wait in a heap until
+    the coordinator's horizon lets them be served.
+    
+    The router is one busy pipeline, as with EventScheduler: an arrival
+    that finds it still working waits (`queued`). `late` counts packets from
+    other shards that arrived before something this shard already started,
+    which conservative synchronization rules out; it should stay zero.
+    """
+    def __init__(self, index: int, config: Dict[str, Any], owners: Dict[int, int],
+                 prefix_len: int, link_latency: float,
+                 arrivals: List[Tuple[float, str, str, str]]):
+        self.index = index
+        self.owners = owners
+        self.shift = 32 - prefix_len
+        self.link_latency = link_latency
+        self.arrivals = arrivals  # (offset, destination, protocol, source), by offset
+        self.position = 0
+        self.base = 0.0
+        self.inbound: List[tuple] = []  # Heap of (arrival time, sequence, item)
+        self._sequence = itertools.count()
+        self.outgoing: Dict[int, List[tuple]] = {}
+        self.status_counts: Dict[int, int] = {}
+        self.forwarded = 0
+        self.started = -math.inf  # Arrival time of the latest request started
+        self.queued = 0
+        self.late = 0
+        self.router = build_network(config, select=lambda spec: self.owner(spec.ip) == index)
+        self.router.name = f"{self.router.name}/shard-{index}"
+        self.router.forwarder = self.forward
+
+    def owner(self, ip_address: str) -> Optional[int]:
+        address = parse_ipv4(ip_address)
+        return None if address is None else self.owners.get(address >> self.shift)
+
+    def forward(self, packet: Packet, meta: tuple, upstream: float) -> bool:
+        """Router forwarder: queue the packet for the shard that owns its address
+        
+        The packet is transmitted here, onto the link, so this router stays
+        busy for its time on the wire and the owner only routes and serves it.
+        """
+        _, destination, protocol, ip_address = meta[:4]
+        owner = self.owner(ip_address)
+        if owner is None or owner == self.index:
+            return False
+        wire = packet.transmission_delay()
+        self.router.clock.sleep(wire)
+        self.router.metrics.add(Stage.TRANSMISSION, wire)
+        self.outgoing.setdefault(owner, []).append(
+            (self.router.clock.now(), packet.source, ip_address, destination, protocol,
+             packet.data, packet.ttl - 1, upstream + wire))
+        self.forwarded += 1
+        return True
+
+    def next_event(self) -> float:
+        """Time of this shard's earliest pending arrival, local or forwarded"""
+        local = self.base + self.arrivals[self.position][0] \
+            if self.position < len(self.arrivals) else math.inf
+        return min(local, self.inbound[0][0]) if self.inbound else local
+
+    def _count(self, batch: BatchResult):
+        for status, count in batch.status_counts.items():
+            self.status_counts[status] = self.status_counts.get(status, 0) + count
+
+    def run_window(self, horizon: float, items: List[tuple]):
+        """Serve, in arrival order, everything that arrives before `horizon`
+        
+        Each request starts at its own arrival time, or once the router is
+        free if that is later (the wait counts toward its latency), so a busy
+        shard may finish past the horizon. Nothing that arrives at or past it
+        is taken up, since a packet from another shard may still arrive first.
+        Requests already waiting go to the router in one batch.
+        """
+        for item in items:
+            arrival = item[0] + self.link_latency
+            if arrival < self.started:
+                self.late += 1
+            heapq.heappush(self.inbound, (arrival, next(self._sequence), item))
+        arrivals, base, inbound = self.arrivals, self.base, self.inbound
+        clock = self.router.clock
+        while True:
+            local = base + arrivals[self.position][0] \
+                if self.position < len(arrivals) else math.inf
+            remote = inbound[0][0] if inbound else math.inf
+            if min(local, remote) >= horizon:
+                return
+            # Step 1: The next arrival, and whatever of the same kind arrived
+            # while the router was busy, up to the other kind's next arrival
+            now = clock.now()
+            if local <= remote:
+                cutoff = min(max(now, local), remote, horizon)
+                end = self.position
+                while end < len(arrivals) and base + arrivals[end][0] <= cutoff \
+                        and base + arrivals[end][0] < horizon:
+                    end += 1
+                batch = arrivals[self.position:end]
+                times = [base + request[0] for request in batch]
+                self.position = end
+            else:
+                cutoff = min(max(now, remote), horizon)
+                batch = []
+                while inbound and inbound[0][0] <= cutoff and inbound[0][0] < local \
+                        and inbound[0][0] < horizon:
+                    batch.append(heapq.heappop(inbound)[2])
+                times = [item[0] + self.link_latency for item in batch]
+            self.queued += sum(1 for arrival in times if arrival < now)
+            self.started = times[-1]
+            
+            # Step 2: Serve the run in one call
+            if local <= remote:
+                self._count(self.router.route_packets([request[1:] for request in batch],
+                                                      collect_results=False, arrivals=times))
+            else:
+                self._count(self.router.deliver(batch, self.link_latency))
+
+    def serve(self, inbox, outbox):
+        """Message loop: handshake, then windows until the coordinator stops us"""
+        outbox.put(("ready", self.index, self.router.clock.now()))
+        self.base = inbox.get()[1]
+        self.router.clock.sync(self.base)
+        while True:
+            message = inbox.get()
+            if message[0] == "stop":
+                break
+            _, horizon, items = message
+            self.run_window(horizon, items)
+            outgoing, self.outgoing = self.outgoing, {}  # Queue pickles lazily: hand off, don't reuse
+            outbox.put(("done", self.index, outgoing, self.router.clock.now(), self.next_event()))
+        # Ship the stats back; servers and routes stay here
+        router = self.router
+        router.forwarder = None
+        router.routing_table = {}
+        router.topology = None
+        outbox.put(("stats", self.index, router, self.status_counts, self.forwarded,
+                    self.queued, self.late))
+
+def _run_shard(index, config, owners, prefix_len, link_latency, arrivals, inbox, outbox):
+    """Process entry point for one shard; a failure is reported to the coordinator"""
+    try:
+        ShardWorker(index, config, owners, prefix_len, link_latency, arrivals).serve(inbox, outbox)
+    except Exception as error:
+        outbox.put(("error", index, error))
+        raise
+
+class ShardedSimulation:
+    """Run one network as several processes, partitioned by subnet
+    
+    Servers are split between shards by subnet (plan_shards) and clients by
+    source address, so every shard is an edge router with its own clients,
+    its own servers and its own clock. A request for a server on another
+    shard is forwarded over a simulated link of `link_latency` seconds.
+    
+    Shards advance in windows under conservative synchronization. A shard
+    cannot start anything before its next event (its next arrival, or its
+    clock if the router is still busy), and a forwarded packet leaves after
+    a routing lookup and its time on the wire, so nothing can arrive at a
+    shard before the other shards' earliest next event plus the lookahead:
+    the lookup delay, the shortest transmission delay and the link latency. Each window
+    lets every shard serve what arrives before that horizon, and forwarded
+    packets travel in one batch per shard pair per window.
+    
+    `prefix_len` defaults to the shortest prefix that gives every shard a
+    subnet (shard_prefix_len).
+    """
+    def __init__(self, config: Optional[Dict[str, Any]] = None, shards: Optional[int] = None,
+                 prefix_len: Optional[int] = None, link_latency: float = 0.005):
+        if link_latency <= 0:
+            raise ValueError(f"Sharded runs need a positive link latency, got {link_latency}")
+        self.config = config or DEMO_NETWORK
+        self.shards = shards or os.cpu_count() or 1
+        self.prefix_len = shard_prefix_len(self.config, self.shards) \
+            if prefix_len is None else prefix_len
+        self.link_latency = link_latency
+        self.owners = plan_shards(self.config, self.shards, self.prefix_len)
+        # Fail here rather than in every worker: pools (with their members),
+        # DNS, firewall and topology are built and checked; servers are not
+        router = build_network(self.config, select=lambda spec: isinstance(spec, PoolSpec))
+        self.lookup_delay = router.lookup_delay
+        self.lookahead = self.lookup_delay + Packet.min_transmission_delay() + link_latency
+
+    @staticmethod
+    def _receive(outbox, workers) -> tuple:
+        """Next reply from a shard; raises a worker's error, or if one died"""
+        while True:
+            try:
+                reply = outbox.get(timeout=1.0)
+            except queue.Empty:
+                dead = [worker.exitcode for worker in workers if worker.exitcode not in (None, 0)]
+                if dead:
+                    raise RuntimeError(f"Shard worker exited with code {dead[0]}")
+                continue
+            if reply[0] == "error":
+                raise reply[2]
+            return reply
+
+    def ingress(self, source_ip: str) -> int:
+        """Shard whose edge router receives traffic from `source_ip`"""
+        address = parse_ipv4(source_ip)
+        return (address if address is not None else hash(source_ip)) % self.shards
+
+    def sustainable_rate(self, utilization: float = 0.5) -> float:
+        """Modeled req/s that keeps the shards' routers `utilization` busy
+        
+        Each request costs a routing lookup, its time on the wire and its
+        server's processing time (about 2.4 s for the demo network), averaged
+        over the servers.
+        """
+        service = [Server(spec.ip, spec.name, spec.content).processing_time
+                   for spec in server_specs(self.config)]
+        mean = sum(service) / len(service) if service else 0.0
+        per_request = self.lookup_delay + Packet.mean_transmission_delay() + mean
+        return utilization * self.shards / per_request
+
+    def run(self, requests: List[Tuple[str, str, str]], rate: Optional[float] = None,
+            seed: int = 42) -> Tuple[AdvancedRouter, Dict[str, Any]]:
+        """Offer `requests` as Poisson arrivals at `rate` modeled req/s
+        
+        `rate` defaults to sustainable_rate(). Returns a router holding the
+        merged statistics of every shard (for show_statistics) and a report
+        of the run.
+        """
+        if rate is None:
+            rate = self.sustainable_rate()
+        gaps = Workload(seed).interarrivals(rate, len(requests))
+        arrivals: List[List[tuple]] = [[] for _ in range(self.shards)]
+        for offset, request in zip(itertools.accumulate(gaps), requests):
+            arrivals[self.ingress(request[2])].append((offset, *request))
+        
+        context = multiprocessing.get_context()
+        outbox = context.Queue()
+        inboxes = [context.Queue() for _ in range(self.shards)]
+        workers = [context.Process(target=_run_shard, daemon=True,
+                                   args=(index, self.config, self.owners, self.prefix_len,
+                                         self.link_latency, arrivals[index], inboxes[index],
+                                         outbox))
+                   for index in range(self.shards)]
+        wall_start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        try:
+            # Step 1: Handshake: every shard starts from the latest built clock
+            base = max(self._receive(outbox, workers)[2] for _ in workers)
+            for inbox in inboxes:
+                inbox.put(("start", base))
+            
+            # Step 2: Windows until no shard has anything left to do. Each
+            # shard's horizon is the earliest any other shard could reach it.
+            lookahead = self.lookahead
+            clocks = [base] * self.shards
+            upcoming = [base + shard[0][0] if shard else math.inf for shard in arrivals]
+            pending: List[List[tuple]] = [[] for _ in range(self.shards)]
+            pending_at = [math.inf] * self.shards
+            windows = 0
+            while True:
+                next_events = [max(clock, min(pair))
+                               for clock, pair in zip(clocks, zip(upcoming, pending_at))]
+                first, second = heapq.nsmallest(2, next_events + [math.inf])
+                if first == math.inf:
+                    break
+                horizons = [(second if event == first else first) + lookahead
+                            for event in next_events]
+                active = [index for index in range(self.shards)
+                          if next_events[index] < horizons[index]]
+                for index in active:
+                    inboxes[index].put(("window", horizons[index], pending[index]))
+                    pending[index], pending_at[index] = [], math.inf
+                for _ in active:
+                    _, index, outgoing, clocks[index], upcoming[index] = \
+                        self._receive(outbox, workers)
+                    for target, items in outgoing.items():
+                        pending[target].extend(items)
+                        pending_at[target] = min(pending_at[target],
+                                                 items[0][0] + self.link_latency)
+                windows += 1
+            
+            # Step 3: Collect and merge every shard's statistics
+            for inbox in inboxes:
+                inbox.put(("stop",))
+            shard_stats = sorted((self._receive(outbox, workers) for _ in workers),
+                                 key=lambda reply: reply[1])
+        finally:
+            for worker in workers:
+                worker.join(timeout=5)
+                if worker.is_alive():
+                    worker.terminate()
+        wall = time.perf_counter() - wall_start
+        
+        merged = AdvancedRouter(f"{self.config.get('router', {}).get('name', 'Router')} "
+                                f"({self.shards} shards)")
+        status_counts: Dict[int, int] = {}
+        per_shard = []
+        for _, index, router, counts, forwarded, queued, late in shard_stats:
+            merged.merge_stats(router)
+            for status, count in counts.items():
+                status_counts[status] = status_counts.get(status, 0) + count
+            per_shard.append({"shard": index, "ingress_requests": len(arrivals[index]),
+                              "subnets": sum(1 for owner in self.owners.values() if owner == index),
+                              "forwarded_out": forwarded, "queued": queued, "late": late,
+                              "modeled_seconds": router.clock.now() - base})
+        latency = merged.latency.overall.snapshot()
+        modeled = max(entry["modeled_seconds"] for entry in per_shard) if per_shard else 0.0
+        report = {
+            "shards": self.shards,
+            "requests": len(requests),
+            "windows": windows,
+            "forwarded": sum(entry["forwarded_out"] for entry in per_shard),
+            "queued": sum(entry["queued"] for entry in per_shard),
+            "late": sum(entry["late"] for entry in per_shard),
+            "rate": rate,
+            "wall_seconds": wall,
+            "throughput_rps": len(requests) / wall if wall else 0.0,
+            "modeled_seconds": modeled,
+            "modeled_rps": len(requests) / modeled if modeled else 0.0,
+            "latency_ms": {k: latency[k] for k in ("mean", "p50", "p90", "p99", "p999", "max")},
+            "status_counts": {outcome_label(k): v for k, v in sorted(status_counts.items())},
+            "per_shard": per_shard,
+        }
+        return merged, report
+
+def print_shard_report(report: Dict[str, Any]):
+    """Human-readable summary of a ShardedSimulation report"""
+    latency = report["latency_ms"]
+    print(f"\n{Colors.BLUE}[SHARDS] {report['requests']:,} requests on {report['shards']} "
+          f"shards ({report['windows']:,} windows){Colors.END}")
+    print(f"  Throughput:  {report['throughput_rps']:,.0f} req/s wall | "
+          f"{report['modeled_rps']:,.1f} req/s modeled")
+    print(f"  Latency:     p50 {latency['p50']:.2f}ms | p90 {latency['p90']:.2f}ms | "
+          f"p99 {latency['p99']:.2f}ms | max {latency['max']:.2f}ms")
+    print("  Outcomes:    " + ", ".join(f"{k}={v}" for k, v in report["status_counts"].items()))
+    print(f"  Cross-shard: {report['forwarded']:,} packets forwarded, {report['late']:,} late")
+    print(f"  Queueing:    {report['queued']:,} arrivals waited for a busy router")
+    for entry in report["per_shard"]:
+        print(f"    shard {entry['shard']}: {entry['subnets']} subnets, "
+              f"{entry['ingress_requests']:,} ingress requests, "
+              f"{entry['forwarded_out']:,} forwarded out")
+
+# ========== 13. SELF-CHECKS ==========
+def check_shard_causality(seed: int = 42) -> List[str]:
+    """Sharded runs: no packet arrives in a shard's past, outcomes match one shard"""
+    domains = [domain for spec in DEMO_NETWORK["servers"] for domain in spec["domains"]]
+    requests = Workload(seed, domains, clients=50).requests(300)
+    problems = []
+    reports = {}
+    for shards in (1, 2, 3):
+        reports[shards] = ShardedSimulation(shards=shards).run(requests, rate=2.0, seed=seed)[1]
+        if reports[shards]["late"]:
+            problems.append(f"{shards} shards: {reports[shards]['late']} cross-shard packets "
+                            f"arrived in the past")
+        if shards > 1 and not reports[shards]["forwarded"]:
+            problems.append(f"{shards} shards: nothing crossed shards")
+        if reports[shards]["status_counts"] != reports[1]["status_counts"]:
+            problems.append(f"{shards} shards: outcomes {reports[shards]['status_counts']} "
+                            f"differ from one shard's {reports[1]['status_counts']}")
+    return problems
+
+def check_metrics_invariance(seed: int = 42) -> List[str]:
+    """Turning stage metrics off changes no outcome and no recorded latency"""
+    domains = [domain for spec in DEMO_NETWORK["servers"] for domain in spec["domains"]]
+    requests = Workload(seed, domains, clients=50).requests(400)
+    routers = [build_demo_router(), build_demo_router()]
+    routers[1].metrics.enabled = False
+    base = max(router.clock.now() for router in routers)
+    runs = []
+    for router in routers:
+        router.clock.sync(base)
+        random.seed(seed)  # Same transmission delays on both routers
+        batch = router.route_packets(requests[:300], collect_results=False)
+        for destination, protocol, source_ip in requests[300:]:
+            router.route_packet(destination, protocol, source_ip)
+        runs.append((batch.status_counts, router.latency.to_dict(), router.clock.now()))
+    problems = []
+    for name, on, off in zip(("outcomes", "latency histograms", "clock"), *runs):
+        if on != off:
+            problems.append(f"{name} differ with metrics off")
+    return problems
+
+def check_histogram_merge(seed: int = 42) -> List[str]:
+    """Merging histograms (also through to_dict) equals recording everything in one"""
+    rng = random.Random(seed)
+    combined = LatencyHistogram()
+    parts = [LatencyHistogram() for _ in range(4)]  # The last one stays empty
+    samples = []
+    for _ in range(20_000):
+        latency = rng.choice((0.0, rng.lognormvariate(3, 2), rng.uniform(0, 2e9)))
+        value = LatencyHistogram.quantize(latency)[0]
+        samples.append(value)
+        combined.record(latency)
+        parts[rng.randrange(3)].record(latency)
+    merged = LatencyHistogram()
+    for part in parts:
+        merged.merge(LatencyHistogram.from_dict(json.loads(json.dumps(part.to_dict()))))
+    problems = []
+    if merged.to_dict() != combined.to_dict():
+        problems.append("merged buckets differ from recording every sample in one histogram")
+    if merged.snapshot() != combined.snapshot():
+        problems.append(f"merged summary {merged.snapshot()} != {combined.snapshot()}")
+    samples.sort()
+    for percent in (50, 90, 99, 99.9):
+        exact = samples[max(1, math.ceil(percent / 100 * len(samples))) - 1] / 1000
+        estimate = merged.percentile(percent)
+        if abs(estimate - exact) > exact / LatencyHistogram.SUB_BUCKETS + 0.001:
+            problems.append(f"p{percent} is {estimate:.3f}ms, exact {exact:.3f}ms")
+    return problems
+
+SELF_CHECKS: Dict[str, Callable[[int], List[str]]] = {
+    "shard-causality": check_shard_causality,
+    "metrics-invariance": check_metrics_invariance,
+    "histogram-merge": check_histogram_merge,
+}
+
+def run_self_checks(names: Optional[List[str]] = None, seed: int = 42) -> Dict[str, List[str]]:
+    """Run the named self-checks (default: all); returns problems per check"""
+    results = {}
+    for name in names or SELF_CHECKS:
+        results[name] = SELF_CHECKS[name](seed)
+        if results[name]:
+            for problem in results[name]:
+                print(f"{Colors.RED}[FAIL] {name}: {problem}{Colors.END}")
+        else:
+            print(f"{Colors.GREEN}✅ {name}{Colors.END}")
+    return results
+
+# ========== 14. MAIN EXECUTION ==========
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(main_cli(sys.argv[1:]))
     try:
         print(f"\n{Colors.HEADER}{'='*60}{Colors.END}")
         print(f"{Colors.BLUE}{'PROJECT GLASS v2.0':^60}{Colors.END}")